@@ -0,0 +1,48 @@
+"""
+Import time benchmark of the component entry module.
+
+Each sample imports `component` in a fresh interpreter with `-X importtime` and reports the cumulative import time
+and the heavy modules loaded at import. Run from the repository root:
+
+    python benchmarks/bench_imports.py [--samples 10]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+SRC_PATH = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'src')
+HEAVY_MODULES = ['pandas', 'numpy', 'keboola.utils', 'dateparser', 'keboola.csvwriter']
+
+_PROBE = ('import sys, component; '
+          'print(",".join(m for m in {modules!r} if m in sys.modules))')
+
+
+def measure_import(module: str = 'component') -> dict:
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', _PROBE.format(modules=HEAVY_MODULES)],
+                            cwd=SRC_PATH, capture_output=True, text=True, check=True)
+    total_us = 0
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        parts = line.split('|')
+        if len(parts) == 3 and parts[2].strip() == module:
+            total_us = int(parts[1].strip())
+    loaded = [m for m in result.stdout.strip().split(',') if m]
+    return {'import_ms': total_us / 1000, 'heavy_modules_loaded': loaded}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--samples', type=int, default=10)
+    args = parser.parse_args()
+
+    samples = [measure_import() for _ in range(args.samples)]
+    times = [s['import_ms'] for s in samples]
+    print(f'component import time over {args.samples} samples: median {statistics.median(times):.1f} ms, '
+          f'min {min(times):.1f} ms, max {max(times):.1f} ms')
+    print(f'heavy modules loaded at import: {samples[-1]["heavy_modules_loaded"] or "none"}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+"""
+Write throughput of SchemaRowWriter compared to ElasticDictWriter on v3 object rows.
+
+Run from the repository root:
+
+    python benchmarks/bench_row_writer.py [--rows 200000] [--properties 40]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'src'))
+
+from keboola.csvwriter import ElasticDictWriter  # noqa: E402
+
+import row_writer  # noqa: E402
+
+
+def _rows(count: int, properties: int):
+    for i in range(count):
+        yield {'id': str(i), 'createdAt': '2021-01-01T00:00:00Z', 'archived': False,
+               'properties': {f'property_{p}': f'value {i} {p}' for p in range(properties)}}
+
+
+def _elastic(path: str, rows):
+    writer = ElasticDictWriter(path, ['id'])
+    writer.writeheader()
+    for row in rows:
+        properties = row.pop('properties', {})
+        row.update(properties)
+        writer.writerow(row)
+    writer.close()
+
+
+def _schema(path: str, rows):
+    writer = row_writer.SchemaRowWriter(path, ['id'])
+    writer.writerows(rows)
+    writer.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=200000)
+    parser.add_argument('--properties', type=int, default=40)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for name, write in (('ElasticDictWriter', _elastic), ('SchemaRowWriter', _schema)):
+            start = time.perf_counter()
+            write(os.path.join(tmp_dir, f'{name}.csv'), _rows(args.rows, args.properties))
+            elapsed = time.perf_counter() - start
+            print(f'{name}: {elapsed:.2f}s ({args.rows / elapsed:.0f} rows/s)')
+
+
+if __name__ == '__main__':
+    main()
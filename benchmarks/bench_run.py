@@ -0,0 +1,68 @@
+"""
+Deterministic benchmark of the whole component run replaying a recorded HTTP cassette.
+
+Record a cassette once with a configuration of the measured scenario (`cassette_mode` = `record` in the
+`http_settings`), then replay it against the code under test. No request leaves the process, so the timings
+compare the parsing, transformation and writing code only, or the concurrency with `--latency-factor 1`.
+
+Run from the repository root:
+
+    python benchmarks/bench_run.py path/to/config.json path/to/cassette.jsonl.gz [--samples 5] [--latency-factor 0]
+"""
+import argparse
+import json
+import logging
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'src'))
+
+from component import Component  # noqa: E402
+
+
+def _prepare_data_dir(data_dir: str, config: dict, cassette_path: str, latency_factor: float):
+    for folder in ('in/tables', 'in/files', 'out/tables', 'out/files'):
+        os.makedirs(os.path.join(data_dir, folder), exist_ok=True)
+    config = json.loads(json.dumps(config))
+    http_settings = config['parameters'].setdefault('http_settings', {})
+    http_settings['cassette_path'] = os.path.abspath(cassette_path)
+    http_settings['cassette_mode'] = 'replay'
+    http_settings['replay_latency_factor'] = latency_factor
+    with open(os.path.join(data_dir, 'config.json'), 'w') as out:
+        json.dump(config, out)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('config', help='config.json used to record the cassette')
+    parser.add_argument('cassette', help='recorded cassette')
+    parser.add_argument('--samples', type=int, default=5)
+    parser.add_argument('--latency-factor', type=float, default=0.0)
+    args = parser.parse_args()
+
+    with open(args.config) as inp:
+        config = json.load(inp)
+    logging.getLogger().setLevel(logging.WARNING)
+
+    timings = []
+    for _ in range(args.samples):
+        data_dir = tempfile.mkdtemp()
+        try:
+            _prepare_data_dir(data_dir, config, args.cassette, args.latency_factor)
+            os.environ['KBC_DATADIR'] = data_dir
+            start = time.perf_counter()
+            Component().run()
+            timings.append(time.perf_counter() - start)
+        finally:
+            shutil.rmtree(data_dir)
+
+    print(f'samples: {len(timings)}, min: {min(timings):.2f}s, median: {statistics.median(timings):.2f}s, '
+          f'max: {max(timings):.2f}s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+"""
+Memory bounded join of object rows fetched in column groups.
+
+Objects with hundreds of properties are fetched in several column groups (each request asks for a subset of the
+properties), the groups are paged independently and in parallel, so rows of the same object arrive in any order.
+The rows are collected in an in-memory buffer which is spilled into a run file sorted by the object ID whenever it
+reaches the buffer size. The runs are merged once all groups are fetched and the rows of each object are combined
+into a single row, in the order of the groups. Objects missing from some of the groups (e.g. created between
+the scans of the groups) are skipped, their row would have the columns of the missing groups empty.
+"""
+import heapq
+import json
+import os
+import tempfile
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+import typed_rows
+
+# max number of group rows kept in memory before spilling into a run file
+DEFAULT_BUFFER_SIZE = 50000
+
+
+def _id_key(value) -> Tuple[int, object]:
+    # integer ids sort numerically, other ids after them as text
+    int_value = typed_rows.to_int(value)
+    if int_value is not None:
+        return 0, int_value
+    return 1, typed_rows.format_value(value)
+
+
+def _json_default(value):
+    # numpy scalars of DataFrame records
+    if hasattr(value, 'item'):
+        return value.item()
+    return str(value)
+
+
+class ColumnGroupJoin:
+
+    def __init__(self, id_column: str, buffer_size: int = DEFAULT_BUFFER_SIZE, directory: Optional[str] = None,
+                 groups: Optional[int] = None):
+        """
+
+        Args:
+            id_column: object ID column present in the rows of all groups
+            buffer_size: max number of group rows kept in memory
+            directory: directory of the spilled run files, system temp by default
+            groups: number of the column groups, objects missing from any of them are skipped, all objects are
+                    joined if None
+        """
+        self.id_column = id_column
+        self.groups = groups
+        # number of objects skipped because they were missing from some groups
+        self.incomplete = 0
+        self._buffer_size = buffer_size
+        self._directory = directory
+        self._buffer: List[tuple] = []
+        self._runs: List[str] = []
+        self.rows_added = 0
+
+    def add(self, group: int, rows: Iterable[dict]):
+        """
+        Adds rows of a column group, rows without the ID are skipped.
+        """
+        for row in rows:
+            object_id = row.get(self.id_column)
+            if object_id is None or object_id == '':
+                continue
+            self.rows_added += 1
+            self._buffer.append((_id_key(object_id), group, self.rows_added, row))
+            if len(self._buffer) >= self._buffer_size:
+                self._spill()
+
+    def _spill(self):
+        fd, path = tempfile.mkstemp(suffix='.jsonl', dir=self._directory)
+        with os.fdopen(fd, 'w', encoding='utf-8') as out:
+            for item in sorted(self._buffer, key=lambda i: i[:3]):
+                out.write(json.dumps(item, default=_json_default) + '\n')
+        self._runs.append(path)
+        self._buffer = []
+
+    @staticmethod
+    def _read_run(path: str) -> Iterator[tuple]:
+        with open(path, 'r', encoding='utf-8') as inp:
+            for line in inp:
+                id_key, group, position, row = json.loads(line)
+                yield tuple(id_key), group, position, row
+
+    def __iter__(self) -> Iterator[dict]:
+        """
+        Yields the joined rows ordered by the object ID. Values of later groups override values of earlier groups
+        for columns present in both, repeated rows of the same group override each other in the order they were added.
+        """
+        runs = [self._read_run(r) for r in self._runs]
+        buffered = sorted(self._buffer, key=lambda i: i[:3])
+        current_key = None
+        joined = None
+        joined_groups = set()
+        for id_key, group, _, row in heapq.merge(buffered, *runs, key=lambda i: i[:3]):
+            if id_key != current_key:
+                if joined is not None and self._is_complete(joined_groups):
+                    yield joined
+                current_key = id_key
+                joined = {}
+                joined_groups = set()
+            joined.update(row)
+            joined_groups.add(group)
+        if joined is not None and self._is_complete(joined_groups):
+            yield joined
+
+    def _is_complete(self, joined_groups: set) -> bool:
+        if self.groups is None or len(joined_groups) >= self.groups:
+            return True
+        self.incomplete += 1
+        return False
+
+    def close(self):
+        for path in self._runs:
+            os.remove(path)
+        self._runs = []
+        self._buffer = []
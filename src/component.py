@@ -2,21 +2,48 @@
 Template Component main class.
 
 '''
+from __future__ import annotations
+
+import copy
+import functools
+import itertools
 import json
 import logging
 import os
 import sys
+import time
 import warnings
-from typing import Dict, List
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime
+from typing import TYPE_CHECKING, Callable, Dict, Iterable, List, Optional, Tuple
 
-import keboola.csvwriter
-import keboola.utils as kbcutils
-import pandas as pd
 from keboola.component import ComponentBase
-from keboola.csvwriter import ElasticDictWriter
 
-from hubspot_api.client_service import HubspotClientService, CONTACTS_DEFAULT_COLS
+from hubspot_api import cassette, parallel, recovery, transport
+from hubspot_api.client_service import (HubspotClientService, CONTACTS_DEFAULT_COLS, COMPANIES_ENDPOINTS,
+                                        CONTACT_DEFAULT_PROPERTIES, CONTACTS_ENDPOINTS, LIST_CONTACTS,
+                                        MARKETING_EMAILS_STATISTICS, OWNERS, PIPELINES)
+import column_join
+import dedupe
+import edge_set
+import memory_governor
+import planner
+import profiling
+import property_history
+import reference_cache
+import row_writer
+import typed_rows
 from json_parser import FlattenJsonParser
+from lazy_import import LazyModule
+
+if TYPE_CHECKING:
+    import pandas as pd
+    from keboola.csvwriter import ElasticDictWriter
+else:
+    # heavy modules, imported only when an endpoint that needs them runs
+    pd = LazyModule('pandas')
+kbcutils = LazyModule('keboola.utils')
+csvwriter = LazyModule('keboola.csvwriter')
 
 ENGAGEMENT_ASSOC_COLS = ["contactIds",
                          "companyIds",
@@ -30,6 +57,7 @@ PIPELINE_STAGE_PK = ['pipelineId', 'stageId']
 PIPELINE_PK = ['pipelineId']
 OWNER_PK = ['ownerId']
 LISTS_PK = ['listId']
+LIST_MEMBERSHIP_PK = ['list_id', 'contact_vid']
 ACTIVITIES_PK = ['engagement_id ']
 EMAIL_EVENTS_PK = ['id', 'created']
 CAMPAIGNS_PK = ['id']
@@ -50,8 +78,40 @@ KEY_COMPANY_PROPERTIES = 'company_properties'
 KEY_CONTACT_PROPERTIES = 'contact_properties'
 KEY_DEAL_PROPERTIES = 'deal_properties'
 KEY_PROPERTY_ATTRIBUTES = "property_attributes"
+KEY_VERSIONS_AS_TABLE = 'versions_as_table'
+KEY_INCREMENTAL_PARSING = 'incremental_json_parsing'
+KEY_ADAPTIVE_PAGE_SIZE = 'adaptive_page_size'
+KEY_HTTP_SETTINGS = 'http_settings'
+KEY_ERROR_RECOVERY = 'error_recovery'
+KEY_COMPANIES_INCREMENTAL_SYNC = 'companies_incremental_sync'
+KEY_CONTACTS_INCREMENTAL_SYNC = 'contacts_incremental_sync'
+KEY_DEDUPLICATE_OUTPUT = 'deduplicate_output'
+KEY_ACTIVITY_COLUMNS = 'activity_columns'
+KEY_ACTIVITY_INCLUDE_BODY = 'activity_include_body'
+KEY_ACTIVITIES_PARALLEL_SCAN = 'activities_parallel_scan'
+KEY_LIST_MEMBERSHIP_IDS = 'list_membership_ids'
+KEY_PORTALS = 'portals'
+KEY_MAX_PARALLEL_PORTALS = 'max_parallel_portals'
+KEY_DRY_RUN = 'dry_run'
+KEY_PROPERTY_GROUP_SIZE = 'property_group_size'
+KEY_ENGAGEMENT_ASSOCIATIONS = 'engagement_associations'
+KEY_ENGAGEMENT_ASSOCIATIONS_MODE = 'engagement_associations_mode'
+KEY_REFERENCE_CACHE = 'reference_cache'
+KEY_MEMORY_GOVERNOR = 'memory_governor'
+
+# state keys
+STATE_TABLE_SCHEMAS = 'table_schemas'
+STATE_COMPANIES_LAST_MODIFIED = 'companies_last_modified'
+STATE_CONTACTS_LAST_MODIFIED = 'contacts_last_modified'
+STATE_EMAIL_STATISTICS_UPDATED = 'marketing_email_statistics_updated'
+STATE_LISTS_UPDATED_AT = 'lists_updated_at'
+STATE_PORTALS = 'portals'
+STATE_ENDPOINT_STATS = 'endpoint_stats'
+STATE_PROPERTY_NAMES = 'property_names'
+STATE_REFERENCE_HASHES = 'reference_hashes'
 # for debug
 KEY_STDLOG = 'stdlogging'
+KEY_PROFILING = 'profiling'
 
 SUPPORTED_ENDPOINTS = ['companies', 'campaigns', 'email_events', 'activities', 'lists', 'owners', 'contacts', 'deals',
                        'pipelines']
@@ -59,6 +119,25 @@ SUPPORTED_ENDPOINTS = ['companies', 'campaigns', 'email_events', 'activities', '
 MANDATORY_PARS = []
 MANDATORY_IMAGE_PARS = []
 
+DEFAULT_MAX_PARALLEL_PORTALS = 4
+
+# property selection resolved to all properties of the object
+ALL_PROPERTIES = 'all'
+# max number of properties requested at once, longer property lists are fetched in column groups
+DEFAULT_PROPERTY_GROUP_SIZE = 50
+PROPERTY_NAMES_CACHE_TTL_S = 24 * 3600
+# number of joined rows per page passed on from the column groups join
+JOINED_PAGE_SIZE = 1000
+
+# engagement associations returned with the objects or read by v4 batch requests pipelined with the paging
+ASSOCIATIONS_INLINE = 'inline'
+ASSOCIATIONS_BATCH = 'batch'
+# max number of object IDs of a v4 association batch read
+ASSOCIATIONS_BATCH_SIZE = 100
+# object types of the v4 associations API, inline associations are keyed by the plural form
+ASSOCIATION_OBJECT_TYPES = {'calls': 'call', 'emails': 'email', 'meetings': 'meeting', 'contacts': 'contact',
+                            'companies': 'company', 'deals': 'deal', 'tickets': 'ticket'}
+
 # columns
 CONTACT_FORM_SUBISSION_COLS = ["contact-associated-by", "conversion-id", "form-id", "form-type", "meta-data",
                                "page-id", "page-url", "portal-id", "timestamp", "title", KEY_CONTACT_VID]
@@ -66,6 +145,18 @@ CONTACT_PROFILES_COLS = ["vid", "saved-at-timestamp", KEY_CONTACT_VID, 'identity
 CONTACT_PROFILE_IDENTITIES_COLS = ['type', 'value', 'timestamp', 'is-primary', 'identity_profile_pk']
 CONTACT_LISTS_COLS = ["internal-list-id", "is-member", "static-list-id", "timestamp", "vid", KEY_CONTACT_VID]
 DEAL_STAGE_HIST_COLS = ['name', 'source', 'sourceId', 'sourceVid', 'timestamp', 'value', 'dealId']
+# compact in-memory types of the child table and association columns, ENUM only for columns with a few distinct
+# values (each distinct value is kept for the whole run), other columns are TEXT
+CHILD_COLUMN_TYPES = {
+    'dealId': typed_rows.INT, 'associated_dealId': typed_rows.INT, 'associated_companyId': typed_rows.INT,
+    'contact_vid': typed_rows.INT, KEY_CONTACT_VID: typed_rows.INT, 'vid': typed_rows.INT,
+    'internal-list-id': typed_rows.INT, 'static-list-id': typed_rows.INT, 'list_id': typed_rows.INT,
+    'portal-id': typed_rows.INT, 'timestamp': typed_rows.INT, 'added_at': typed_rows.INT,
+    'from_id': typed_rows.INT, 'to_id': typed_rows.INT,
+    'from_type': typed_rows.ENUM, 'to_type': typed_rows.ENUM, 'association_types': typed_rows.ENUM,
+    'association_categories': typed_rows.ENUM,
+    'is-member': typed_rows.ENUM, 'name': typed_rows.ENUM, 'source': typed_rows.ENUM, 'form-type': typed_rows.ENUM,
+    'contact-associated-by': typed_rows.ENUM}
 
 ENGAGEMENT_COLS = [
     "id",
@@ -101,14 +192,28 @@ class Component(ComponentBase):
             exit(1)
 
         self.incremental = self.configuration.parameters.get(KEY_INCR_OUT)
-        state = self.get_state_file() or {}
-        self._object_schemas: dict = state.get('table_schemas') or {}
+        self._state: dict = self.get_state_file() or {}
+        self._object_schemas: dict = self._state.get(STATE_TABLE_SCHEMAS) or {}
 
         # If _object_schemas is empty list [], then it will stay a list instead of being a dict.
         if not self._object_schemas:
             self._object_schemas = {}
 
         self._writer_cache: Dict[str, ElasticDictWriter] = {}
+        # association tables collected during the run and written once at the end
+        self._edge_sets: Dict[str, edge_set.EdgeSet] = {}
+        self._edge_set_pks: Dict[str, List[str]] = {}
+        # (column, values) of rows deleted from the Storage table before the incremental load of an association table
+        self._edge_set_delete_where: Dict[str, Tuple[str, List[str]]] = {}
+        # run statistics logged at the end of the run
+        self._run_metrics: dict = {}
+        # prefix of the output table names, set per portal in the multi-portal mode
+        self._table_prefix = ''
+        # portal ID known upfront in the multi-portal mode
+        self._portal_id: Optional[str] = None
+        self._profiler = profiling.StageProfiler()
+        # shared by all portals of the run
+        self._memory_governor: Optional[memory_governor.MemoryGovernor] = None
 
     def run(self):
         '''
@@ -116,6 +221,36 @@ class Component(ComponentBase):
         '''
         params = self.configuration.parameters  # noqa
 
+        profiling_settings = params.get(KEY_PROFILING) or {}
+        sampler = None
+        if profiling_settings.get('enabled') and profiling_settings.get('sampling'):
+            sampler = profiling.SamplingProfiler(profiling_settings.get('sampling_interval_ms')
+                                                 or profiling.DEFAULT_SAMPLING_INTERVAL_MS)
+            sampler.start()
+        self._start_memory_governor(params.get(KEY_MEMORY_GOVERNOR) or {})
+
+        try:
+            if params.get(KEY_DRY_RUN):
+                self._dry_run(params)
+            elif params.get(KEY_PORTALS):
+                self._run_portals(params, params[KEY_PORTALS])
+            else:
+                token, authentication_type = self._get_token(params)
+                self._extract(params, token, authentication_type, params.get(KEY_HTTP_SETTINGS) or {})
+        finally:
+            if sampler:
+                sampler.stop()
+                self._write_profile_file('profile.folded', sampler.write_folded)
+            if self._memory_governor:
+                self._memory_governor.stop()
+                self._run_metrics['memory'] = self._memory_governor.stats()
+
+        self._state[STATE_TABLE_SCHEMAS] = self._object_schemas
+        self.write_state_file(self._state)
+        self._log_run_metrics()
+
+    @staticmethod
+    def _get_token(params: dict) -> Tuple[str, str]:
         authentication_type = params.get("authentication_type", "API Key")
         if authentication_type == "API Key":
             token = params[KEY_API_TOKEN]
@@ -123,38 +258,154 @@ class Component(ComponentBase):
             token = params['#private_app_token']
         else:
             raise ValueError(f'Invalid authentication type "{authentication_type}"')
+        return token, authentication_type
+
+    @staticmethod
+    def _get_portal_http_settings(params: dict, portal: dict) -> dict:
+        http_settings = dict(params.get(KEY_HTTP_SETTINGS) or {})
+        if portal.get('max_requests_per_second'):
+            http_settings['max_requests_per_second'] = portal['max_requests_per_second']
+        if http_settings.get('cassette_path'):
+            # each portal records into / replays from its own cassette
+            cassette_dir, cassette_name = os.path.split(http_settings['cassette_path'])
+            http_settings['cassette_path'] = os.path.join(cassette_dir, f"portal_{portal['portal_id']}_{cassette_name}")
+        return http_settings
+
+    @staticmethod
+    def _get_start_date(params: dict) -> Tuple[Optional[datetime], bool]:
+        """
+        Returns the start of the `period_from` window and whether the recent endpoints are used.
+        """
+        if not params.get(KEY_PERIOD_FROM):
+            return None, False
+        import dateparser
+        period = params.get(KEY_PERIOD_FROM)
+        if not dateparser.parse(period):
+            raise ValueError(F'Invalid date from period "{period}", check the supported format')
+        start_date, end_date = kbcutils.parse_datetime_interval(period, 'now')
+        logging.info(f"Getting data since: {period}")
+        return start_date, True
+
+    def _run_portals(self, params: dict, portals: List[dict]):
+        """
+        Extracts several portals in parallel. Each portal has its own HTTP transport, so also its own connection
+        pool and request rate budget, its output tables are prefixed by `portal_<portalId>_` and its state
+        is kept under the portal ID.
+        """
+        portal_states = self._state.get(STATE_PORTALS) or {}
+
+        def extract_portal(portal: dict) -> Component:
+            portal_id = str(portal['portal_id'])
+            worker = self._for_portal(portal_id, portal_states.get(portal_id) or {})
+            logging.info(f'Extracting portal {portal_id}')
+            worker._extract(params, portal['#token'], portal.get('authentication_type', 'Private App Token'),
+                            self._get_portal_http_settings(params, portal))
+            return worker
+
+        max_workers = params.get(KEY_MAX_PARALLEL_PORTALS) or DEFAULT_MAX_PARALLEL_PORTALS
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            workers = list(executor.map(extract_portal, portals))
+
+        portal_metrics = self._run_metrics.setdefault('portals', {})
+        for portal, worker in zip(portals, workers):
+            portal_id = str(portal['portal_id'])
+            worker._state[STATE_TABLE_SCHEMAS] = worker._object_schemas
+            portal_states[portal_id] = worker._state
+            portal_metrics[portal_id] = worker._run_metrics
+        self._state[STATE_PORTALS] = portal_states
+
+    def _for_portal(self, portal_id: str, portal_state: dict) -> Component:
+        """
+        Returns a copy of the component extracting a single portal of the multi-portal mode.
+        """
+        worker = copy.copy(self)
+        worker._table_prefix = f'portal_{portal_id}_'
+        worker._portal_id = portal_id
+        worker._state = portal_state
+        worker._object_schemas = portal_state.get(STATE_TABLE_SCHEMAS) or {}
+        worker._writer_cache = {}
+        worker._edge_sets = {}
+        worker._edge_set_pks = {}
+        worker._edge_set_delete_where = {}
+        worker._run_metrics = {}
+        return worker
+
+    def _extract(self, params: dict, token: str, authentication_type: str, http_settings: dict):
+        """
+        Extracts all configured endpoints of a single portal.
+        """
+        self._profiler = profiling.StageProfiler(enabled=(params.get(KEY_PROFILING) or {}).get('enabled', False))
+        http_transport = self._build_transport(http_settings)
+        http_transport.request_timer = functools.partial(self._profiler.stage, profiling.STAGE_FETCH)
+        client_service = HubspotClientService(token, authentication_type=authentication_type,
+                                              stream_json=params.get(KEY_INCREMENTAL_PARSING, False),
+                                              adaptive_page_size=params.get(KEY_ADAPTIVE_PAGE_SIZE, False),
+                                              transport=http_transport,
+                                              page_recovery=self._build_page_recovery(
+                                                  params.get(KEY_ERROR_RECOVERY) or {}))
+        memory_handlers = (functools.partial(self._on_memory_pressure, client_service),
+                           functools.partial(self._on_memory_relief, client_service))
+        if self._memory_governor:
+            self._memory_governor.add_handlers(*memory_handlers)
 
-        client_service = HubspotClientService(token, authentication_type=authentication_type)
-
-        if params.get(KEY_PERIOD_FROM):
-            import dateparser
-            period = params.get(KEY_PERIOD_FROM)
-            if not dateparser.parse(period):
-                raise ValueError(F'Invalid date from period "{period}", check the supported format')
-            start_date, end_date = kbcutils.parse_datetime_interval(period, 'now')
-            recent = True
-            logging.info(f"Getting data since: {period}")
-        else:
-            start_date = None
-            recent = False
-
+        try:
+            self._extract_endpoints(params, client_service)
+            self._run_metrics['page_sizes'] = client_service.get_page_size_stats()
+            self._store_endpoint_stats(self._run_metrics['page_sizes'])
+            self._run_metrics['http'] = client_service.get_transport_stats()
+            self._run_metrics['error_recovery'] = client_service.get_recovery_stats()
+            self._write_failed_pages(client_service.get_failed_pages())
+        finally:
+            # completes the cassette in the record mode, also with the responses recorded up to a failure
+            client_service.transport.close()
+        self._start_endpoint('association_tables')
+        self._write_edge_sets()
+        self._close_files()
+        self._profiler.stop()
+        if self._memory_governor:
+            self._memory_governor.end_endpoint()
+            self._memory_governor.remove_handlers(*memory_handlers)
+        if self._profiler.enabled:
+            self._run_metrics['profile'] = self._profiler.breakdown()
+            self._write_profile_file('profile_stages.csv', self._profiler.write_breakdown)
+
+    def _extract_endpoints(self, params: dict, client_service: HubspotClientService):
+        """
+        Extracts the configured endpoints with the client of the portal.
+        """
+        start_date, recent = self._get_start_date(params)
         endpoints = params.get(KEY_ENDPOINTS, SUPPORTED_ENDPOINTS)
         property_attributes = params.get(KEY_PROPERTY_ATTRIBUTES,
                                          {"include_versions": True, "include_source": True, "include_timestamp": True})
 
         if 'companies' in endpoints:
+            self._start_endpoint('companies')
             logging.info('Extracting Companies')
-            res_file_path = os.path.join(self.tables_out_path, 'companies.csv')
-            self._get_simple_ds(res_file_path, COMPANY_ID_COL, client_service.get_companies, property_attributes,
-                                recent, self._parse_props(params.get(KEY_COMPANY_PROPERTIES)))
+            res_file_path = self._get_out_path('companies.csv')
+            fields = self._resolve_properties(client_service, 'companies',
+                                              self._parse_props(params.get(KEY_COMPANY_PROPERTIES)))
+            if params.get(KEY_COMPANIES_INCREMENTAL_SYNC):
+                def fetch_companies(group_fields: List[str], primary: bool) -> Iterable[pd.DataFrame]:
+                    return self._get_companies_incremental(client_service, start_date, group_fields,
+                                                           property_attributes)
+            else:
+                def fetch_companies(group_fields: List[str], primary: bool) -> Iterable[pd.DataFrame]:
+                    return client_service.get_companies(property_attributes, recent, group_fields)
+            companies = self._get_in_column_groups(
+                fetch_companies, fields, 'companyId', 'hs_lastmodifieddate',
+                STATE_COMPANIES_LAST_MODIFIED if params.get(KEY_COMPANIES_INCREMENTAL_SYNC) else None)
+            self._get_simple_ds(res_file_path, COMPANY_ID_COL, self._split_property_history, companies,
+                                property_attributes, 'companies', 'companyId', version_column='hs_lastmodifieddate')
 
         if 'campaigns' in endpoints:
+            self._start_endpoint('campaigns')
             logging.info('Extracting Campaigns from HubSpot CRM')
-            res_file_path = os.path.join(self.tables_out_path, 'campaigns.csv')
+            res_file_path = self._get_out_path('campaigns.csv')
             self._get_simple_ds(res_file_path, CAMPAIGNS_PK, client_service.get_campaigns, recent)
 
         email_events = [e for e in endpoints if e.startswith('email_events')]
         if email_events:
+            self._start_endpoint('email_events')
             email_events = set(email_events)
             # backward compatibility
             if "email_events" in email_events:
@@ -165,82 +416,332 @@ class Component(ComponentBase):
             logging.info('Extracting Email Events from HubSpot CRM')
 
             events_list = [e.split('-')[1] for e in email_events]
-            res_file_path = os.path.join(self.tables_out_path, 'email_events.csv')
+            res_file_path = self._get_out_path('email_events.csv')
             self._get_simple_ds(res_file_path, EMAIL_EVENTS_PK, client_service.get_email_events, start_date,
                                 events_list)
 
         if 'activities' in endpoints:
+            self._start_endpoint('activities')
             logging.info('Extracting Activities from HubSpot CRM')
-            res_file_path = os.path.join(self.tables_out_path, 'activities.csv')
-            self._get_simple_ds(res_file_path, ACTIVITIES_PK, client_service.get_activities, start_date)
+            res_file_path = self._get_out_path('activities.csv')
+            if params.get(KEY_ACTIVITIES_PARALLEL_SCAN):
+                activities_getter = client_service.get_activities_parallel
+            else:
+                activities_getter = client_service.get_activities
+            self._get_simple_ds(res_file_path, ACTIVITIES_PK, activities_getter, start_date,
+                                params.get(KEY_ACTIVITY_INCLUDE_BODY, False),
+                                self._parse_props(params.get(KEY_ACTIVITY_COLUMNS)),
+                                version_column='engagement_lastUpdated')
 
         if 'lists' in endpoints:
+            self._start_endpoint('lists')
             logging.info('Extracting Lists from HubSpot CRM')
-            res_file_path = os.path.join(self.tables_out_path, 'lists.csv')
+            res_file_path = self._get_out_path('lists.csv')
             self._get_simple_ds(res_file_path, LISTS_PK, client_service.get_lists)
 
+        if 'list_memberships' in endpoints:
+            self._start_endpoint('list_memberships')
+            logging.info('Extracting List memberships from HubSpot CRM')
+            self.get_list_memberships(client_service, self._parse_props(params.get(KEY_LIST_MEMBERSHIP_IDS)))
+
         if 'owners' in endpoints:
+            self._start_endpoint('owners')
             logging.info('Extracting Owners from HubSpot CRM')
-            res_file_path = os.path.join(self.tables_out_path, 'owners.csv')
-            self._get_simple_ds(res_file_path, OWNER_PK, client_service.get_owners, recent)
+            owners = self._get_reference_objects(client_service, 'owners_with_inactive' if recent else 'owners',
+                                                 lambda: client_service.get_owners(recent), OWNERS)
+            if owners is not None:
+                self._download_reference_objects(owners, 'owners', OWNER_PK)
 
         if 'contacts' in endpoints:
+            self._start_endpoint('contacts')
             logging.info('Extracting Contacts from HubSpot CRM')
-            self.get_contacts(client_service, start_date, self._parse_props(params.get(KEY_CONTACT_PROPERTIES)),
-                              property_attributes, params.get('include_contact_list_membership', True))
+            self.get_contacts(client_service, start_date,
+                              self._resolve_properties(client_service, 'contacts',
+                                                       self._parse_props(params.get(KEY_CONTACT_PROPERTIES))),
+                              property_attributes, params.get('include_contact_list_membership', True),
+                              params.get(KEY_CONTACTS_INCREMENTAL_SYNC, False))
 
         if 'deals' in endpoints:
+            self._start_endpoint('deals')
             logging.info('Extracting Deals from HubSpot CRM')
-            self.get_deals(client_service, start_date, self._parse_props(params.get(KEY_DEAL_PROPERTIES)),
+            self.get_deals(client_service, start_date,
+                           self._resolve_properties(client_service, 'deals',
+                                                    self._parse_props(params.get(KEY_DEAL_PROPERTIES))),
                            property_attributes)
 
         if 'pipelines' in endpoints:
+            self._start_endpoint('pipelines')
             logging.info('Extracting Pipelines from HubSpot CRM')
-            self.get_pipelines(client_service)
+            pipelines = self._get_reference_objects(client_service, 'pipelines', client_service.get_pipelines,
+                                                    PIPELINES)
+            if pipelines is not None:
+                self.get_pipelines(pipelines)
 
         if 'dispositions' in endpoints:
+            self._start_endpoint('dispositions')
             logging.info('Extracting Engagement Dispositons from HubSpot CRM')
-            res_file_path = os.path.join(self.tables_out_path, 'engagement-dispositions.csv')
-            self._get_simple_ds(res_file_path, ['id'], client_service.get_owners, recent)
+            self._download_reference_objects(client_service.get_owners(recent), 'engagement-dispositions', ['id'])
 
+        engagement_associations = params.get(KEY_ENGAGEMENT_ASSOCIATIONS) or []
+        associations_mode = params.get(KEY_ENGAGEMENT_ASSOCIATIONS_MODE) or ASSOCIATIONS_INLINE
         if 'calls' in endpoints:
+            self._start_endpoint('calls')
             logging.info('Extracting Calls HubSpot CRM')
             self._dowload_crm_v3_object(client_service, 'calls',
-                                        properties=self._parse_props(params.get('call_properties', [])))
+                                        properties=self._parse_props(params.get('call_properties', [])),
+                                        associations=engagement_associations, associations_mode=associations_mode)
 
         if 'emails' in endpoints:
+            self._start_endpoint('emails')
             logging.info('Extracting Emails HubSpot CRM')
             self._dowload_crm_v3_object(client_service, 'emails',
-                                        properties=self._parse_props(params.get('email_properties', [])))
+                                        properties=self._parse_props(params.get('email_properties', [])),
+                                        associations=engagement_associations, associations_mode=associations_mode)
 
         if 'meetings' in endpoints:
+            self._start_endpoint('meetings')
             logging.info('Extracting Meetings HubSpot CRM')
             self._dowload_crm_v3_object(client_service, 'meetings',
-                                        properties=self._parse_props(params.get('meeting_properties', [])))
+                                        properties=self._parse_props(params.get('meeting_properties', [])),
+                                        associations=engagement_associations, associations_mode=associations_mode)
         if 'forms' in endpoints:
+            self._start_endpoint('forms')
             logging.info('Extracting Forms HubSpot CRM')
             parser = FlattenJsonParser(child_separator='__', exclude_fields=['displayOptions'],
                                        keys_to_ignore=['fieldGroups'])
             self._download_v3_parsed(client_service.get_forms, parser, 'forms')
 
         if 'marketing_email_statistics' in endpoints:
+            self._start_endpoint('marketing_email_statistics')
             logging.info('Extracting marketing_email_statistics HubSpot')
             parser = FlattenJsonParser(child_separator='__', exclude_fields=['smartEmailFields'],
                                        keys_to_ignore=['styleSettings'])
-            updated_since = None
-            if start_date:
+            # incremental since the last seen update unless the result table is fully loaded
+            updated_since = self._state.get(STATE_EMAIL_STATISTICS_UPDATED) if self.incremental else None
+            if not updated_since and start_date:
                 updated_since = int(start_date.timestamp() * 1000)
-            self._download_v3_parsed(client_service.get_email_statistics, parser, 'marketing_email_statistics',
-                                     updated_since=updated_since)
+            self._download_v3_parsed(self._get_email_statistics, parser, 'marketing_email_statistics',
+                                     client=client_service, updated_since=updated_since)
 
-        self._close_files()
+    def _start_endpoint(self, name: str):
+        """
+        Starts measuring the stages and the memory usage of the next endpoint.
+        """
+        self._profiler.start_endpoint(name)
+        if self._memory_governor:
+            self._memory_governor.start_endpoint(self._table_prefix + name)
+
+    # MEMORY
+    def _start_memory_governor(self, settings: dict):
+        if not settings.get('enabled'):
+            return
+        ceiling_mb = settings.get('ceiling_mb')
+        ceiling = ceiling_mb * memory_governor.MB if ceiling_mb else memory_governor.container_memory_limit()
+        if ceiling is None:
+            logging.warning('Memory ceiling is not set and the container memory is not limited, '
+                            'only the memory usage is measured')
+        self._memory_governor = memory_governor.MemoryGovernor(
+            ceiling, pressure_ratio=settings.get('pressure_ratio') or memory_governor.DEFAULT_PRESSURE_RATIO)
+        self._memory_governor.add_handlers(parallel.pause_fetch_ahead, parallel.resume_fetch_ahead)
+        self._memory_governor.start()
+
+    def _on_memory_pressure(self, client: HubspotClientService):
+        client.limit_page_sizes()
+        for edges in list(self._edge_sets.values()):
+            edges.shrink_buffer()
+
+    def _on_memory_relief(self, client: HubspotClientService):
+        client.release_page_sizes()
+        for edges in list(self._edge_sets.values()):
+            edges.restore_buffer()
+
+    def _write_profile_file(self, name: str, write: Callable[[str], None]):
+        """
+        Writes a profiling output file tagged `profile`.
+        """
+        file_def = self.create_out_file_definition(self._table_prefix + name, tags=['profile'])
+        os.makedirs(os.path.dirname(file_def.full_path), exist_ok=True)
+        write(file_def.full_path)
+        self.write_manifest(file_def)
+
+    def _store_endpoint_stats(self, page_size_stats: Dict[str, dict]):
+        """
+        Keeps the volume and latency of each endpoint in the state for the dry-run planner.
+        """
+        endpoint_stats = self._state.setdefault(STATE_ENDPOINT_STATS, {})
+        for endpoint, stats in page_size_stats.items():
+            if stats['pages']:
+                endpoint_stats[endpoint] = {'pages': stats['pages'], 'records': stats['records'],
+                                            'avg_latency_s': stats['avg_latency_s']}
+
+    # DRY RUN
+    def _dry_run(self, params: dict):
+        """
+        Writes the expected records, pages, requests and duration of each configured endpoint into the run_plan
+        table instead of extracting the data. The incremental state is kept unchanged.
+        """
+        plans = []
+        if params.get(KEY_PORTALS):
+            portal_states = self._state.get(STATE_PORTALS) or {}
+            for portal in params[KEY_PORTALS]:
+                portal_id = str(portal['portal_id'])
+                portal_plans, summary = self._plan_portal(params, portal['#token'],
+                                                          portal.get('authentication_type', 'Private App Token'),
+                                                          self._get_portal_http_settings(params, portal),
+                                                          portal_states.get(portal_id) or {})
+                plans.extend({'portal_id': portal_id, **plan} for plan in portal_plans)
+                self._run_metrics.setdefault('run_plan', {})[portal_id] = summary
+        else:
+            token, authentication_type = self._get_token(params)
+            plans, self._run_metrics['run_plan'] = self._plan_portal(params, token, authentication_type,
+                                                                     params.get(KEY_HTTP_SETTINGS) or {},
+                                                                     self._state)
+
+        result_table = self.create_out_table_definition('run_plan.csv', incremental=False)
+        # not written through the writer cache, its schemas are stored in the state used by the real runs
+        writer = csvwriter.ElasticDictWriter(result_table.full_path, list(planner.PLAN_COLS))
+        writer.writeheader()
+        for plan in plans:
+            logging.info(f'Plan: {json.dumps(plan)}')
+            writer.writerow(plan)
+        writer.close()
+        self.write_manifest(result_table)
+
+    def _plan_portal(self, params: dict, token: str, authentication_type: str, http_settings: dict,
+                     state: dict) -> Tuple[List[dict], dict]:
+        """
+        Plans the endpoints of a single portal, taking the same full / recent / incremental paths as the run.
+        """
+        client = HubspotClientService(token, authentication_type=authentication_type,
+                                      transport=self._build_transport(http_settings))
+        run_planner = planner.RunPlanner(state.get(STATE_ENDPOINT_STATS) or {},
+                                         http_settings.get('max_requests_per_second'))
+        start_date, recent = self._get_start_date(params)
+        start_ms = int(start_date.timestamp() * 1000) if start_date else None
+        endpoints = params.get(KEY_ENDPOINTS, SUPPORTED_ENDPOINTS)
+
+        if 'companies' in endpoints:
+            modified_since = state.get(STATE_COMPANIES_LAST_MODIFIED) or start_ms
+            if params.get(KEY_COMPANIES_INCREMENTAL_SYNC) and modified_since:
+                run_planner.add('companies', 'incremental', lambda: client.count_objects('companies', modified_since))
+            elif recent:
+                run_planner.add('companies', 'recent', lambda: client.count_objects('companies', start_ms))
+            else:
+                run_planner.add('companies', 'full', lambda: client.count_objects('companies'))
+
+        if 'campaigns' in endpoints:
+            # details of each campaign are requested separately
+            run_planner.add('campaigns', 'recent' if recent else 'full', requests_per_record=1)
+
+        if any(e.startswith('email_events') for e in endpoints):
+            run_planner.add('email_events', 'recent' if start_date else 'full')
+
+        if 'activities' in endpoints:
+            # the full scan is never partitioned
+            workers = parallel.DEFAULT_WORKERS if params.get(KEY_ACTIVITIES_PARALLEL_SCAN) and start_date else 1
+            run_planner.add('activities', 'recent' if start_date else 'full',
+                            lambda: client.count_activities(start_ms), workers=workers)
 
-    def _get_simple_ds(self, res_file_path, pkey, ds_getter, *fpars):
+        if 'lists' in endpoints:
+            run_planner.add('lists', 'full')
+
+        if 'list_memberships' in endpoints:
+            incremental = self.incremental and state.get(STATE_LISTS_UPDATED_AT)
+            run_planner.add('list_memberships', 'incremental' if incremental else 'full',
+                            workers=parallel.DEFAULT_WORKERS)
+
+        if 'owners' in endpoints:
+            run_planner.add('owners', 'full')
+
+        if 'contacts' in endpoints:
+            modified_since = state.get(STATE_CONTACTS_LAST_MODIFIED) or start_ms
+            # a batch associations request per page and associated object type
+            associations = len(params.get('contact_associations') or [])
+            if params.get(KEY_CONTACTS_INCREMENTAL_SYNC) and modified_since:
+                run_planner.add('contacts', 'incremental', lambda: client.count_objects('contacts', modified_since),
+                                requests_per_page=associations)
+            elif start_date and (datetime.utcnow() - start_date).days < 30:
+                run_planner.add('contacts', 'recent', lambda: client.count_objects('contacts', start_ms),
+                                requests_per_page=associations)
+            else:
+                run_planner.add('contacts', 'full', lambda: client.count_objects('contacts'),
+                                requests_per_page=associations)
+
+        if 'deals' in endpoints:
+            if start_date:
+                run_planner.add('deals', 'recent', lambda: client.count_objects('deals', start_ms))
+            else:
+                run_planner.add('deals', 'full', lambda: client.count_objects('deals'))
+
+        if 'pipelines' in endpoints:
+            run_planner.add('pipelines', 'full')
+
+        # a v4 batch read per page and associated object type in the batch mode
+        association_reads = 0
+        if params.get(KEY_ENGAGEMENT_ASSOCIATIONS_MODE) == ASSOCIATIONS_BATCH:
+            association_reads = len(params.get(KEY_ENGAGEMENT_ASSOCIATIONS) or [])
+        for object_type in ('calls', 'emails', 'meetings'):
+            if object_type in endpoints:
+                run_planner.add(object_type, 'full', functools.partial(client.count_objects, object_type),
+                                requests_per_page=association_reads)
+
+        if 'forms' in endpoints:
+            run_planner.add('forms', 'full')
+
+        if 'marketing_email_statistics' in endpoints:
+            incremental = (self.incremental and state.get(STATE_EMAIL_STATISTICS_UPDATED)) or start_date
+            run_planner.add('marketing_email_statistics', 'incremental' if incremental else 'full',
+                            workers=parallel.DEFAULT_WORKERS)
+
+        client.transport.close()
+        return run_planner.plans, run_planner.summary()
+
+    def _build_transport(self, http_settings: dict) -> transport.HttpTransport:
+        transport_settings = dict(
+            pool_size=http_settings.get('pool_size') or transport.DEFAULT_POOL_SIZE,
+            connect_timeout=http_settings.get('connect_timeout') or transport.DEFAULT_CONNECT_TIMEOUT,
+            read_timeout=http_settings.get('read_timeout') or transport.DEFAULT_READ_TIMEOUT,
+            keep_alive=http_settings.get('keep_alive', True),
+            max_requests_per_second=http_settings.get('max_requests_per_second'))
+        if not http_settings.get('cassette_path'):
+            return transport.HttpTransport(**transport_settings)
+
+        # relative cassette paths are resolved against the data folder
+        cassette_path = os.path.join(self.data_folder_path, http_settings['cassette_path'])
+        mode = http_settings.get('cassette_mode') or cassette.MODE_REPLAY
+        logging.info(f'HTTP cassette {mode} mode, cassette: {cassette_path}')
+        return cassette.CassetteTransport(cassette_path, mode=mode,
+                                          latency_factor=http_settings.get('replay_latency_factor') or 0.0,
+                                          redact_fields=(http_settings.get('cassette_redact_fields')
+                                                         or cassette.DEFAULT_REDACT_FIELDS),
+                                          **transport_settings)
+
+    @staticmethod
+    def _build_page_recovery(settings: dict) -> recovery.PageRecovery:
+        return recovery.PageRecovery(
+            max_page_attempts=settings.get('max_page_attempts') or recovery.DEFAULT_MAX_PAGE_ATTEMPTS,
+            endpoint_retry_budget=settings.get('endpoint_retry_budget', recovery.DEFAULT_ENDPOINT_RETRY_BUDGET),
+            quarantine=settings.get('quarantine_failed_pages', False))
+
+    def _write_failed_pages(self, failed_pages: List[dict]):
+        """
+        Writes pages quarantined after repeated failures into the failed_pages report table.
+        """
+        if not failed_pages:
+            return
+        logging.warning(f'{len(failed_pages)} pages failed and were skipped, see the failed_pages table.')
+        result_table = self.create_out_table_definition('failed_pages.csv', incremental=False)
+        for page in failed_pages:
+            self.output_object_dict(dict(page), result_table.full_path, list(recovery.FAILED_PAGES_COLS))
+        self.write_manifest(result_table)
+
+    def _get_simple_ds(self, res_file_path, pkey, ds_getter, *fpars, version_column=None):
         """
         Generic method to get simple objects
         :param res_file_path:
         :param pkey:
         :param ds_getter:
+        :param version_column: modification date column used to pick the latest version of duplicate rows
         :return:
         """
         res_columns = list()
@@ -255,17 +756,228 @@ class Component(ComponentBase):
         # store manifest
         if os.path.isfile(res_file_path):
             cleaned_columns = self._cleanup_col_names(res_columns)
+            self._deduplicate_output(res_file_path, cleaned_columns, pkey, version_column)
             self._write_table_manifest_legacy(file_name=res_file_path, primary_key=pkey,
                                               incremental=self.incremental,
                                               columns=cleaned_columns)
 
+    # PROPERTIES
+    def _resolve_properties(self, client: HubspotClientService, object_type: str, fields: List[str]) -> List[str]:
+        """
+        Resolves the `all` property selection into names of all properties of the object. The names are cached
+        in the state for PROPERTY_NAMES_CACHE_TTL_S.
+        """
+        if [f.lower() for f in fields] != [ALL_PROPERTIES]:
+            return fields
+
+        cache = self._state.setdefault(STATE_PROPERTY_NAMES, {})
+        cached = cache.get(object_type) or {}
+        if cached.get('names') and time.time() - cached.get('fetched_at', 0) < PROPERTY_NAMES_CACHE_TTL_S:
+            names = cached['names']
+        else:
+            names = client.get_property_names(object_type)
+            cache[object_type] = {'names': names, 'fetched_at': int(time.time())}
+        logging.info(f'Extracting all {len(names)} {object_type} properties')
+        return list(names)
+
+    def _get_in_column_groups(self, fetch, fields: List[str], id_column: str, modified_property: str,
+                              state_key: Optional[str] = None) -> Iterable[pd.DataFrame]:
+        """
+        Fetches objects with long property lists in column groups of max `property_group_size` properties, so
+        the request URLs stay within limits. The groups are fetched in parallel and their rows are joined by
+        the object ID on disk. The first (primary) group carries all non-property columns (associations, list
+        memberships, etc.), the other groups the properties only.
+
+        Objects missing from any group are not written, their columns of the missing groups would be empty. On
+        incremental loads all groups share the cutoff time of the start of the scans, objects modified later
+        are not written either, as the groups may have returned different versions. The modification date
+        stored in `state_key` is moved back to the cutoff, so the skipped objects are fetched by the next run.
+
+        Args:
+            fetch: function(fields, primary) returning the object pages of the given properties
+            fields: requested properties, the default properties of the object if empty
+            id_column: object ID column
+            modified_property: (epoch ms) modification date property, fetched in every group
+            state_key: state of the last seen modification date of the incremental fetch, if any
+        """
+        group_size = self.configuration.parameters.get(KEY_PROPERTY_GROUP_SIZE) or DEFAULT_PROPERTY_GROUP_SIZE
+        if len(fields) <= group_size:
+            yield from fetch(fields, True)
+            return
+
+        groups = [fields[i:i + group_size] for i in range(0, len(fields), group_size)]
+        logging.info(f'Fetching {len(fields)} properties in {len(groups)} column groups')
+        modified_column = f'properties.{modified_property}.value'
+        cutoff = int(time.time() * 1000)
+
+        def fetch_group(group: int) -> Iterable[Tuple[int, pd.DataFrame]]:
+            group_fields = list(groups[group])
+            if modified_property not in group_fields:
+                group_fields.append(modified_property)
+            for page in fetch(group_fields, group == 0):
+                yield group, page
+
+        joined = column_join.ColumnGroupJoin(id_column, groups=len(groups))
+        columns = set()
+        modified_after_cutoff = 0
+        try:
+            for group, page in parallel.merge_partitions([functools.partial(fetch_group, i)
+                                                          for i in range(len(groups))]):
+                if page.empty:
+                    continue
+                if group > 0:
+                    page = page[[c for c in page.columns if c == id_column or c.startswith('properties.')]]
+                if self.incremental and modified_column in page.columns:
+                    # the object is then missing from this group and skipped by the join
+                    modified_later = pd.to_numeric(page[modified_column], errors='coerce') > cutoff
+                    modified_after_cutoff += int(modified_later.sum())
+                    page = page[~modified_later]
+                columns.update(page.columns)
+                joined.add(group, page.to_dict('records'))
+
+            if modified_after_cutoff and state_key and self._state.get(state_key):
+                self._state[state_key] = min(self._state[state_key], cutoff)
+            columns = sorted(columns)
+            rows = []
+            for row in joined:
+                rows.append(row)
+                if len(rows) >= JOINED_PAGE_SIZE:
+                    yield pd.DataFrame(rows, columns=columns).fillna('')
+                    rows = []
+            if rows:
+                yield pd.DataFrame(rows, columns=columns).fillna('')
+            if joined.incomplete:
+                logging.warning(f'{joined.incomplete} objects missing from some column groups or modified during '
+                                f'the scan were skipped, they are fetched by the next run')
+        finally:
+            joined.close()
+
+    # COMPANIES
+    def _get_companies_incremental(self, client: HubspotClientService, start_time, fields,
+                                   property_attributes) -> Iterable[pd.DataFrame]:
+        """
+        Gets companies modified since the last seen `hs_lastmodifieddate` stored in the state (or since `period_from`
+        on the first run) using the search scan. Full scan is used only if there is no starting point.
+        """
+        if fields and 'hs_lastmodifieddate' not in fields:
+            fields.append('hs_lastmodifieddate')
+
+        modified_since = self._state.get(STATE_COMPANIES_LAST_MODIFIED)
+        if not modified_since and start_time:
+            modified_since = int(start_time.timestamp() * 1000)
+
+        if modified_since:
+            logging.info(f'Getting companies modified since {modified_since} using the search endpoint')
+            pages = client.get_companies_modified_since(property_attributes, modified_since, fields)
+        else:
+            logging.info('Getting ALL companies using "full scan" endpoint (no previous state or period_from)')
+            pages = client.get_companies(property_attributes, False, fields)
+
+        return self._track_last_modified(pages, 'properties.hs_lastmodifieddate.value', STATE_COMPANIES_LAST_MODIFIED,
+                                         client, COMPANIES_ENDPOINTS)
+
+    def _track_last_modified(self, pages: Iterable[pd.DataFrame], column: str, state_key: str,
+                             client: HubspotClientService, endpoints: List[str]) -> Iterable[pd.DataFrame]:
+        """
+        Passes the pages through and stores the max value of the (epoch ms) modification date column in the state
+        once all pages are processed. The state is kept if a page of the endpoints was quarantined, the skipped
+        records would never be fetched again otherwise.
+        """
+        last_modified = self._state.get(state_key) or 0
+        for page in pages:
+            if column in page.columns and not page.empty:
+                page_max = pd.to_numeric(page[column], errors='coerce').max()
+                if not pd.isna(page_max):
+                    last_modified = max(last_modified, int(page_max))
+            yield page
+
+        if self._has_quarantined_pages(client, state_key, *endpoints):
+            return
+        if last_modified:
+            self._state[state_key] = last_modified
+
+    @staticmethod
+    def _has_quarantined_pages(client: HubspotClientService, state_key: str, *endpoints: str) -> bool:
+        if not client.has_quarantined_pages(*endpoints):
+            return False
+        logging.warning(f'Some pages were quarantined, the state {state_key} is kept so the skipped records '
+                        f'are fetched again in the next run')
+        return True
+
+    # LISTS
+    def get_list_memberships(self, client: HubspotClientService, list_ids: List[str]):
+        """
+        Fetches members of the selected (or all) lists, concurrently per list. When the output is loaded incrementally
+        only lists with `updatedAt` changed since the last run are fetched and their rows in Storage are replaced,
+        so contacts removed from the lists are removed from the table too. Lists with a quarantined page are
+        neither replaced nor marked as fetched.
+        """
+        selected_ids = {int(list_id) for list_id in list_ids}
+        last_updates = (self._state.get(STATE_LISTS_UPDATED_AT) or {}) if self.incremental else {}
+        list_updates = {}
+        for list_id, updated_at in client.get_list_updates():
+            if selected_ids and list_id not in selected_ids:
+                continue
+            if updated_at > last_updates.get(str(list_id), -1):
+                list_updates[str(list_id)] = updated_at
+
+        logging.info(f'Fetching memberships of {len(list_updates)} updated lists')
+        memberships = self._get_edge_set('list_memberships.csv', ['list_id', 'contact_vid', 'added_at'],
+                                         LIST_MEMBERSHIP_PK)
+        for rows in client.get_list_memberships([int(list_id) for list_id in list_updates]):
+            memberships.add_all((r['list_id'], r['contact_vid'], r['added_at']) for r in rows)
+
+        complete = {list_id: updated_at for list_id, updated_at in list_updates.items()
+                    if not client.has_quarantined_pages(LIST_CONTACTS.format(list_id=list_id))}
+        if len(complete) < len(list_updates):
+            logging.warning(f'Memberships of {len(list_updates) - len(complete)} lists were not fetched completely, '
+                            f'the lists are fetched again in the next run')
+        self._state[STATE_LISTS_UPDATED_AT] = {**last_updates, **complete}
+        if self.incremental and complete:
+            self._edge_set_delete_where['list_memberships.csv'] = ('list_id', sorted(complete, key=int))
+
     # CONTACTS
+    def _get_contacts_incremental(self, client: HubspotClientService, start_time, fields, property_attributes,
+                                  include_membership: bool) -> Iterable[pd.DataFrame]:
+        """
+        Gets contacts modified since the last seen `lastmodifieddate` stored in the state (or since `period_from`
+        on the first run), regardless of the window length. Full scan is used only if there is no starting point.
+        The default properties are requested explicitly, so their columns incl. `lastmodifieddate` are kept.
+        """
+        fields = fields or list(CONTACT_DEFAULT_PROPERTIES)
+        if 'lastmodifieddate' not in fields:
+            fields.append('lastmodifieddate')
+
+        modified_since = self._state.get(STATE_CONTACTS_LAST_MODIFIED)
+        if modified_since:
+            start_time = datetime.utcfromtimestamp(modified_since / 1000)
+
+        if start_time:
+            logging.info(f'Getting contacts modified since {start_time}')
+            pages = client.get_contacts_modified_since(property_attributes, start_time, fields, include_membership)
+        else:
+            logging.info('Getting ALL contacts using "full scan" endpoint (no previous state or period_from)')
+            pages = client.get_contacts(property_attributes, None, fields, include_membership)
+
+        return self._track_last_modified(pages, 'properties.lastmodifieddate.value', STATE_CONTACTS_LAST_MODIFIED,
+                                         client, CONTACTS_ENDPOINTS)
+
     def get_contacts(self, client: HubspotClientService, start_time, fields, property_attributes,
-                     include_membership: True):
-        res_file_path = os.path.join(self.tables_out_path, 'contacts.csv')
+                     include_membership: True, incremental_sync: bool = False):
+        res_file_path = self._get_out_path('contacts.csv')
         res_columns = []
         counter = 0
-        for res in client.get_contacts(property_attributes, start_time, fields, include_membership):
+        if incremental_sync:
+            def fetch_contacts(group_fields: List[str], primary: bool) -> Iterable[pd.DataFrame]:
+                return self._get_contacts_incremental(client, start_time, group_fields, property_attributes,
+                                                      include_membership and primary)
+        else:
+            def fetch_contacts(group_fields: List[str], primary: bool) -> Iterable[pd.DataFrame]:
+                return client.get_contacts(property_attributes, start_time, group_fields,
+                                           include_membership and primary)
+        contacts = self._get_in_column_groups(fetch_contacts, fields, 'canonical-vid', 'lastmodifieddate',
+                                              STATE_CONTACTS_LAST_MODIFIED if incremental_sync else None)
+        for res in self._split_property_history(contacts, property_attributes, 'contacts', 'canonical-vid'):
             counter += 100
             if len(res.columns.values) == 0:
                 logging.info("No contact records for specified period.")
@@ -294,36 +1006,103 @@ class Component(ComponentBase):
         # store manifests
         if os.path.isfile(res_file_path):
             cl_cols = self._cleanup_col_names(res_columns)
+            self._deduplicate_output(res_file_path, cl_cols, CONTACT_PK, 'lastmodifieddate')
             self._write_table_manifest_legacy(file_name=res_file_path, primary_key=CONTACT_PK,
                                               incremental=self.incremental,
                                               columns=cl_cols)
 
+    def _split_property_history(self, pages: Iterable[pd.DataFrame], property_attributes: dict, object_name: str,
+                                id_column: str, keep_columns: List[str] = None) -> Iterable[pd.DataFrame]:
+        """
+        Moves property versions of each page into the `[object_name]_property_history` table and drops
+        the versions columns from the page. Pages are passed through unchanged unless `versions_as_table` is set.
+        """
+        if not property_attributes.get(KEY_VERSIONS_AS_TABLE):
+            yield from pages
+            return
+
+        result_table = self.create_out_table_definition(f'{object_name}_property_history.csv',
+                                                        incremental=self.incremental,
+                                                        primary_key=property_history.PROPERTY_HISTORY_PK)
+        header_columns = list(self._object_schemas.get(result_table.full_path, property_history.PROPERTY_HISTORY_COLS))
+        has_history = False
+        for page in pages:
+            versions_columns = property_history.get_versions_columns(page.columns)
+            if versions_columns:
+                rows = list(property_history.iter_property_history(page, id_column, versions_columns))
+                has_history = has_history or bool(rows)
+                self.output_object_dicts(rows, result_table.full_path, header_columns)
+                page.drop(columns=[c for c in versions_columns if c not in (keep_columns or [])], inplace=True)
+            yield page
+
+        if has_history:
+            self.write_manifest(result_table)
+
     def _download_contact_associations(self, client: HubspotClientService, result: pd.DataFrame):
         vids = result['vid'].tolist()
         for ass in self.configuration.parameters['contact_associations']:
-            results = client.get_associations('contact', ass['to_object_type'], vids)
+            try:
+                results = client.get_associations('contact', ass['to_object_type'], vids)
+            except recovery.PageQuarantined as e:
+                logging.warning(f'{e} Associations of the page are skipped.')
+                continue
             self._write_associations('contact', ass['to_object_type'], results)
 
+    def _get_associations_edge_set(self) -> edge_set.EdgeSet:
+        return self._get_edge_set('object_associations.csv',
+                                  ['from_id', 'from_type', 'to_id', 'to_type', 'association_types'],
+                                  ['from_id', 'from_type', 'to_id', 'to_type'])
+
     def _write_associations(self, from_type: str, to_type: str, data: List[dict]):
-        result_table = self.create_out_table_definition('object_associations.csv', incremental=self.incremental,
-                                                        primary_key=['from_id', 'from_type', 'to_id', 'to_type'])
-        result_row = {}
-        header = ['from_id',
-                  'from_type',
-                  'to_id',
-                  'to_type',
-                  'association_types']
+        associations = self._get_associations_edge_set()
         for row in data:
             for association in row['to']:
-                result_row['from_id'] = row['from']['id']
-                result_row['from_type'] = from_type
-                result_row['to_id'] = association['toObjectId']
-                result_row['to_type'] = to_type
-                result_row['association_types'] = association['associationTypes']
-                self.output_object_dict(result_row, result_table.full_path, header)
-
-        if data:
-            self.write_manifest(result_table)
+                associations.add((row['from']['id'], from_type, association['toObjectId'], to_type,
+                                  association['associationTypes']))
+
+    def _get_engagement_associations_edge_set(self) -> edge_set.EdgeSet:
+        return self._get_edge_set('engagement_associations.csv',
+                                  ['from_id', 'from_type', 'to_id', 'to_type', 'association_types',
+                                   'association_labels', 'association_categories'],
+                                  ['from_id', 'from_type', 'to_id', 'to_type'])
+
+    @staticmethod
+    def _get_association_type_definitions(client: HubspotClientService, from_type: str,
+                                          to_type: str) -> Dict[str, dict]:
+        try:
+            return client.get_association_type_definitions(from_type, to_type)
+        except recovery.PageQuarantined as e:
+            logging.warning(f'{e} Labels and categories of the {from_type} to {to_type} associations are empty.')
+            return {}
+
+    def _write_named_associations(self, from_type: str, to_type: str, data: List[dict],
+                                  type_definitions: Dict[str, dict]):
+        """
+        Writes v3 batch read results, the association types are named as the inline associations.
+        """
+        for row in data:
+            self._add_associations(row['from']['id'], from_type, to_type,
+                                   ((association.get('id'), association.get('type')) for association in row['to']),
+                                   type_definitions)
+
+    def _add_associations(self, from_id, from_type: str, to_type: str, associated: Iterable[tuple],
+                          type_definitions: Dict[str, dict]):
+        """
+        Adds all associations of an object to a type as a single row per associated object. The names, labels
+        and categories of the association types are comma separated and sorted.
+        """
+        types_by_id = {}
+        for to_id, association_type in associated:
+            types = types_by_id.setdefault(to_id, set())
+            if association_type is not None and association_type != '':
+                types.add(str(association_type))
+        edges = self._get_engagement_associations_edge_set()
+        for to_id, types in types_by_id.items():
+            definitions = [type_definitions.get(t) or {} for t in types]
+            labels = {d['label'] for d in definitions if d.get('label')}
+            categories = {d['category'] for d in definitions if d.get('category')}
+            edges.add((from_id, from_type, to_id, to_type, ','.join(sorted(types)), ','.join(sorted(labels)),
+                       ','.join(sorted(categories))))
 
     def _drop_duplicate_properties(self, df, property_names: list):
         columns = list(df.columns.values)
@@ -336,40 +1115,30 @@ class Component(ComponentBase):
 
     def _store_contact_submission_and_list(self, contacts):
 
-        c_subform_path = os.path.join(self.tables_out_path, 'contacts_form_submissions.csv')
-        c_lists_path = os.path.join(self.tables_out_path, 'contacts_lists.csv')
+        c_subform_path = self._get_out_path('contacts_form_submissions.csv')
+        c_lists = self._get_edge_set('contacts_lists.csv', CONTACT_LISTS_COLS, CONTACT_LIST_PK)
+        form_submissions = typed_rows.TypedRowBuffer(CONTACT_FORM_SUBISSION_COLS, CHILD_COLUMN_TYPES)
+        submission_cols = CONTACT_FORM_SUBISSION_COLS[:-1]
         # Create table with Contact's form submissions and lists and drop column afterwards
         for index, row in contacts.iterrows():
 
-            if len(row['form-submissions']) > 0:
-                temp_contacts_sub_forms = pd.DataFrame(row['form-submissions'])
-                temp_contacts_sub_forms[KEY_CONTACT_VID] = row['canonical-vid']
-                res_cols = CONTACT_FORM_SUBISSION_COLS
-                temp_contacts_sub_forms = temp_contacts_sub_forms.reindex(columns=res_cols).fillna('')
+            for submission in row['form-submissions']:
+                form_submissions.append([submission.get(c) for c in submission_cols] + [row['canonical-vid']])
 
-                # save res
-                self.output_file(temp_contacts_sub_forms, c_subform_path, temp_contacts_sub_forms.columns)
-
-            if len(row['list-memberships']) > 0:
-                temp_contacts_lists = pd.DataFrame(row['list-memberships'])
-                temp_contacts_lists[KEY_CONTACT_VID] = row['canonical-vid']
-                res_cols = CONTACT_LISTS_COLS
-                temp_contacts_lists = temp_contacts_lists.reindex(columns=res_cols).fillna('')
-                # save res
-                self.output_file(temp_contacts_lists, c_lists_path, temp_contacts_lists.columns)
+            for membership in row['list-memberships']:
+                membership[KEY_CONTACT_VID] = row['canonical-vid']
+                c_lists.add_dict(membership)
 
+        with self._profiler.stage(profiling.STAGE_WRITE):
+            form_submissions.write(c_subform_path)
         if os.path.isfile(c_subform_path):
             self._write_table_manifest_legacy(file_name=c_subform_path, primary_key=C_SUBMISSION_PK,
                                               columns=CONTACT_FORM_SUBISSION_COLS,
                                               incremental=self.incremental)
-        if os.path.isfile(c_lists_path):
-            self._write_table_manifest_legacy(file_name=c_lists_path, primary_key=CONTACT_LIST_PK,
-                                              columns=CONTACT_LISTS_COLS,
-                                              incremental=self.incremental)
 
     def _store_contact_identity_profiles(self, contacts):
-        c_profiles = os.path.join(self.tables_out_path, 'contacts_identity_profiles.csv')
-        c_identities = os.path.join(self.tables_out_path, 'contacts_identity_profile_identities.csv')
+        c_profiles = self._get_out_path('contacts_identity_profiles.csv')
+        c_identities = self._get_out_path('contacts_identity_profile_identities.csv')
         # Create table with Contact's form submissions and lists and drop column afterwards
         for index, row in contacts.iterrows():
 
@@ -410,10 +1179,15 @@ class Component(ComponentBase):
 
     # DEALS
     def get_deals(self, client: HubspotClientService, start_time, fields, property_attributes):
-        res_file_path = os.path.join(self.tables_out_path, 'deals.csv')
+        res_file_path = self._get_out_path('deals.csv')
         res_columns = list()
         counter = 0
-        for res in client.get_deals(property_attributes, start_time, fields):
+        deals = self._get_in_column_groups(
+            lambda group_fields, primary: client.get_deals(property_attributes, start_time, group_fields, primary),
+            fields, 'dealId', 'hs_lastmodifieddate')
+        # dealstage versions are kept for the deals_stage_history table
+        for res in self._split_property_history(deals, property_attributes, 'deals', 'dealId',
+                                                keep_columns=['properties.dealstage.versions']):
             counter += 1
             self._store_deals_stage_hist_and_list(res)
             res.drop(['properties.dealstage.versions'], 1, inplace=True, errors='ignore')
@@ -431,151 +1205,283 @@ class Component(ComponentBase):
         # store manifests
         if os.path.isfile(res_file_path):
             cl_cols = self._cleanup_col_names(res_columns)
+            self._deduplicate_output(res_file_path, cl_cols, DEAL_PK, 'hs_lastmodifieddate')
             self._write_table_manifest_legacy(file_name=res_file_path, primary_key=DEAL_PK,
                                               incremental=self.incremental,
                                               columns=cl_cols)
 
     def _store_deals_stage_hist_and_list(self, deals):
 
-        stage_hist_path = os.path.join(self.tables_out_path, 'deals_stage_history.csv')
-        c_lists_path = os.path.join(self.tables_out_path, 'deals_contacts_list.csv')
-        deal_lists_path = os.path.join(self.tables_out_path, 'deals_assoc_deals_list.csv')
-        companies_lists_path = os.path.join(self.tables_out_path, 'deals_assoc_companies_list.csv')
+        stage_hist_path = self._get_out_path('deals_stage_history.csv')
+        c_lists = self._get_edge_set('deals_contacts_list.csv', ['contact_vid', 'dealId'], DEAL_C_LIST_PK)
+        deal_lists = self._get_edge_set('deals_assoc_deals_list.csv', ['associated_dealId', 'dealId'],
+                                        ['dealId', 'associated_dealId'])
+        companies_lists = self._get_edge_set('deals_assoc_companies_list.csv', ['associated_companyId', 'dealId'],
+                                             ['dealId', 'associated_companyId'])
+        stage_history = typed_rows.TypedRowBuffer(DEAL_STAGE_HIST_COLS, CHILD_COLUMN_TYPES)
+        version_cols = DEAL_STAGE_HIST_COLS[:-1]
         # Create table with Deals' Stage History & Deals' Contacts List
-        c_list_cols, stage_his_cols, ass_deal_list_cols = None, None, None
         for index, row in deals.iterrows():
 
             if row.get('properties.dealstage.versions') and str(
                     row['properties.dealstage.versions']) != 'nan' and len(row['properties.dealstage.versions']) > 0:
-                temp_stage_history = pd.DataFrame(row['properties.dealstage.versions'])
-                temp_stage_history['dealId'] = row['dealId']
-                # fix columns - sometimes there are some missing in the response
-                temp_stage_history = temp_stage_history.reindex(columns=DEAL_STAGE_HIST_COLS).fillna('')
-
-                self.output_file(temp_stage_history, stage_hist_path, temp_stage_history.columns)
-                if not stage_his_cols:
-                    stage_his_cols = list(temp_stage_history.columns.values)
+                # missing version fields are written empty
+                for version in row['properties.dealstage.versions']:
+                    stage_history.append([version.get(c) for c in version_cols] + [row['dealId']])
 
             if row.get('associations.associatedVids') and len(row['associations.associatedVids']) != 0:
-                temp_deals_contacts_list = pd.DataFrame(row['associations.associatedVids'],
-                                                        columns=['contact_vid'])
-                temp_deals_contacts_list['dealId'] = row['dealId']
-                self.output_file(temp_deals_contacts_list, c_lists_path, temp_deals_contacts_list.columns)
-                if not c_list_cols:
-                    c_list_cols = list(temp_deals_contacts_list.columns.values)
+                c_lists.add_all((vid, row['dealId']) for vid in row['associations.associatedVids'])
 
             if row.get('associations.associatedCompanyIds') and len(row['associations.associatedCompanyIds']) != 0:
-                comp_list = pd.DataFrame(row['associations.associatedCompanyIds'],
-                                         columns=['associated_companyId'])
-                comp_list['dealId'] = row['dealId']
-                logging.debug(f'{list(comp_list.columns.values)}')
-                self.output_file(comp_list, companies_lists_path, comp_list.columns)
+                companies_lists.add_all((company_id, row['dealId'])
+                                        for company_id in row['associations.associatedCompanyIds'])
 
             if row.get('associations.associatedDealIds') and len(row['associations.associatedDealIds']) != 0:
-                ass_deal_list = pd.DataFrame(row['associations.associatedDealIds'],
-                                             columns=['associated_dealId'])
-                ass_deal_list['dealId'] = row['dealId']
-                self.output_file(ass_deal_list, deal_lists_path, ass_deal_list.columns)
-                if not ass_deal_list_cols:
-                    ass_deal_list_cols = list(ass_deal_list.columns.values)
+                deal_lists.add_all((deal_id, row['dealId']) for deal_id in row['associations.associatedDealIds'])
 
+        with self._profiler.stage(profiling.STAGE_WRITE):
+            stage_history.write(stage_hist_path)
         if os.path.isfile(stage_hist_path):
             self._write_table_manifest_legacy(file_name=stage_hist_path, primary_key=DEAL_STAGE_HIST_PK,
-                                              columns=stage_his_cols,
-                                              incremental=self.incremental)
-        if os.path.isfile(c_lists_path):
-            self._write_table_manifest_legacy(file_name=c_lists_path, primary_key=DEAL_C_LIST_PK,
-                                              columns=["contact_vid", "dealId"],
-                                              incremental=self.incremental)
-        if os.path.isfile(deal_lists_path):
-            self._write_table_manifest_legacy(file_name=deal_lists_path,
-                                              primary_key=['dealId', 'associated_dealId'],
-                                              columns=ass_deal_list_cols,
-                                              incremental=self.incremental)
-        if os.path.isfile(companies_lists_path):
-            self._write_table_manifest_legacy(file_name=companies_lists_path,
-                                              primary_key=['dealId', 'associated_companyId'],
-                                              columns=["associated_companyId", "dealId"],
+                                              columns=DEAL_STAGE_HIST_COLS,
                                               incremental=self.incremental)
 
     # PIPELINES
-    def get_pipelines(self, client: HubspotClientService):
-        res_file_path = os.path.join(self.tables_out_path, 'pipelines.csv')
-        res_columns = list()
+    def get_pipelines(self, pipelines: Iterable[dict]):
+        """
+        Writes streamed pipelines and explodes their stages into the pipeline_stages table in the same pass.
+        """
+        pipelines_table = self.create_out_table_definition('pipelines.csv', incremental=self.incremental,
+                                                           primary_key=PIPELINE_PK)
+        stages_table = self.create_out_table_definition('pipeline_stages.csv', incremental=self.incremental,
+                                                        primary_key=PIPELINE_STAGE_PK)
+        pipeline_columns = list(self._object_schemas.get(pipelines_table.full_path, PIPELINE_PK))
+        stage_columns = list(self._object_schemas.get(stages_table.full_path, PIPELINE_STAGE_PK))
+        parser = FlattenJsonParser(child_separator='_')
+
         counter = 0
-        for res in client.get_pipelines():
+        stage_counter = 0
+        for pipeline in pipelines:
             counter += 1
-            self._store_pipeline_stages(res)
-            res.drop(['stages'], 1, inplace=True, errors='ignore')
-            self.output_file(res, res_file_path, res.columns)
-            if not res_columns:
-                res_columns = list(res.columns.values)
-
-            if counter % 100 == 0:
-                logging.info(f"Processed {counter} Pipelines records.")
-
-        # store manifests
-        if os.path.isfile(res_file_path):
-            cl_cols = self._cleanup_col_names(res_columns)
-            self._write_table_manifest_legacy(file_name=res_file_path, primary_key=PIPELINE_PK, columns=cl_cols,
-                                              incremental=self.incremental)
+            for stage in pipeline.pop('stages', None) or []:
+                stage_counter += 1
+                stage['pipelineId'] = pipeline.get('pipelineId')
+                self.output_object_dict(stage, stages_table.full_path, stage_columns)
 
-    def _store_pipeline_stages(self, pipelines):
+            self.output_object_dict(parser.parse_row(pipeline), pipelines_table.full_path, pipeline_columns)
 
-        stage_hist_path = os.path.join(self.tables_out_path, 'pipeline_stages.csv')
-        # Create table with Pipelines' Stages.
-        res_columns = list()
-        for index, row in pipelines.iterrows():
-
-            if len(row['stages']) > 0:
-                temp_pipelines_stages = pd.DataFrame(row['stages'])
-                temp_pipelines_stages['pipelineId'] = row['pipelineId']
-                self.output_file(temp_pipelines_stages, stage_hist_path, temp_pipelines_stages.columns)
-                if not res_columns:
-                    res_columns = list(temp_pipelines_stages.columns.values)
+        logging.info(f"Processed {counter} Pipelines with {stage_counter} stages.")
+        if counter > 0:
+            self.write_manifest(pipelines_table)
+        if stage_counter > 0:
+            self.write_manifest(stages_table)
 
-        if os.path.isfile(stage_hist_path):
-            self._write_table_manifest_legacy(file_name=stage_hist_path, primary_key=PIPELINE_STAGE_PK,
-                                              columns=res_columns,
-                                              incremental=self.incremental)
+    def _get_reference_objects(self, client: HubspotClientService, name: str, fetch: Callable[[], Iterable[dict]],
+                               endpoint: str) -> Optional[Iterable[dict]]:
+        """
+        Returns the reference objects, or None if the reference cache is enabled and the payload is the same
+        as in the last run, so the tables don't have to be written. Without the cache the objects are streamed.
+        None is returned also when the response was quarantined, the incomplete payload would replace the tables.
 
-    def _dowload_crm_v3_object(self, client: HubspotClientService, object_name: str, **kwargs):
+        Args:
+            client: client
+            name: cache entry of the payload
+            fetch: function requesting the objects from the API
+            endpoint: API endpoint of the objects
+        """
+        settings = self.configuration.parameters.get(KEY_REFERENCE_CACHE) or {}
+        if not settings.get('enabled'):
+            objects = iter(fetch())
+            # the single request is sent on the first item
+            first = next(objects, None)
+            if self._is_reference_quarantined(client, name, endpoint):
+                return None
+            return itertools.chain([first], objects) if first is not None else iter([])
+
+        shared_dir = settings.get('shared_dir')
+        portal_id = self._portal_id
+        if shared_dir and not portal_id:
+            portal_id = self._portal_id = client.get_portal_id()
+        cache = reference_cache.ReferenceCache(self._state.setdefault(STATE_REFERENCE_HASHES, {}),
+                                               shared_dir=shared_dir, portal_id=portal_id,
+                                               max_age_s=settings.get('max_age_s') or reference_cache.DEFAULT_MAX_AGE_S)
+        objects = cache.load_shared(name)
+        source = 'shared_cache'
+        if objects is None:
+            objects = list(fetch())
+            source = 'api'
+            if self._is_reference_quarantined(client, name, endpoint):
+                return None
+            cache.store_shared(name, objects)
+
+        changed = cache.update(name, objects)
+        self._run_metrics.setdefault('reference_cache', {})[name] = {'source': source, 'changed': changed}
+        if not changed:
+            logging.info(f'{name} did not change since the last run, the tables are not written.')
+            return None
+        return objects
+
+    @staticmethod
+    def _is_reference_quarantined(client: HubspotClientService, name: str, endpoint: str) -> bool:
+        if not client.has_quarantined_pages(endpoint):
+            return False
+        logging.warning(f'The response of {name} was quarantined, the tables are not written.')
+        return True
+
+    def _download_reference_objects(self, objects: Iterable[dict], object_name: str, primary_key: List[str]):
+        """
+        Writes streamed reference objects (owners, etc.) row by row, nested objects are flattened.
+        """
         result_table = self.create_out_table_definition(f'{object_name}.csv', incremental=self.incremental,
-                                                        primary_key=['id'])
-        result_path = result_table.full_path
-        header_columns = self._object_schemas.get(result_path, ['id'])
+                                                        primary_key=primary_key)
+        header_columns = list(self._object_schemas.get(result_table.full_path, primary_key))
+        parser = FlattenJsonParser(child_separator='_')
+
         counter = 0
-        for res in client.get_v3_engagement_object(object_name, **kwargs):
-            if counter % 500 == 0:
-                logging.info(f"Downloaded {counter} records.")
-            for row in res:
-                counter += 1
-                self.output_object_dict(row, result_path, header_columns)
+        for obj in objects:
+            counter += 1
+            self.output_object_dict(parser.parse_row(obj), result_table.full_path, header_columns)
 
+        logging.info(f"Processed {counter} {object_name} records.")
         if counter > 0:
             self.write_manifest(result_table)
 
+    def _dowload_crm_v3_object(self, client: HubspotClientService, object_name: str, properties: List[str] = None,
+                               associations: List[str] = None, associations_mode: str = ASSOCIATIONS_INLINE):
+        """
+        Downloads v3 engagement objects, optionally with their associations to the given object types written into
+        the engagement_associations table in the same scan. Inline associations are returned with the objects, truncated
+        ones (more than a page of associated objects) and all associations in the batch mode are read by v4 batch
+        requests sent concurrently while the next pages are fetched.
+        """
+        result_path = self._get_out_path(f'{object_name}.csv')
+        # requested properties are known upfront, the schema cached from the previous run keeps the column order
+        header_columns = list(self._object_schemas.get(result_path, ['id'])) + list(properties or [])
+        writer = row_writer.SchemaRowWriter(result_path, header_columns)
+        associations = associations or []
+        inline_associations = associations if associations_mode == ASSOCIATIONS_INLINE else []
+        from_type = ASSOCIATION_OBJECT_TYPES[object_name]
+        type_definitions = {to_type: self._get_association_type_definitions(client, from_type, to_type)
+                            for to_type in associations}
+        batch_reads = []
+        with ThreadPoolExecutor(max_workers=parallel.DEFAULT_WORKERS) as executor:
+            try:
+                for res in client.get_v3_engagement_object(object_name, properties, inline_associations):
+                    if writer.rows % 500 == 0:
+                        logging.info(f"Downloaded {writer.rows} records.")
+                    batch_ids = {to_type: [] for to_type in associations}
+                    # a streamed page can be read only once
+                    rows = list(res)
+                    for row in rows:
+                        self._store_inline_associations(from_type, row.pop('associations', None) or {},
+                                                        row.get('id'), batch_ids, type_definitions)
+                        if not inline_associations:
+                            for ids in batch_ids.values():
+                                ids.append(row.get('id'))
+                    # timed per page, timing each row would distort the measured time
+                    with self._profiler.stage(profiling.STAGE_WRITE):
+                        writer.writerows(rows)
+
+                    for to_type, ids in batch_ids.items():
+                        for i in range(0, len(ids), ASSOCIATIONS_BATCH_SIZE):
+                            # v3 names the association types as the inline associations
+                            batch_reads.append((to_type, executor.submit(client.get_associations, from_type, to_type,
+                                                                         ids[i:i + ASSOCIATIONS_BATCH_SIZE], 'v3')))
+                    batch_reads = self._write_completed_associations(from_type, batch_reads, type_definitions)
+                    # the paging waits for the batch reads once too many are pending
+                    while len(batch_reads) > parallel.DEFAULT_WORKERS * parallel.QUEUE_SIZE_PER_WORKER:
+                        to_type, future = batch_reads.pop(0)
+                        self._write_named_associations(from_type, to_type, self._get_batch_result(future),
+                                                       type_definitions.get(to_type) or {})
+            finally:
+                writer.close()
+            self._write_completed_associations(from_type, batch_reads, type_definitions, wait=True)
+        self._write_schema_table_manifest(writer, ['id'])
+
+    def _store_inline_associations(self, from_type: str, associations: dict, object_id, batch_ids: Dict[str, list],
+                                   type_definitions: Dict[str, Dict[str, dict]]):
+        """
+        Adds inline associations of an object to the engagement_associations table. Object types with truncated
+        associations are scheduled for a batch read.
+        """
+        for key, associated in associations.items():
+            to_type = ASSOCIATION_OBJECT_TYPES.get(key, key)
+            if (associated.get('paging') or {}).get('next'):
+                batch_ids.setdefault(to_type, []).append(object_id)
+                continue
+            self._add_associations(object_id, from_type, to_type,
+                                   ((a.get('id'), a.get('type')) for a in associated.get('results') or []),
+                                   type_definitions.get(to_type) or {})
+
+    def _write_completed_associations(self, from_type: str, batch_reads: List[tuple],
+                                      type_definitions: Dict[str, Dict[str, dict]], wait: bool = False) -> list:
+        """
+        Writes results of the completed association batch reads, returns the pending ones.
+        """
+        pending = []
+        for to_type, future in batch_reads:
+            if wait or future.done():
+                self._write_named_associations(from_type, to_type, self._get_batch_result(future),
+                                               type_definitions.get(to_type) or {})
+            else:
+                pending.append((to_type, future))
+        return pending
+
+    @staticmethod
+    def _get_batch_result(future: Future) -> List[dict]:
+        try:
+            return future.result()
+        except recovery.PageQuarantined as e:
+            # recorded in the failed pages, the other batches continue
+            logging.warning(f'{e} Associations of the batch are skipped.')
+            return []
+
+    def _get_email_statistics(self, client: HubspotClientService, updated_since=None) -> Iterable[List[dict]]:
+        """
+        Passes the email statistics pages through and stores the max `updated` value in the state
+        once all pages are processed.
+        """
+        if updated_since:
+            logging.info(f'Getting marketing emails updated since {updated_since}')
+        last_updated = updated_since or 0
+        for page in client.get_email_statistics(updated_since=updated_since):
+            for row in page:
+                if isinstance(row.get('updated'), (int, float)):
+                    last_updated = max(last_updated, int(row['updated']))
+            yield page
+
+        if self._has_quarantined_pages(client, STATE_EMAIL_STATISTICS_UPDATED, MARKETING_EMAILS_STATISTICS):
+            return
+        if last_updated:
+            self._state[STATE_EMAIL_STATISTICS_UPDATED] = last_updated
+
     def _download_v3_parsed(self, method, parser: FlattenJsonParser, object_name: str, **kwargs):
-        result_table = self.create_out_table_definition(f'{object_name}.csv', incremental=self.incremental,
-                                                        primary_key=['id'])
-        result_path = result_table.full_path
-        header_columns = self._object_schemas.get(result_path, ['id'])
+        result_path = self._get_out_path(f'{object_name}.csv')
+        writer = row_writer.SchemaRowWriter(result_path, self._object_schemas.get(result_path, ['id']))
 
         counter = 0
         next_boundary = 500
-        total_rows = 0
-        for res in method(**kwargs):
-            if counter % 500 == 0:
-                logging.info(f"Downloading records between {counter} and {next_boundary}.")
-                next_boundary = counter + 500
-                counter += 1
-            for row in res:
-                total_rows = + 1
-                parsed_row = parser.parse_row(row)
-                self.output_object_dict(parsed_row, result_path, header_columns)
-
-        if total_rows > 0:
-            self.write_manifest(result_table)
+        try:
+            for res in method(**kwargs):
+                if counter % 500 == 0:
+                    logging.info(f"Downloading records between {counter} and {next_boundary}.")
+                    next_boundary = counter + 500
+                    counter += 1
+                parsed_rows = [parser.parse_row(row) for row in res]
+                with self._profiler.stage(profiling.STAGE_WRITE):
+                    writer.writerows(parsed_rows)
+        finally:
+            writer.close()
+        self._write_schema_table_manifest(writer, ['id'])
+
+    def _write_schema_table_manifest(self, writer: row_writer.SchemaRowWriter, primary_key: List[str]):
+        """
+        Stores the final columns of a closed SchemaRowWriter in the table schemas and writes the table manifest.
+        """
+        self._object_schemas[writer.file_path] = writer.columns
+        if writer.rows > 0:
+            self._write_table_manifest_legacy(file_name=writer.file_path, primary_key=primary_key,
+                                              columns=writer.columns, incremental=self.incremental)
 
     def output_file(self, data_output, file_output, column_headers):
         """
@@ -589,7 +1495,7 @@ class Component(ComponentBase):
         data_output = data_output.astype(str)
         _mode = 'w+' if not os.path.isfile(file_output) else 'a'
 
-        with open(file_output, _mode, encoding='utf-8', newline='') as b:
+        with self._profiler.stage(profiling.STAGE_WRITE), open(file_output, _mode, encoding='utf-8', newline='') as b:
             data_output.to_csv(b, index=False, header=False, columns=column_headers, line_terminator="")
 
     def output_object_dict(self, data_output: dict, file_output, column_headers):
@@ -598,9 +1504,17 @@ class Component(ComponentBase):
         Append to the file if file does not exist
         * row by row
         """
+        self.output_object_dicts([data_output], file_output, column_headers)
+
+    def output_object_dicts(self, data_output: List[dict], file_output, column_headers):
+        """
+        Output several rows at once, the write stage is measured once for all of them.
+        """
         writer = self._get_writer_from_cache(file_output, column_headers)
-        data_output = self._flatten_properties(data_output)
-        writer.writerow(data_output)
+        rows = [self._flatten_properties(row) for row in data_output]
+        with self._profiler.stage(profiling.STAGE_WRITE):
+            for row in rows:
+                writer.writerow(row)
 
     def _flatten_properties(self, result: dict):
         properties = result.pop('properties', {})
@@ -610,18 +1524,73 @@ class Component(ComponentBase):
 
     def _get_writer_from_cache(self, output_path: str, column_headers):
         if not self._writer_cache.get(output_path):
-            self._writer_cache[output_path] = keboola.csvwriter.ElasticDictWriter(output_path, column_headers)
+            self._writer_cache[output_path] = csvwriter.ElasticDictWriter(output_path, column_headers)
             self._writer_cache[output_path].writeheader()
 
         return self._writer_cache[output_path]
 
+    def _get_out_path(self, file_name: str) -> str:
+        return os.path.join(self.tables_out_path, self._table_prefix + file_name)
+
+    def create_out_table_definition(self, name: str, *args, **kwargs):
+        return super().create_out_table_definition(self._table_prefix + name, *args, **kwargs)
+
+    def _get_edge_set(self, file_name: str, columns: List[str], primary_key: List[str]) -> edge_set.EdgeSet:
+        if file_name not in self._edge_sets:
+            self._edge_sets[file_name] = edge_set.EdgeSet(columns, column_types=CHILD_COLUMN_TYPES)
+            self._edge_set_pks[file_name] = primary_key
+        return self._edge_sets[file_name]
+
+    def _write_edge_sets(self):
+        """
+        Writes each association table once, without duplicate rows and sorted.
+        """
+        for file_name, edges in self._edge_sets.items():
+            delete_where = self._edge_set_delete_where.get(file_name)
+            # an empty table still deletes the replaced rows
+            if not edges.rows_added and not delete_where:
+                continue
+            file_path = self._get_out_path(file_name)
+            with self._profiler.stage(profiling.STAGE_WRITE):
+                written = edges.write(file_path)
+            self._write_table_manifest_legacy(file_name=file_path, primary_key=self._edge_set_pks[file_name],
+                                              columns=edges.columns, incremental=self.incremental,
+                                              delete_where=delete_where)
+            metrics = self._run_metrics.setdefault('association_rows', {})
+            metrics[file_name] = {'received': edges.rows_added, 'written': written}
+
     def _close_files(self):
         for key, f in self._writer_cache.items():
-            f.close()
+            with self._profiler.stage(profiling.STAGE_WRITE):
+                f.close()
             logging.debug(self._object_schemas)
             self._object_schemas[key] = f.fieldnames
 
-        self.write_state_file({"table_schemas": self._object_schemas})
+    def _deduplicate_output(self, file_path: str, columns: List[str], primary_key: List[str],
+                            version_column: str = None):
+        """
+        Keeps only the latest row of each primary key in the headless output file, if enabled.
+        """
+        if not self.configuration.parameters.get(KEY_DEDUPLICATE_OUTPUT):
+            return
+
+        key_indices = dedupe.find_columns(columns, primary_key)
+        if key_indices is None:
+            logging.warning(f'Primary key {primary_key} not found in {os.path.basename(file_path)}, '
+                            f'skipping deduplication.')
+            return
+
+        version_index = None
+        if version_column:
+            version_indices = dedupe.find_columns(columns, [version_column])
+            version_index = version_indices[0] if version_indices else None
+
+        with self._profiler.stage(profiling.STAGE_WRITE):
+            removed = dedupe.dedupe_csv(file_path, key_indices, version_index)
+        self._run_metrics.setdefault('deduplicated_rows', {})[os.path.basename(file_path)] = removed
+
+    def _log_run_metrics(self):
+        logging.info(f'Run metrics: {json.dumps(self._run_metrics, default=str)}')
 
     def _parse_props(self, param):
         cols = []
@@ -644,7 +1613,8 @@ class Component(ComponentBase):
                                      destination='',
                                      primary_key=None,
                                      columns=None,
-                                     incremental=None):
+                                     incremental=None,
+                                     delete_where: Optional[Tuple[str, List[str]]] = None):
         """
         Write manifest for output table Manifest is used for
         the table to be stored in KBC Storage.
@@ -654,6 +1624,7 @@ class Component(ComponentBase):
             primary_key: List with names of columns used for primary key.
             columns: List of columns for headless CSV files
             incremental: Set to true to enable incremental loading
+            delete_where: (column, values) of rows deleted from the table before the incremental load
         """
         manifest = {}
         if destination:
@@ -673,6 +1644,9 @@ class Component(ComponentBase):
                 raise TypeError("Columns must by a list")
         if incremental:
             manifest['incremental'] = True
+        if delete_where:
+            manifest['delete_where_column'], manifest['delete_where_values'] = delete_where
+            manifest['delete_where_operator'] = 'eq'
         with open(file_name + '.manifest', 'w') as manifest_file:
             json.dump(manifest, manifest_file)
 
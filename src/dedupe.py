@@ -0,0 +1,143 @@
+"""
+In-run deduplication of the headless output CSV files by their primary key.
+
+Incremental endpoints may return the same object several times within a single run (e.g. an object modified while
+being paginated or overlapping time offsets). The rows are keyed by a fixed size hash of the primary key values stored
+in an on-disk SQLite index, so the memory footprint does not grow with the number of rows.
+"""
+import csv
+import hashlib
+import logging
+import os
+import sqlite3
+import tempfile
+from typing import Iterator, List, Optional
+
+KEY_DIGEST_SIZE = 16
+# number of index updates sent to the index in a single batch
+INDEX_BATCH_SIZE = 10000
+KEY_SEPARATOR = '\x1f'
+
+
+def normalize_column_name(column: str) -> str:
+    return column.strip().replace('-', '_')
+
+
+def find_columns(columns: List[str], names: List[str]) -> Optional[List[int]]:
+    """
+    Returns indices of the `names` columns, compared regardless of surrounding whitespace and `-` / `_` difference.
+    None if any of the columns is missing.
+    """
+    normalized = [normalize_column_name(c) for c in columns]
+    indices = []
+    for name in names:
+        name = normalize_column_name(name)
+        if name not in normalized:
+            return None
+        indices.append(normalized.index(name))
+    return indices
+
+
+def _to_version(value: str) -> Optional[float]:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class UpsertIndex:
+    """
+    On-disk index of the latest row number of each primary key.
+
+    The row with the highest version wins, rows without a comparable version and rows with the same version
+    replace the previous ones, i.e. the last written row is the latest.
+    """
+
+    def __init__(self, directory: Optional[str] = None):
+        fd, self._path = tempfile.mkstemp(suffix='.sqlite', dir=directory)
+        os.close(fd)
+        self._db = sqlite3.connect(self._path)
+        self._db.execute('PRAGMA journal_mode=OFF')
+        self._db.execute('PRAGMA synchronous=OFF')
+        self._db.execute('CREATE TABLE idx (key BLOB PRIMARY KEY, row INTEGER NOT NULL, version REAL) WITHOUT ROWID')
+        self._batch = []
+        self.rows = 0
+
+    @staticmethod
+    def hash_key(values: List[str]) -> bytes:
+        return hashlib.blake2b(KEY_SEPARATOR.join(values).encode('utf-8'), digest_size=KEY_DIGEST_SIZE).digest()
+
+    def add(self, key_values: List[str], version: Optional[float] = None):
+        self._batch.append((self.hash_key(key_values), self.rows, version))
+        self.rows += 1
+        if len(self._batch) >= INDEX_BATCH_SIZE:
+            self._flush()
+
+    def _flush(self):
+        self._db.executemany('INSERT INTO idx VALUES (?, ?, ?) ON CONFLICT(key) DO UPDATE '
+                             'SET row = excluded.row, version = excluded.version '
+                             'WHERE excluded.version IS NULL OR idx.version IS NULL '
+                             'OR excluded.version >= idx.version', self._batch)
+        self._batch = []
+
+    def unique_keys(self) -> int:
+        self._flush()
+        return self._db.execute('SELECT COUNT(*) FROM idx').fetchone()[0]
+
+    def kept_rows(self) -> Iterator[int]:
+        """
+        Yields numbers of the kept rows in ascending order.
+        """
+        self._flush()
+        for (row,) in self._db.execute('SELECT row FROM idx ORDER BY row'):
+            yield row
+
+    def close(self):
+        self._db.close()
+        os.remove(self._path)
+
+
+def dedupe_csv(file_path: str, key_indices: List[int], version_index: Optional[int] = None,
+               index_dir: Optional[str] = None) -> int:
+    """
+    Keeps only the latest row of each primary key in a headless CSV file. The file is rewritten only if
+    it contains duplicates, the order of the kept rows is preserved.
+
+    Args:
+        file_path: headless CSV file
+        key_indices: indices of the primary key columns
+        version_index: optional index of the modification date column, the row with the highest value is kept
+        index_dir: directory of the temporary index, system temp by default
+
+    Returns: number of removed rows
+
+    """
+    index = UpsertIndex(index_dir)
+    try:
+        with open(file_path, 'r', encoding='utf-8', newline='') as inp:
+            for row in csv.reader(inp):
+                key_values = [row[i] if i < len(row) else '' for i in key_indices]
+                version = None
+                if version_index is not None and version_index < len(row):
+                    version = _to_version(row[version_index])
+                index.add(key_values, version)
+
+        removed = index.rows - index.unique_keys()
+        if not removed:
+            return 0
+
+        tmp_path = file_path + '.dedupe'
+        kept_rows = index.kept_rows()
+        next_kept = next(kept_rows, None)
+        with open(file_path, 'r', encoding='utf-8', newline='') as inp, \
+                open(tmp_path, 'w', encoding='utf-8', newline='') as out:
+            writer = csv.writer(out, lineterminator='\n')
+            for row_number, row in enumerate(csv.reader(inp)):
+                if row_number == next_kept:
+                    writer.writerow(row)
+                    next_kept = next(kept_rows, None)
+        os.replace(tmp_path, file_path)
+        logging.info(f'Removed {removed} duplicate rows from {os.path.basename(file_path)}')
+        return removed
+    finally:
+        index.close()
@@ -0,0 +1,131 @@
+"""
+Memory bounded set of association (edge) rows.
+
+Association and child tables (e.g. `deals_contacts_list`, `contacts_lists`, `object_associations`) receive the same
+rows many times across pages. The rows are collected in an in-memory set which is spilled into a sorted run file
+on disk whenever it reaches the buffer size. The runs are merged once at the end, so each row is emitted only once
+and the result is sorted.
+
+Values of INT columns (ids, timestamps) are kept as ints and values of ENUM columns (object types) as interned
+strings, so the rows take a fraction of the memory of string tuples. Integer values sort numerically.
+"""
+import csv
+import heapq
+import os
+import tempfile
+from typing import Iterable, Iterator, List, Optional, Sequence
+
+import typed_rows
+
+# max number of rows kept in memory before spilling into a run file
+DEFAULT_BUFFER_SIZE = 500000
+# the buffer is never shrunk below this size under memory pressure
+MIN_BUFFER_SIZE = 10000
+
+
+def _sort_key(row: tuple) -> tuple:
+    # INT columns may contain text values that are not integers, those sort after the integers
+    return tuple((1, v) if isinstance(v, str) else (0, v) for v in row)
+
+
+def _sorted(rows: Iterable[tuple]) -> list:
+    try:
+        return sorted(rows)
+    except TypeError:
+        return sorted(rows, key=_sort_key)
+
+
+class EdgeSet:
+
+    def __init__(self, columns: List[str], buffer_size: int = DEFAULT_BUFFER_SIZE, directory: Optional[str] = None,
+                 column_types: Optional[dict] = None):
+        """
+
+        Args:
+            columns: row columns
+            buffer_size: max number of unique rows kept in memory
+            directory: directory of the spilled run files, system temp by default
+            column_types: typed_rows type (INT, ENUM, TEXT) of the columns, TEXT if not set
+        """
+        self.columns = list(columns)
+        self._types = [(column_types or {}).get(c, typed_rows.TEXT) for c in self.columns]
+        self._buffer_size = buffer_size
+        self._initial_buffer_size = buffer_size
+        self._directory = directory
+        self._buffer = set()
+        self._runs = []
+        self.rows_added = 0
+
+    def add(self, row: Sequence):
+        """
+        Adds a row, values are ordered as `columns`.
+        """
+        self.rows_added += 1
+        self._buffer.add(tuple(typed_rows.normalize(v, t) for v, t in zip(row, self._types)))
+        if len(self._buffer) >= self._buffer_size:
+            self._spill()
+
+    def add_dict(self, row: dict):
+        self.add([row.get(c) for c in self.columns])
+
+    def add_all(self, rows: Iterable[Sequence]):
+        for row in rows:
+            self.add(row)
+
+    def shrink_buffer(self):
+        """
+        Halves the buffer size under memory pressure, a larger buffer is spilled on the next add.
+        """
+        self._buffer_size = max(min(MIN_BUFFER_SIZE, self._initial_buffer_size), self._buffer_size // 2)
+
+    def restore_buffer(self):
+        self._buffer_size = self._initial_buffer_size
+
+    def _spill(self):
+        fd, path = tempfile.mkstemp(suffix='.csv', dir=self._directory)
+        with os.fdopen(fd, 'w', encoding='utf-8', newline='') as out:
+            csv.writer(out, lineterminator='\n').writerows(_sorted(self._buffer))
+        self._runs.append(path)
+        self._buffer = set()
+
+    def _read_run(self, path: str) -> Iterator[tuple]:
+        with open(path, 'r', encoding='utf-8', newline='') as inp:
+            for row in csv.reader(inp):
+                yield tuple(typed_rows.normalize(v, t) for v, t in zip(row, self._types))
+
+    def __iter__(self) -> Iterator[tuple]:
+        """
+        Yields unique rows in sorted order.
+        """
+        previous = None
+        runs = [self._read_run(r) for r in self._runs]
+        for row in heapq.merge(_sorted(self._buffer), *runs, key=_sort_key):
+            if row != previous:
+                yield row
+            previous = row
+
+    def write(self, file_path: str, header: bool = False) -> int:
+        """
+        Writes the unique sorted rows into a CSV file and removes the spilled runs.
+
+        Returns: number of written rows
+
+        """
+        count = 0
+        try:
+            with open(file_path, 'w', encoding='utf-8', newline='') as out:
+                writer = csv.writer(out, lineterminator='\n')
+                if header:
+                    writer.writerow(self.columns)
+                for row in self:
+                    writer.writerow(row)
+                    count += 1
+        finally:
+            self.close()
+        return count
+
+    def close(self):
+        for path in self._runs:
+            os.remove(path)
+        self._runs = []
+        self._buffer = set()
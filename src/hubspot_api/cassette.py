@@ -0,0 +1,205 @@
+"""
+Record / replay of the HTTP traffic of a run.
+
+CassetteTransport is an HttpTransport, so it sits under both API clients. In the record mode the requests are sent
+to the API and each response is appended to a gzip compressed JSON lines cassette as it is recorded, so
+recording a large portal does not keep the responses in memory; the cassette is complete once closed. Credentials
+are never stored (auth headers are not recorded, auth query parameters are removed) and values of the configured
+response fields (by default the personal data, e.g. email, phone) are redacted. In the replay mode no request leaves
+the process, the recorded responses are returned in the recorded order for each request, either at full speed or
+with the recorded latency scaled by `latency_factor`. The recorded `elapsed` time is kept on the replayed
+responses, so the adaptive page sizing takes the same decisions as in the recorded run.
+
+Requests are matched by method, path, query parameters and JSON body. Time windows computed at run time (e.g. from
+a relative `period_from`) shift between the recording and the replay, so requests that do not match exactly are
+matched with all epoch millis values ignored.
+"""
+import base64
+import gzip
+import io
+import json
+import re
+import threading
+import time
+from datetime import timedelta
+from typing import Dict, Iterable, List, Optional
+from urllib.parse import urlsplit
+
+import requests
+
+from hubspot_api.transport import HttpTransport
+
+MODE_RECORD = 'record'
+MODE_REPLAY = 'replay'
+
+REDACTED = 'REDACTED'
+# query parameters holding credentials
+SECRET_PARAMS = {'hapikey', 'access_token'}
+# response headers not replayed, the recorded content is already decoded
+SKIPPED_HEADERS = {'set-cookie', 'content-encoding', 'transfer-encoding', 'content-length'}
+# response fields holding personal data, redacted unless other fields are configured
+DEFAULT_REDACT_FIELDS = ['email', 'firstname', 'lastname', 'firstName', 'lastName', 'phone', 'mobilephone',
+                         'address', 'identities']
+EPOCH_MILLIS_PATTERN = re.compile(r'(?<!\d)1\d{12}(?!\d)')
+
+
+class CassetteMiss(RuntimeError):
+    """
+    Request was not recorded in the cassette.
+    """
+
+
+class _ReplayedBody(io.BytesIO):
+    """
+    In-memory response body readable as `response.raw` by the streaming parser.
+    """
+    decode_content = True
+
+
+def _request_key(method: str, url: str, params: Optional[dict], body) -> str:
+    path = urlsplit(url).path.lstrip('/')
+    params = {k: v for k, v in (params or {}).items() if k not in SECRET_PARAMS and v is not None}
+    return json.dumps([method.upper(), path, params, body], sort_keys=True, default=str)
+
+
+def _loose_key(key: str) -> str:
+    return EPOCH_MILLIS_PATTERN.sub('<epoch_ms>', key)
+
+
+def redact(value, fields: Iterable[str]):
+    """
+    Replaces all string values nested under the given keys.
+    """
+    fields = set(fields)
+
+    def _redact(item, redacted: bool):
+        if isinstance(item, dict):
+            return {k: _redact(v, redacted or k in fields) for k, v in item.items()}
+        if isinstance(item, list):
+            return [_redact(v, redacted) for v in item]
+        if redacted and isinstance(item, str):
+            return REDACTED
+        return item
+
+    return _redact(value, False)
+
+
+class CassetteTransport(HttpTransport):
+
+    def __init__(self, cassette_path: str, mode: str = MODE_REPLAY, latency_factor: float = 0.0,
+                 redact_fields: Iterable[str] = tuple(DEFAULT_REDACT_FIELDS), **kwargs):
+        """
+
+        Args:
+            cassette_path: path of the gzip compressed cassette
+            mode: record or replay
+            latency_factor: replayed responses are delayed by the recorded latency multiplied by this factor,
+                            0 replays at full speed
+            redact_fields: keys of the response JSON whose values are redacted in the cassette
+            **kwargs: HttpTransport parameters
+        """
+        if mode not in (MODE_RECORD, MODE_REPLAY):
+            raise ValueError(f'Invalid cassette mode "{mode}", supported: {MODE_RECORD}, {MODE_REPLAY}')
+        super().__init__(**kwargs)
+        self.cassette_path = cassette_path
+        self.mode = mode
+        self.latency_factor = latency_factor
+        self._redact_fields = list(redact_fields)
+        self._lock = threading.Lock()
+        self._recorded = 0
+        self._out = gzip.open(cassette_path, 'wt', encoding='utf-8') if mode == MODE_RECORD else None
+        # recorded responses by the exact and by the loose request key
+        self._replay: Dict[str, List[dict]] = {}
+        self._replay_positions: Dict[str, int] = {}
+        if mode == MODE_REPLAY:
+            self._load()
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        key = _request_key(method, url, kwargs.get('params'), kwargs.get('json'))
+        if self.mode == MODE_REPLAY:
+            with self.request_timer():
+                return self._replay_response(key, url)
+
+        response = super().request(method, url, **kwargs)
+        self._record(key, response)
+        return response
+
+    # RECORD
+    def _record(self, key: str, response: requests.Response):
+        # reads the whole body, streaming consumers read it from memory
+        content = response.content
+        response.raw = _ReplayedBody(content)
+        entry = {'key': key,
+                 'status': response.status_code,
+                 'headers': {k: v for k, v in response.headers.items() if k.lower() not in SKIPPED_HEADERS},
+                 'elapsed': response.elapsed.total_seconds()}
+        entry.update(self._encode_content(content))
+        line = json.dumps(entry, separators=(',', ':')) + '\n'
+        with self._lock:
+            self._out.write(line)
+            self._recorded += 1
+
+    def _encode_content(self, content: bytes) -> dict:
+        if self._redact_fields:
+            try:
+                content = json.dumps(redact(json.loads(content), self._redact_fields)).encode('utf-8')
+            except ValueError:
+                pass
+        try:
+            return {'text': content.decode('utf-8')}
+        except UnicodeDecodeError:
+            return {'base64': base64.b64encode(content).decode('ascii')}
+
+    # REPLAY
+    def _load(self):
+        with gzip.open(self.cassette_path, 'rt', encoding='utf-8') as inp:
+            for line in inp:
+                entry = json.loads(line)
+                self._replay.setdefault(entry['key'], []).append(entry)
+                loose_key = _loose_key(entry['key'])
+                if loose_key != entry['key']:
+                    self._replay.setdefault(loose_key, []).append(entry)
+
+    def _next_entry(self, key: str) -> dict:
+        with self._lock:
+            if key not in self._replay:
+                key = _loose_key(key)
+            entries = self._replay.get(key)
+            if not entries:
+                raise CassetteMiss(f'Request not found in the cassette {self.cassette_path}: {key}')
+            position = self._replay_positions.get(key, 0)
+            # repeated requests get the recorded responses in order, the last one once they run out
+            self._replay_positions[key] = position + 1
+            self._count_request()
+            return entries[min(position, len(entries) - 1)]
+
+    def _replay_response(self, key: str, url: str) -> requests.Response:
+        entry = self._next_entry(key)
+        if self.latency_factor:
+            time.sleep(entry['elapsed'] * self.latency_factor)
+
+        if 'text' in entry:
+            content = entry['text'].encode('utf-8')
+        else:
+            content = base64.b64decode(entry['base64'])
+        response = requests.Response()
+        response.status_code = entry['status']
+        response.headers.update(entry['headers'])
+        response.url = url
+        response.encoding = 'utf-8'
+        response.elapsed = timedelta(seconds=entry['elapsed'])
+        response.raw = _ReplayedBody(content)
+        response._content = content
+        return response
+
+    def stats(self) -> dict:
+        if self.mode == MODE_RECORD:
+            return {**super().stats(), 'cassette': self.mode, 'recorded_responses': self._recorded}
+        return {'cassette': self.mode, 'requests': self._requests_sent}
+
+    def close(self):
+        with self._lock:
+            if self._out is not None:
+                self._out.close()
+                self._out = None
+        super().close()
@@ -1,16 +1,26 @@
+from __future__ import annotations
+
+import functools
 import logging
+import re
 from collections.abc import Iterable
-from datetime import datetime
+from datetime import datetime, timedelta
 from json import JSONDecodeError
-from typing import List, Optional
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterator, List, Optional, Tuple
 
-import numpy as np
-import pandas as pd
-from keboola.http_client import HttpClient
-from pandas import json_normalize
 from requests import Response
 
-from hubspot_api import client_v3
+from hubspot_api import client_v3, json_stream, paging, parallel, recovery
+from hubspot_api.transport import HttpTransport, SharedTransportClient
+from lazy_import import LazyModule
+
+if TYPE_CHECKING:
+    import numpy as np
+    import pandas as pd
+else:
+    # imported on the first use, not needed by the streamed endpoints
+    np = LazyModule('numpy')
+    pd = LazyModule('pandas')
 
 COMPANIES_DEFAULT_COLS = ["additionalDomains", "companyId", "isDeleted", "mergeAudits", "portalId", "stateChanges"]
 COMPANY_DEFAULT_PROPERTIES = ['about_us', 'name', 'phone', 'facebook_company_page', 'city', 'country', 'website',
@@ -73,6 +83,8 @@ EMAIL_EVENTS_COLS = ['appId', 'appName', 'browser', 'browser.family', 'browser.n
                      'ipAddress', 'location', 'location.city', 'location.country', 'location.state', 'portalId',
                      'recipient', 'sentBy.created', 'sentBy.id', 'smtpId', 'type', 'userAgent']
 
+# large email bodies, not extracted by default
+ENGAGEMENT_BODY_COLS = ['metadata.text', 'metadata.html']
 ENGAGEMENTS_COLS = ['metadata.isBot', 'metadata.endTime', 'metadata.postSendStatus', 'associations.quoteIds',
                     'metadata.from.raw', 'engagement.createdBy', 'metadata.to',
                     'metadata.agentResponseTimeMilliseconds', 'metadata.visitorStartTime', 'metadata.messageId',
@@ -101,9 +113,13 @@ ENGAGEMENTS_COLS = ['metadata.isBot', 'metadata.endTime', 'metadata.postSendStat
                     'engagement.teamId', 'metadata.to.email', 'metadata.calleeObjectId', 'metadata.calleeObjectType',
                     'metadata.emailSendEventId.created', 'metadata.emailSendEventId.id', 'metadata.errorMessage']
 
+# v3 engagement object types counted by the run planner
+ENGAGEMENT_V3_TYPES = {'calls': 'CALL', 'emails': 'EMAIL', 'meetings': 'MEETING', 'notes': 'NOTE', 'tasks': 'TASK'}
+
 CAMPAIGNS = 'email/public/v1/campaigns/'
 
 LISTS = 'contacts/v1/lists'
+LIST_CONTACTS = 'contacts/v1/lists/{list_id}/contacts/all'
 
 ENGAGEMENTS_PAGED = 'engagements/v1/engagements/paged'
 ENGAGEMENTS_PAGED_SINCE = 'engagements/v1/engagements/recent/modified'
@@ -119,24 +135,51 @@ DEALS_RECENT = 'deals/v1/deal/recent/modified'
 COMPANIES_ALL = 'companies/v2/companies/paged'
 COMPANIES_RECENT = 'companies/v2/companies/recent/modified'
 
-MAX_RETRIES = 10
+ISO_DATETIME_PATTERN = re.compile(r'^\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}(\.\d+)?Z$')
+
+# max records per DataFrame in the incremental JSON parsing mode
+STREAM_CHUNK_SIZE = 100
 BASE_URL = 'https://api.hubapi.com/'
 
 # endpoints
 CONTACTS_ALL = 'contacts/v1/lists/all/contacts/all'
 CONTACTS_RECENT = 'contacts/v1/lists/recently_updated/contacts/recent'
+# part of the window fetched from the recent contacts endpoint, the endpoint allows max 30 days back
+CONTACTS_RECENT_WINDOW_DAYS = 29
 
 COMPANY_PROPERTIES = 'properties/v1/companies/properties/'
-
-
-class HubspotClientService(HttpClient):
-
-    def __init__(self, token, authentication_type: str = "API Key"):
+CONTACT_PROPERTIES = 'properties/v1/contacts/properties'
+DEAL_PROPERTIES = 'properties/v1/deals/properties'
+OBJECT_PROPERTIES = {'companies': COMPANY_PROPERTIES, 'contacts': CONTACT_PROPERTIES, 'deals': DEAL_PROPERTIES}
+
+PIPELINES = 'deals/v1/pipelines'
+OWNERS = 'owners/v2/owners/'
+MARKETING_EMAILS_STATISTICS = 'marketing-emails/v1/emails/with-statistics'
+CONTACTS_SEARCH = 'crm/v3/objects/contacts/search'
+COMPANIES_SEARCH = 'crm/v3/objects/companies/search'
+# endpoints of the incrementally extracted objects
+CONTACTS_ENDPOINTS = [CONTACTS_ALL, CONTACTS_RECENT, CONTACTS_SEARCH]
+COMPANIES_ENDPOINTS = [COMPANIES_ALL, COMPANIES_RECENT, COMPANIES_SEARCH]
+ACCOUNT_DETAILS = 'account-info/v3/details'
+
+
+class HubspotClientService(SharedTransportClient):
+
+    def __init__(self, token, authentication_type: str = "API Key", stream_json: bool = False,
+                 adaptive_page_size: bool = False, transport: Optional[HttpTransport] = None,
+                 page_recovery: Optional[recovery.PageRecovery] = None):
         """
 
         Args:
             token:
             authentication_type: "API Key" or "Private App Token"
+            stream_json: Parse paged responses incrementally from the response stream instead of loading
+                the whole body into memory.
+            adaptive_page_size: Tune page sizes of paged endpoints within their max based on the observed
+                latency, payload size and errors.
+            transport: HTTP transport (connection pool) shared with the v3 client, a default one is created if not set.
+            page_recovery: Retry and quarantine policy of failed pages shared with the v3 client, failed pages
+                are retried with the default budgets and fail the run if not set.
         """
         if authentication_type == "API Key":
             default_params = {"hapikey": token}
@@ -145,10 +188,50 @@ class HubspotClientService(HttpClient):
             default_params = {}
             auth_header = {'Authorization': f'Bearer {token}'}
 
-        HttpClient.__init__(self, base_url=BASE_URL, max_retries=MAX_RETRIES, backoff_factor=0.3,
-                            status_forcelist=(429, 500, 502, 504, 524), default_params=default_params,
-                            auth_header=auth_header)
-        self._client_v3 = client_v3.ClientV3(token, authentication_type)
+        SharedTransportClient.__init__(self, BASE_URL, transport=transport, default_params=default_params,
+                                       auth_header=auth_header)
+        self._stream_json = stream_json
+        self._page_sizes = paging.PageSizeRegistry(adaptive=adaptive_page_size)
+        self._recovery = page_recovery or recovery.PageRecovery()
+        self._client_v3 = client_v3.ClientV3(token, authentication_type, stream_json=stream_json,
+                                             page_sizes=self._page_sizes, transport=self.transport,
+                                             page_recovery=self._recovery)
+
+    def get_transport_stats(self) -> dict:
+        """
+        Connection pool reuse statistics of the transport shared by both clients.
+        """
+        return self.transport.stats()
+
+    def get_page_size_stats(self) -> dict:
+        """
+        Page sizes and response statistics of all paged endpoints used in the run.
+        """
+        return self._page_sizes.stats()
+
+    def limit_page_sizes(self):
+        """
+        Halves the page sizes of all paged endpoints under memory pressure.
+        """
+        self._page_sizes.limit_all()
+
+    def release_page_sizes(self):
+        self._page_sizes.release_all()
+
+    def get_failed_pages(self) -> List[dict]:
+        """
+        Pages quarantined after repeated failures, see recovery.FAILED_PAGES_COLS.
+        """
+        return self._recovery.failed_pages
+
+    def get_recovery_stats(self) -> dict:
+        return self._recovery.stats()
+
+    def has_quarantined_pages(self, *endpoints: str) -> bool:
+        """
+        True if any page of the endpoints was quarantined, i.e. some of their records were skipped.
+        """
+        return self._recovery.quarantined_pages(endpoints) > 0
 
     def _parse_response_text(self, response: Response, endpoint, parameters) -> dict:
         try:
@@ -164,67 +247,137 @@ class HubspotClientService(HttpClient):
                                f'Status: {response.status_code}. '
                                f'Response: {response.text[start_pos:start_pos + 100]}... {e}')
 
-    def _get_paged_result_pages(self, endpoint, parameters, res_obj_name, limit_attr, offset_req_attr, offset_resp_attr,
-                                has_more_attr, offset, limit, default_cols=None):
+    @recovery.stop_on_quarantine
+    def _get_streamed_items(self, endpoint, parameters=None, prefix='item') -> Iterator[dict]:
+        """
+        Streams objects of a non-paged response one by one without loading the whole body into memory.
 
-        has_more = True
-        while has_more:
-            final_df = pd.DataFrame()
-            parameters[offset_req_attr] = offset
-            parameters[limit_attr] = limit
-
-            req = self.get_raw(self.base_url + endpoint, params=parameters)
-            self._check_http_result(req, endpoint)
-            req_response = self._parse_response_text(req, endpoint, parameters)
-            if req_response.get(has_more_attr):
-                has_more = True
-                offset = req_response[offset_resp_attr]
-            else:
-                has_more = False
-            if req_response.get(res_obj_name):
-                final_df = final_df.append(json_normalize(req_response[res_obj_name]), sort=True)
-            else:
+        Args:
+            endpoint: endpoint path
+            parameters: request parameters
+            prefix: ijson prefix of the returned objects, `item` for top level arrays.
+
+        Returns: Iterator of response objects
+
+        """
+
+        def request() -> Response:
+            response = self.get_raw(self.base_url + endpoint, params=parameters, stream=True)
+            self._check_http_result(response, endpoint)
+            return response
+
+        req = self._recovery.run(endpoint, parameters, request)
+        try:
+            yield from json_stream.iter_items(req, prefix)
+        except json_stream.JSONError as e:
+            raise RuntimeError(f'The HS API response is invalid. enpoint: {endpoint}, parameters: {parameters}. '
+                               f'Status: {req.status_code}. {e}')
+        finally:
+            req.close()
+
+    def _request_page(self, endpoint, parameters, limit_attr, pager: paging.AdaptivePageSize,
+                      stream: bool = False) -> Response:
+        """
+        Requests a single page with the page size (`limit_attr` parameter) chosen by the pager.
+        """
+
+        def send(size: int) -> Response:
+            parameters[limit_attr] = size
+            return self.get_raw(self.base_url + endpoint, params=parameters, stream=stream)
+
+        def request() -> Response:
+            response = paging.request_with_page_size(pager, send)
+            self._check_http_result(response, endpoint)
+            return response
+
+        return self._recovery.run(endpoint, parameters, request)
+
+    def _get_streamed_page(self, endpoint, parameters, res_obj_name, limit_attr, pager: paging.AdaptivePageSize,
+                           field_filter: Optional[json_stream.FieldFilter] = None
+                           ) -> Tuple[json_stream.StreamedPage, Response]:
+        """
+        Requests a single page and parses records of the `res_obj_name` array incrementally from the response stream.
+        """
+        req = self._request_page(endpoint, parameters, limit_attr, pager, stream=True)
+        page = json_stream.StreamedPage(req, res_obj_name,
+                                        error_context=f'enpoint: {endpoint}, parameters: {parameters}',
+                                        field_filter=field_filter)
+        return page, req
+
+    def _get_loaded_page(self, endpoint, parameters, res_obj_name, limit_attr,
+                         pager: paging.AdaptivePageSize) -> dict:
+        req = self._request_page(endpoint, parameters, limit_attr, pager)
+        req_response = self._parse_response_text(req, endpoint, parameters)
+        pager.on_page(req.elapsed.total_seconds(), len(req.content), len(req_response.get(res_obj_name) or []))
+        return req_response
+
+    def _get_page_dfs(self, endpoint, parameters, res_obj_name, limit_attr, pager: paging.AdaptivePageSize,
+                      default_cols=None, field_filter: Optional[json_stream.FieldFilter] = None
+                      ) -> Iterator[Tuple[pd.DataFrame, Optional[dict]]]:
+        """
+        Requests a single page and yields its records as DataFrame(s) along with the paging fields of the response.
+
+        In the incremental parsing mode the page is split into DataFrames of max STREAM_CHUNK_SIZE records and
+        the paging fields are returned with the last chunk, once the whole body is consumed. Fields rejected
+        by the `field_filter` are removed before the records are flattened.
+        """
+        if self._stream_json:
+            page, req = self._get_streamed_page(endpoint, parameters, res_obj_name, limit_attr, pager, field_filter)
+            last_chunk = None
+            for chunk in page.chunks(STREAM_CHUNK_SIZE):
+                if last_chunk:
+                    yield self._build_page_df(last_chunk, default_cols), None
+                last_chunk = chunk
+            pager.on_page(req.elapsed.total_seconds(), page.bytes_read, page.count)
+            if not last_chunk:
+                logging.debug(f'Empty response {page.meta}')
+            yield self._build_page_df(last_chunk, default_cols), page.meta
+        else:
+            req_response = self._get_loaded_page(endpoint, parameters, res_obj_name, limit_attr, pager)
+            records = req_response.get(res_obj_name)
+            if not records:
                 logging.debug(f'Empty response {req_response}')
-            if default_cols and not final_df.empty:
-                # dedupe
-                default_cols = list(set(default_cols))
-                final_df = final_df.reindex(columns=default_cols).fillna('')
-                # final_df = final_df.loc[:, default_cols].fillna('')
-            # sort cols
-            final_df = final_df.reindex(sorted(final_df.columns), axis=1)
-            yield final_df
-
-    def _get_paged_result_pages_dict(self, endpoint, parameters, res_obj_name, limit_attr, offset_req_attr,
-                                     offset_resp_attr, offset, limit, default_cols=None):
+            elif field_filter:
+                records = [field_filter.apply(r) for r in records]
+            yield self._build_page_df(records, default_cols), req_response
 
+    @staticmethod
+    def _build_page_df(records: Optional[List[dict]], default_cols=None) -> pd.DataFrame:
+        final_df = pd.DataFrame()
+        if records:
+            final_df = final_df.append(pd.json_normalize(records), sort=True)
+        if default_cols and not final_df.empty:
+            # dedupe
+            default_cols = list(set(default_cols))
+            final_df = final_df.reindex(columns=default_cols).fillna('')
+            # final_df = final_df.loc[:, default_cols].fillna('')
+        # sort cols
+        final_df = final_df.reindex(sorted(final_df.columns), axis=1)
+        return final_df
+
+    @recovery.stop_on_quarantine
+    def _get_paged_result_pages(self, endpoint, parameters, res_obj_name, limit_attr, offset_req_attr, offset_resp_attr,
+                                has_more_attr, offset, limit, default_cols=None,
+                                field_filter: Optional[json_stream.FieldFilter] = None):
+        """
+        `limit` is the max page size of the endpoint, the actual page size is chosen by the endpoint pager.
+        """
+        pager = self._page_sizes.get(endpoint, limit)
         has_more = True
         while has_more:
-            final_result = {}
             parameters[offset_req_attr] = offset
-            parameters[limit_attr] = limit
-
-            req = self.get_raw(self.base_url + endpoint, params=parameters)
-            self._check_http_result(req, endpoint)
-            req_response = self._parse_response_text(req, endpoint, parameters)
-
-            # paginate until there are some data
-            if req_response.get(res_obj_name):
-                logging.debug(
-                    f'totalCount:{req_response["totalCount"]}, offset:{req_response["offset"]}, '
-                    f'datalen: {len(req_response["objects"])}, total:{req_response["total"]}')
-                has_more = True
-                # https://legacydocs.hubspot.com/docs/methods/cms_email/get-all-marketing-email-statistics
-                # Use the limit of the previous request as the offset to get the next set of results.
-                offset = req_response[offset_resp_attr] + limit
-            else:
-                has_more = False
-            if req_response.get(res_obj_name):
-                final_result = req_response.get(res_obj_name)
-            else:
-                logging.debug(f'Empty response {req_response}')
-
-            yield final_result
 
+            for final_df, req_response in self._get_page_dfs(endpoint, parameters, res_obj_name, limit_attr, pager,
+                                                             default_cols, field_filter):
+                if req_response is not None:
+                    if req_response.get(has_more_attr):
+                        has_more = True
+                        offset = req_response[offset_resp_attr]
+                    else:
+                        has_more = False
+                yield final_df
+
+    @recovery.stop_on_quarantine
     def _get_contact_recent_pages(self, parameters, since_time_offset, limit, default_cols=None):
         """
         Recent contacts enpoint paginates backwards, from time offset back to 30 day ago.
@@ -232,43 +385,30 @@ class HubspotClientService(HttpClient):
 
         :param parameters:
         :param since_time_offset:
-        :param limit:
+        :param limit: max page size
         :param default_cols:
         :return:
         """
         res_obj_name = 'contacts'
         endpoint = CONTACTS_RECENT
+        pager = self._page_sizes.get(endpoint, limit)
         # start from today
         timeoffset = int(datetime.utcnow().timestamp() * 1000)
 
         has_more = True
         while has_more:
-            final_df = pd.DataFrame()
             parameters['timeOffset'] = timeoffset
-            parameters['count'] = limit
 
-            req = self.get_raw(self.base_url + endpoint, params=parameters)
-            self._check_http_result(req, endpoint)
-            req_response = self._parse_response_text(req, endpoint, parameters)
-            timeoffset = req_response.get('time-offset', since_time_offset)
+            for final_df, req_response in self._get_page_dfs(endpoint, parameters, res_obj_name, 'count', pager,
+                                                             default_cols):
+                if req_response is not None:
+                    timeoffset = req_response.get('time-offset', since_time_offset)
 
-            if req_response.get('has-more') and timeoffset >= since_time_offset:
-                has_more = True
-            else:
-                has_more = False
-
-            if req_response.get(res_obj_name):
-                final_df = final_df.append(json_normalize(req_response[res_obj_name]), sort=True)
-            else:
-                logging.debug(f'Empty response {req_response}')
-            if default_cols and not final_df.empty:
-                # dedupe
-                default_cols = list(set(default_cols))
-                final_df = final_df.reindex(columns=default_cols).fillna('')
-                # final_df = final_df.loc[:, default_cols].fillna('')
-            # sort cols
-            final_df = final_df.reindex(sorted(final_df.columns), axis=1)
-            yield final_df
+                    if req_response.get('has-more') and timeoffset >= since_time_offset:
+                        has_more = True
+                    else:
+                        has_more = False
+                yield final_df
 
     def _check_http_result(self, response, endpoint):
         http_error_msg = ''
@@ -292,7 +432,17 @@ class HubspotClientService(HttpClient):
             http_error_msg = u'Request to %s failed %s Client Error: %s' % (endpoint, response.status_code, reason)
 
         if http_error_msg:
-            raise RuntimeError(http_error_msg, response.text)
+            raise recovery.PageRequestError(f'{http_error_msg} Detail: {response.text[:1000]}', endpoint, response)
+
+    def _get_contact_properties_and_cols(self, property_attributes, fields=None) -> Tuple[List[str], List[str]]:
+        if not fields:
+            contact_properties = CONTACT_DEFAULT_PROPERTIES
+            expected_contact_cols = CONTACTS_DEFAULT_COLS + self._build_property_cols(
+                CONTACTS_DEFAULT_COLS, property_attributes)
+        else:
+            contact_properties = fields
+            expected_contact_cols = CONTACTS_DEFAULT_COLS + self._build_property_cols(fields, property_attributes)
+        return contact_properties, expected_contact_cols
 
     def get_contacts(self, property_attributes, start_time=None, fields=None,
                      show_list_membership: bool = True) -> Iterable:
@@ -306,13 +456,7 @@ class HubspotClientService(HttpClient):
         """
         offset = -1
 
-        if not fields:
-            contact_properties = CONTACT_DEFAULT_PROPERTIES
-            expected_contact_cols = CONTACTS_DEFAULT_COLS + self._build_property_cols(
-                CONTACTS_DEFAULT_COLS, property_attributes)
-        else:
-            contact_properties = fields
-            expected_contact_cols = CONTACTS_DEFAULT_COLS + self._build_property_cols(fields, property_attributes)
+        contact_properties, expected_contact_cols = self._get_contact_properties_and_cols(property_attributes, fields)
 
         parameters = {'property': contact_properties, 'formSubmissionMode': 'all',
                       'showListMemberships': show_list_membership}
@@ -332,9 +476,53 @@ class HubspotClientService(HttpClient):
                                                 'vid-offset', 'has-more', offset, 100,
                                                 default_cols=expected_contact_cols)
 
-    def get_companies(self, property_attributes, recent=None, fields=None):
+    def get_contacts_modified_since(self, property_attributes, start_time: datetime, fields=None,
+                                    show_list_membership: bool = True) -> Iterable:
+        """
+        Get contacts modified since start_time, for windows of arbitrary length without the full scan.
 
-        offset = 0
+        The part of the window within the last CONTACTS_RECENT_WINDOW_DAYS is fetched from the recent contacts
+        endpoint, the older part using the CRM search endpoint filtered by `lastmodifieddate`. Contacts returned
+        multiple times are deduplicated by `canonical-vid`, the first (most recent) version is kept.
+
+        Search results contain property values only, form submissions, list memberships and identity profiles
+        are available only for contacts from the recent endpoint.
+
+        :param start_time: datetime
+        :return: generator object with all available pages
+        """
+        recent_start = datetime.utcnow() - timedelta(days=CONTACTS_RECENT_WINDOW_DAYS)
+        seen_vids = set()
+        recent_pages = self.get_contacts(property_attributes, max(start_time, recent_start), fields,
+                                         show_list_membership)
+        yield from self._drop_seen_rows(recent_pages, 'canonical-vid', seen_vids)
+
+        if start_time < recent_start:
+            logging.info(f'Getting contacts modified between {start_time} and {recent_start} using search endpoint')
+            contact_properties, expected_contact_cols = self._get_contact_properties_and_cols(property_attributes,
+                                                                                              fields)
+            search_pages = (self._build_page_df([self._search_result_to_legacy(r, ['vid', 'canonical-vid'])
+                                                 for r in results], default_cols=expected_contact_cols)
+                            for results in self._client_v3.search_objects_modified_since(
+                'contacts', contact_properties, int(start_time.timestamp() * 1000),
+                modified_property='lastmodifieddate', modified_before=int(recent_start.timestamp() * 1000)))
+            try:
+                yield from self._drop_seen_rows(search_pages, 'canonical-vid', seen_vids)
+            except client_v3.SearchWindowExhausted as e:
+                logging.warning(f'{e} Falling back to the full scan of contacts.')
+                yield from self._drop_seen_rows(self.get_contacts(property_attributes, None, fields,
+                                                                  show_list_membership), 'canonical-vid', seen_vids)
+
+    @staticmethod
+    def _drop_seen_rows(pages: Iterable[pd.DataFrame], id_column: str, seen_ids: set) -> Iterable[pd.DataFrame]:
+        for page in pages:
+            if id_column in page.columns and not page.empty:
+                page = page.drop_duplicates(subset=[id_column])
+                page = page[~page[id_column].isin(seen_ids)]
+                seen_ids.update(page[id_column].tolist())
+            yield page
+
+    def _get_company_properties_and_cols(self, property_attributes, fields=None) -> Tuple[List[str], List[str]]:
         if not fields:
             company_properties = COMPANY_DEFAULT_PROPERTIES
             expected_company_cols = COMPANIES_DEFAULT_COLS + self._build_property_cols(
@@ -342,18 +530,18 @@ class HubspotClientService(HttpClient):
         else:
             company_properties = fields
             expected_company_cols = COMPANIES_DEFAULT_COLS + self._build_property_cols(fields, property_attributes)
+        return company_properties, expected_company_cols
+
+    def get_companies(self, property_attributes, recent=None, fields=None):
+
+        offset = 0
+        company_properties, expected_company_cols = self._get_company_properties_and_cols(property_attributes, fields)
 
         parameters = {'properties': company_properties}
 
         if property_attributes['include_versions']:
             parameters['propertiesWithHistory'] = company_properties
 
-        # # hubspot_api api allows only 30 days back, get all data if larger
-        # if start_time and (datetime.utcnow() - start_time).days >= 30:
-        #     recent = False
-        # else:
-        #     recent = True
-
         if recent:
             return self._get_paged_result_pages(COMPANIES_RECENT, parameters, 'results', 'count', 'offset',
                                                 'offset',
@@ -364,12 +552,61 @@ class HubspotClientService(HttpClient):
                                                 'offset',
                                                 'has-more', offset, 250, default_cols=expected_company_cols)
 
+    def get_companies_modified_since(self, property_attributes, modified_since: int, fields=None) -> Iterable:
+        """
+        Get companies modified since the given time (arbitrary window) using the CRM search endpoint.
+
+        Results are converted to the same columns as the full scan. The search endpoint returns property values only,
+        so the source / timestamp / versions attributes are left empty. Falls back to the full scan if the search
+        window can't be moved forward, companies already returned by the search are skipped.
+
+        :param modified_since: epoch milliseconds
+        :return: generator object with all available pages
+        """
+        company_properties, expected_company_cols = self._get_company_properties_and_cols(property_attributes, fields)
+        seen_ids = set()
+        search_pages = (self._build_page_df([self._search_result_to_legacy(r, ['companyId']) for r in results],
+                                            default_cols=expected_company_cols)
+                        for results in self._client_v3.search_objects_modified_since('companies', company_properties,
+                                                                                     modified_since))
+        try:
+            yield from self._drop_seen_rows(search_pages, 'companyId', seen_ids)
+        except client_v3.SearchWindowExhausted as e:
+            logging.warning(f'{e} Falling back to the full scan of companies.')
+            yield from self._drop_seen_rows(self.get_companies(property_attributes, False, fields), 'companyId',
+                                            seen_ids)
+
+    @staticmethod
+    def _search_result_to_legacy(result: dict, id_columns: List[str]) -> dict:
+        """
+        Converts v3 search result into the legacy (v1/v2) object structure, datetime values are converted
+        into epoch milliseconds as returned by the legacy endpoints.
+        """
+        legacy_object = {col: int(result['id']) for col in id_columns}
+        legacy_object['isDeleted'] = result.get('archived', False)
+        properties = {}
+        for name, value in (result.get('properties') or {}).items():
+            if isinstance(value, str) and ISO_DATETIME_PATTERN.match(value):
+                value = str(client_v3.iso_to_epoch_ms(value))
+            properties[name] = {'value': value}
+        legacy_object['properties'] = properties
+        return legacy_object
+
     def get_company_properties(self):
         req = self.get_raw(self.base_url + COMPANY_PROPERTIES)
         self._check_http_result(req, COMPANY_PROPERTIES)
         req_response = req.json()
         return req_response
 
+    def get_property_names(self, object_type: str) -> List[str]:
+        """
+        Returns names of all properties (incl. custom ones) of companies, contacts or deals.
+        """
+        endpoint = OBJECT_PROPERTIES[object_type]
+        req = self.get_raw(self.base_url + endpoint)
+        self._check_http_result(req, endpoint)
+        return [p['name'] for p in req.json() if not p.get('deleted')]
+
     def _build_property_cols(self, properties, property_attributes):
         # get flattened property cols
         prop_cols = []
@@ -393,13 +630,15 @@ class HubspotClientService(HttpClient):
             prop_cols.append('properties.' + p + '.versions')
         return prop_cols
 
-    def get_deals(self, property_attributes, start_time=None, fields=None) -> Iterable:
+    def get_deals(self, property_attributes, start_time=None, fields=None,
+                  include_associations: bool = True) -> Iterable:
         """
         Get either all available deals or recent ones specified by start_time.
 
         API supports more options, possible to extend in the future
         :type fields: list list of deal properties to get
         :param start_time: datetime
+        :param include_associations: include associated contacts, companies and deals
         :return: generator object with all available pages
         """
         offset = 0
@@ -417,7 +656,7 @@ class HubspotClientService(HttpClient):
         expected_deal_cols += self._build_property_cols(['dealstage'], property_attributes)
         parameters = {'properties': deal_properties,
                       'propertiesWithHistory': 'dealstage',
-                      'includeAssociations': 'true'}
+                      'includeAssociations': 'true' if include_associations else 'false'}
         if start_time:
             parameters['since'] = int(start_time.timestamp() * 1000)
             return self._get_paged_result_pages(DEALS_RECENT, parameters, 'results', 'count', 'offset',
@@ -430,7 +669,6 @@ class HubspotClientService(HttpClient):
                                                 offset, 250, default_cols=expected_deal_cols)
 
     def get_campaigns(self, recent=False):
-        final_df = pd.DataFrame()
         if recent:
             url = CAMPAIGNS_BY_ID_RECENT
         else:
@@ -439,13 +677,14 @@ class HubspotClientService(HttpClient):
         for res in self._get_paged_result_pages(url, {}, 'campaigns', 'limit', 'offset', 'offset', 'hasMore',
                                                 None,
                                                 1000):
-
+            # a frame per page, the campaigns of the previous pages are already written
+            final_df = pd.DataFrame()
             for index, row in res.iterrows():
                 req = self.get_raw(self.base_url + CAMPAIGNS + str(row['id']))
                 self._check_http_result(req, CAMPAIGNS)
                 req_response = req.json()
 
-                final_df = final_df.append(json_normalize(req_response), sort=True)
+                final_df = final_df.append(pd.json_normalize(req_response), sort=True)
             # add missing cols
             columns = ['counters.open', 'counters.click', 'id', 'name', 'counters.delivered',
                        'counters.processed', 'counters.sent', 'lastProcessingFinishedAt',
@@ -474,23 +713,124 @@ class HubspotClientService(HttpClient):
                                                         offset, 1000, default_cols=EMAIL_EVENTS_COLS):
                 yield open_ev
 
-    def get_activities(self, start_time: datetime) -> Iterable:
+    def get_activities(self, start_time: datetime, include_body: bool = False,
+                       columns: Optional[List[str]] = None) -> Iterable:
+        """
+        Get all engagements or the ones modified since start_time.
+
+        :param start_time: datetime
+        :param include_body: keep the email body fields (ENGAGEMENT_BODY_COLS), they are skipped at parse time otherwise
+        :param columns: optional subset of the flattened columns (e.g. engagement.type, metadata.subject), other fields
+                        are not parsed at all. engagement.id is always included.
+        :return: generator object with all available pages
+        """
         offset = 0
+        field_filter, default_cols = self._get_activities_field_filter(include_body, columns)
 
         if start_time:
-            pages = self._get_paged_result_pages(ENGAGEMENTS_PAGED_SINCE, {"since": int(start_time.timestamp() * 1000)},
-                                                 'results', 'count', 'offset', 'offset', 'hasMore', offset, 250,
-                                                 default_cols=ENGAGEMENTS_COLS)
+            return self._get_paged_result_pages(ENGAGEMENTS_PAGED_SINCE,
+                                                {"since": int(start_time.timestamp() * 1000)},
+                                                'results', 'count', 'offset', 'offset', 'hasMore', offset, 250,
+                                                default_cols=default_cols, field_filter=field_filter)
         else:
-            pages = self._get_paged_result_pages(ENGAGEMENTS_PAGED, {}, 'results', 'limit', 'offset', 'offset',
-                                                 'hasMore',
-                                                 offset, 250, default_cols=ENGAGEMENTS_COLS)
-        for pg_res in pages:
-            if 'metadata.text' in pg_res.columns:
-                pg_res.drop(['metadata.text'], 1)
-            if 'metadata.html' in pg_res.columns:
-                pg_res.drop(['metadata.html'], 1)
-            yield pg_res
+            return self._get_paged_result_pages(ENGAGEMENTS_PAGED, {}, 'results', 'limit', 'offset', 'offset',
+                                                'hasMore',
+                                                offset, 250, default_cols=default_cols, field_filter=field_filter)
+
+    @staticmethod
+    def _get_activities_field_filter(include_body: bool,
+                                     columns: Optional[List[str]]) -> Tuple[json_stream.FieldFilter, List[str]]:
+        if columns and 'engagement.id' not in columns:
+            columns = ['engagement.id'] + columns
+        field_filter = json_stream.FieldFilter(include=columns,
+                                               exclude=None if include_body else ENGAGEMENT_BODY_COLS)
+        default_cols = [c for c in (columns or ENGAGEMENTS_COLS) if field_filter.keep(c)]
+        return field_filter, default_cols
+
+    def get_activities_parallel(self, start_time: datetime, include_body: bool = False,
+                                columns: Optional[List[str]] = None,
+                                max_workers: int = parallel.DEFAULT_WORKERS) -> Iterable:
+        """
+        Same as get_activities, but the scan is split into partitions fetched concurrently.
+
+        Engagements modified since start_time are partitioned by offset ranges once the total count is known from
+        the first page. The full scan endpoint is paged by a cursor and can't be partitioned without changing
+        the columns or the engagement types of the output, so its pages are fetched and parsed ahead by a single
+        worker while the consumer writes the previous ones.
+
+        :return: generator object with all available pages in the order they are fetched
+        """
+        if not start_time:
+            logging.info('The full scan of activities is not partitioned, fetching ahead in a single worker')
+            return parallel.merge_partitions([functools.partial(self.get_activities, start_time, include_body,
+                                                                columns)], 1)
+
+        field_filter, default_cols = self._get_activities_field_filter(include_body, columns)
+        return self._get_offset_partitioned_pages(ENGAGEMENTS_PAGED_SINCE,
+                                                  {"since": int(start_time.timestamp() * 1000)},
+                                                  'results', 'count', 250, 'total', max_workers,
+                                                  functools.partial(self._build_filtered_page_df,
+                                                                    default_cols=default_cols,
+                                                                    field_filter=field_filter))
+
+    @recovery.stop_on_quarantine
+    def _get_offset_partitioned_pages(self, endpoint, parameters, res_obj_name, limit_attr, limit, total_attr,
+                                      max_workers: int, page_transform: Optional[Callable[[List[dict]], Any]] = None
+                                      ) -> Iterator[Any]:
+        """
+        Requests the first page and fetches the remaining `offset` pages up to the total count reported
+        in the `total_attr` field concurrently, in contiguous offset ranges with the page size of the first page.
+        The stride is the number of records the server returned, which may be capped below the requested size.
+
+        Pages are yielded in the order they are fetched, as lists of records or transformed by `page_transform`
+        in the worker threads.
+        """
+        page_transform = page_transform or (lambda records: records)
+        pager = self._page_sizes.get(endpoint, limit)
+        parameters = dict(parameters, offset=0)
+        first_page = self._get_loaded_page(endpoint, parameters, res_obj_name, limit_attr, pager)
+        first_records = first_page.get(res_obj_name) or []
+        # e.g. the recently modified engagements are capped at 100 records regardless of the requested count
+        page_size = len(first_records)
+        total = first_page.get(total_attr) or 0
+        yield page_transform(first_records)
+
+        offsets = list(range(page_size, total, page_size)) if page_size else []
+        if not offsets:
+            return
+
+        logging.info(f'Fetching {len(offsets)} remaining pages of {endpoint} in {max_workers} parallel partitions')
+
+        def request(page_parameters: dict) -> Response:
+            response = self.get_raw(self.base_url + endpoint, params=page_parameters)
+            self._check_http_result(response, endpoint)
+            return response
+
+        def get_pages(partition_offsets: List[int]) -> Iterator[Any]:
+            for offset in partition_offsets:
+                page_parameters = dict(parameters, offset=offset, **{limit_attr: page_size})
+                try:
+                    req = self._recovery.run(endpoint, page_parameters, functools.partial(request, page_parameters))
+                except recovery.PageQuarantined as e:
+                    # pages are independent, continue with the next offset
+                    logging.warning(f'{e} Continuing with the next page.')
+                    continue
+                req_response = self._parse_response_text(req, endpoint, page_parameters)
+                records = req_response.get(res_obj_name) or []
+                if len(records) < page_size and offset + page_size < total:
+                    logging.warning(f'{endpoint} returned {len(records)} records at offset {offset} instead of '
+                                    f'{page_size}, records modified during the scan may be missing.')
+                pager.on_page(req.elapsed.total_seconds(), len(req.content), len(records))
+                yield page_transform(records)
+
+        partitions = [functools.partial(get_pages, chunk) for chunk in parallel.split_evenly(offsets, max_workers)]
+        yield from parallel.merge_partitions(partitions, max_workers)
+
+    def _build_filtered_page_df(self, records: Optional[List[dict]], default_cols,
+                                field_filter: json_stream.FieldFilter) -> pd.DataFrame:
+        if records:
+            records = [field_filter.apply(r) for r in records]
+        return self._build_page_df(records, default_cols)
 
     def get_lists(self):
         offset = 0
@@ -498,53 +838,111 @@ class HubspotClientService(HttpClient):
         return self._get_paged_result_pages(LISTS, {}, 'lists', 'limit', 'offset', 'offset', 'has-more',
                                             offset, 250, default_cols=LISTS_COLS)
 
-    def get_pipelines(self, include_inactive=None):
-        final_df = pd.DataFrame()
-
-        req = self.get_raw('https://api.hubapi.com/deals/v1/pipelines', params={'include_inactive': include_inactive})
-        self._check_http_result(req, 'deals/pipelines')
-        req_response = req.json()
-
-        final_df = final_df.append(json_normalize(req_response), sort=True)
+    def get_list_updates(self) -> Iterator[Tuple[int, int]]:
+        """
+        Yields (listId, updatedAt) of all contact lists.
+        """
+        for page in self.get_lists():
+            if page.empty:
+                continue
+            for list_id, updated_at in zip(page['listId'].tolist(), page['updatedAt'].tolist()):
+                yield int(list_id), int(updated_at or 0)
+
+    def get_list_memberships(self, list_ids: List[int],
+                             max_workers: int = parallel.DEFAULT_WORKERS) -> Iterator[List[dict]]:
+        """
+        Fetches members of the given lists, lists are fetched concurrently.
 
-        return [final_df]
+        :return: generator of membership row lists (list_id, contact_vid, added_at) in the order they are fetched
+        """
+        partitions = [functools.partial(self._get_list_membership_pages, list_id) for list_id in list_ids]
+        return parallel.merge_partitions(partitions, max_workers)
+
+    @recovery.stop_on_quarantine
+    def _get_list_membership_pages(self, list_id: int) -> Iterator[List[dict]]:
+        endpoint = LIST_CONTACTS.format(list_id=list_id)
+        # not registered in the shared registry, each list is paged by a single worker
+        pager = paging.AdaptivePageSize(endpoint, 100, adaptive=self._page_sizes.adaptive)
+        # a single property keeps the pages small, only the contact ids are needed
+        parameters = {'property': 'lastmodifieddate', 'propertyMode': 'value_only'}
+        has_more = True
+        while has_more:
+            req_response = self._get_loaded_page(endpoint, parameters, 'contacts', 'count', pager)
+            yield [{'list_id': list_id,
+                    'contact_vid': contact.get('canonical-vid', contact.get('vid')),
+                    'added_at': contact.get('addedAt')} for contact in req_response.get('contacts') or []]
+            has_more = bool(req_response.get('has-more'))
+            parameters['vidOffset'] = req_response.get('vid-offset')
+
+    def get_pipelines(self, include_inactive=None) -> Iterator[dict]:
+        """
+        Streams deal pipelines one by one, including the nested `stages` list.
+        """
+        return self._get_streamed_items(PIPELINES, {'include_inactive': include_inactive})
 
-    def get_owners(self, include_inactive=True):
-        final_df = pd.DataFrame()
+    def get_portal_id(self) -> str:
+        req = self.get_raw(self.base_url + ACCOUNT_DETAILS)
+        self._check_http_result(req, ACCOUNT_DETAILS)
+        return str(req.json()['portalId'])
 
-        req = self.get_raw('https://api.hubapi.com/owners/v2/owners/', params={'include_inactive': include_inactive})
-        self._check_http_result(req, 'owners')
-        req_response = req.json()
+    def get_owners(self, include_inactive=True) -> Iterator[dict]:
+        """
+        Streams owners one by one.
+        """
+        return self._get_streamed_items(OWNERS, {'include_inactive': include_inactive})
 
-        final_df = final_df.append(json_normalize(req_response), sort=True)
+    def get_email_statistics(self, include_inactive=True, updated_since: Optional[int] = None,
+                             max_workers: int = parallel.DEFAULT_WORKERS) -> Iterator[List[dict]]:
+        """
+        Get marketing emails with statistics, optionally only the ones updated since `updated_since`.
 
-        return [final_df]
+        The `totalCount` of the first page is used to fetch the remaining pages concurrently.
 
-    def get_email_statistics(self, include_inactive=True, updated_since: Optional[int] = None):
+        :param updated_since: epoch milliseconds
+        :return: generator object with record lists of all available pages in the order they are fetched
+        """
         parameters = {}
         if updated_since:
             parameters = {"updated__gte": updated_since}
-        resp = self._get_paged_result_pages_dict('marketing-emails/v1/emails/with-statistics', parameters, 'objects',
-                                                 'limit',
-                                                 'offset', 'offset', 0, 250)
-
-        return resp
+        return self._get_offset_partitioned_pages(MARKETING_EMAILS_STATISTICS, parameters, 'objects', 'limit', 250,
+                                                  'totalCount', max_workers)
 
-    def get_v3_engagement_object(self, object_type: str, properties: List[str] = None):
-        return self._client_v3.get_engagement_object(object_type, properties)
+    def get_v3_engagement_object(self, object_type: str, properties: List[str] = None,
+                                 associations: List[str] = None):
+        return self._client_v3.get_engagement_object(object_type, properties, associations)
 
     def get_forms(self):
         return self._client_v3.get_forms()
 
-    def get_associations(self, from_object_type: str, to_object_type: str, ids: List[str]):
+    def count_objects(self, object_type: str, modified_since: Optional[int] = None) -> int:
+        """
+        Number of CRM objects (optionally modified since the epoch millis time) from a single search request.
+        """
+        modified_property = 'lastmodifieddate' if object_type == 'contacts' else 'hs_lastmodifieddate'
+        return self._client_v3.count_objects(object_type, modified_since, modified_property)
+
+    def count_activities(self, modified_since: Optional[int] = None) -> int:
+        """
+        Number of engagements of all v3 engagement types (optionally modified since the epoch millis time).
+        """
+        return sum(self.count_objects(object_type, modified_since) for object_type in ENGAGEMENT_V3_TYPES)
+
+    def get_associations(self, from_object_type: str, to_object_type: str, ids: List[str], api_version: str = 'v4'):
         """
 
                Args:
                    from_object_type: e.g. company, contact
                    to_object_type: e.g. company, contact
                    ids: List of IDs of from_object type
+                   api_version: v4 (association type IDs) or v3 (association type names)
 
                Returns: Result as dict
 
                """
-        return self._client_v3.get_associations(from_object_type, to_object_type, ids)
+        return self._client_v3.get_associations(from_object_type, to_object_type, ids, api_version)
+
+    def get_association_type_definitions(self, from_object_type: str, to_object_type: str) -> Dict[str, dict]:
+        """
+        Returns the v4 definitions (`typeId`, `label`, `category`) of the association types keyed by the v3 type name.
+        """
+        return self._client_v3.get_association_type_definitions(from_object_type, to_object_type)
@@ -1,13 +1,35 @@
 import json
 import logging
+from datetime import datetime
 from enum import Enum
-from typing import List, Union, Iterator
+from typing import Dict, Iterable, Iterator, List, Optional, Union
 
-from keboola.http_client import HttpClient
+from requests import Response
+
+from hubspot_api import json_stream, paging, recovery
+from hubspot_api.transport import HttpTransport, SharedTransportClient
 
-MAX_RETRIES = 10
 BASE_URL = 'https://api.hubapi.com/'
 
+# max number of results reachable by paging a single search query
+SEARCH_MAX_RESULTS = 10000
+SEARCH_PAGE_SIZE = 100
+
+
+class SearchWindowExhausted(Exception):
+    """
+    Raised when the search window can't be moved forward, e.g. more than 10k objects share the same modification date.
+    """
+
+
+def iso_to_epoch_ms(value: Optional[str]) -> Optional[int]:
+    """
+    Converts v3 API datetime value (e.g. 2023-01-01T10:00:00.123Z) into epoch milliseconds.
+    """
+    if not value:
+        return None
+    return int(datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp() * 1000)
+
 
 class EngagementObjects(Enum):
     calls = "calls"
@@ -38,14 +60,21 @@ class EngagementObjects(Enum):
         return True
 
 
-class ClientV3(HttpClient):
+class ClientV3(SharedTransportClient):
 
-    def __init__(self, token, authentication_type):
+    def __init__(self, token, authentication_type, stream_json: bool = False,
+                 page_sizes: Optional[paging.PageSizeRegistry] = None, transport: Optional[HttpTransport] = None,
+                 page_recovery: Optional[recovery.PageRecovery] = None):
         """
 
         Args:
             token:
             authentication_type: "API Key" or "Private App Token"
+            stream_json: Parse paged responses incrementally from the response stream. Pages are then returned
+                as lazy iterators instead of lists.
+            page_sizes: Page size registry shared with other clients, a fixed size registry is used if not set.
+            transport: Shared HTTP transport, a default one is created if not set.
+            page_recovery: Retry and quarantine policy of failed pages, default budgets without quarantine if not set.
         """
         if authentication_type == "API Key":
             default_params = {"hapikey": token}
@@ -53,20 +82,67 @@ class ClientV3(HttpClient):
         else:
             default_params = {}
             auth_header = {'Authorization': f'Bearer {token}'}
-        HttpClient.__init__(self, base_url=BASE_URL, max_retries=MAX_RETRIES, backoff_factor=0.3,
-                            status_forcelist=(429, 500, 502, 504, 524), default_params=default_params,
-                            auth_header=auth_header)
+        SharedTransportClient.__init__(self, BASE_URL, transport=transport, default_params=default_params,
+                                       auth_header=auth_header)
+        self._stream_json = stream_json
+        self._page_sizes = page_sizes or paging.PageSizeRegistry()
+        self._recovery = page_recovery or recovery.PageRecovery()
+
+    def _get_paged_result_pages(self, endpoint, parameters, limit=100, default_cols=None) -> Iterator[Iterable[dict]]:
+        if self._stream_json:
+            return self._get_streamed_result_pages(endpoint, parameters, limit)
 
-    def _get_paged_result_pages(self, endpoint, parameters, limit=100, default_cols=None) -> Iterator[List[dict]]:
+        return self._get_loaded_result_pages(endpoint, parameters, limit)
 
+    def _request_page(self, endpoint, parameters, pager: paging.AdaptivePageSize, stream: bool = False) -> Response:
+        """
+        Requests a single page with the `limit` chosen by the pager.
+        """
+
+        def send(size: int) -> Response:
+            parameters['limit'] = size
+            return self.get_raw(self.base_url + endpoint, params=parameters, stream=stream)
+
+        def request() -> Response:
+            response = paging.request_with_page_size(pager, send)
+            self._check_http_result(response, endpoint)
+            return response
+
+        return self._recovery.run(endpoint, parameters, request)
+
+    @recovery.stop_on_quarantine
+    def _get_streamed_result_pages(self, endpoint, parameters, limit=100) -> Iterator[Iterable[dict]]:
+        """
+        Yields pages as lazy iterators parsed from the response stream. The next page is requested
+        once the previous one is consumed.
+        """
+        pager = self._page_sizes.get(endpoint, limit)
         has_more = True
         while has_more:
-            parameters['limit'] = limit
+            req = self._request_page(endpoint, parameters, pager, stream=True)
+            page = json_stream.StreamedPage(req, 'results', error_context=f'endpoint: {endpoint}')
+            yield page
+
+            after = page.drain().get('paging.next.after')
+            pager.on_page(req.elapsed.total_seconds(), page.bytes_read, page.count)
+            if after:
+                has_more = True
+                parameters['after'] = after
+            else:
+                has_more = False
+                if not page.count:
+                    logging.debug(f'Empty response {page.meta}')
+
+    @recovery.stop_on_quarantine
+    def _get_loaded_result_pages(self, endpoint, parameters, limit=100) -> Iterator[List[dict]]:
 
-            req = self.get_raw(self.base_url + endpoint, params=parameters)
-            self._check_http_result(req, endpoint)
+        pager = self._page_sizes.get(endpoint, limit)
+        has_more = True
+        while has_more:
+            req = self._request_page(endpoint, parameters, pager)
             resp_text = str.encode(req.text, 'utf-8')
             req_response = json.loads(resp_text)
+            pager.on_page(req.elapsed.total_seconds(), len(resp_text), len(req_response.get('results') or []))
 
             if req_response.get('paging', {}).get('next', {}).get('after'):
                 has_more = True
@@ -100,7 +176,7 @@ class ClientV3(HttpClient):
             reason = response.reason
 
         if response.status_code >= 400:
-            error_detail = response.json()['message'] + f' Errors: {response.json()["errors"]}'
+            error_detail = self._get_error_detail(response)
         if 401 == response.status_code:
             http_error_msg = f'Failed to login: {reason} - Please check your API token'
         elif 401 < response.status_code < 500:
@@ -112,7 +188,17 @@ class ClientV3(HttpClient):
                              f'Detail: {error_detail}'
 
         if http_error_msg:
-            raise RuntimeError(http_error_msg)
+            raise recovery.PageRequestError(http_error_msg, endpoint, response)
+
+    @staticmethod
+    def _get_error_detail(response: Response) -> str:
+        try:
+            body = response.json()
+        except ValueError:
+            return response.text[:1000]
+        if not isinstance(body, dict):
+            return str(body)[:1000]
+        return f'{body.get("message", "")} Errors: {body.get("errors", [])}'
 
     def get_forms(self, archived: bool = False, form_types: List[str] = None) -> Iterator[List[dict]]:
         request_params = {"archived": archived}
@@ -131,7 +217,16 @@ class ClientV3(HttpClient):
 
         return self._get_paged_result_pages('crm/v3/objects/calls', request_params)
 
-    def get_engagement_object(self, object_type: Union[EngagementObjects, str], properties: List[str] = None):
+    def get_engagement_object(self, object_type: Union[EngagementObjects, str], properties: List[str] = None,
+                              associations: List[str] = None):
+        """
+
+        Args:
+            object_type: engagement object type
+            properties: properties to return
+            associations: object types whose associated IDs are returned inline in the `associations` field
+                          of each result, e.g. contact, company
+        """
 
         if isinstance(object_type, str):
             EngagementObjects.validate_field(object_type)
@@ -142,24 +237,158 @@ class ClientV3(HttpClient):
         if properties:
             properties_str = ','.join(properties)
             request_params['properties'] = properties_str
+        if associations:
+            request_params['associations'] = ','.join(associations)
 
         return self._get_paged_result_pages(f'crm/v3/objects/{object_type}', request_params)
 
-    def get_associations(self, from_object_type: str, to_object_type: str, ids: List[str]) -> dict:
+    def _request_search_page(self, endpoint: str, body: dict, pager: paging.AdaptivePageSize) -> Response:
+
+        def send(size: int) -> Response:
+            body['limit'] = size
+            return self.post_raw(self.base_url + endpoint, json=body)
+
+        def request() -> Response:
+            response = paging.request_with_page_size(pager, send)
+            self._check_http_result(response, endpoint)
+            return response
+
+        return self._recovery.run(endpoint, body, request)
+
+    @recovery.stop_on_quarantine
+    def search_objects_modified_since(self, object_type: str, properties: List[str], modified_since: int,
+                                      modified_property: str = 'hs_lastmodifieddate',
+                                      modified_before: Optional[int] = None) -> Iterator[List[dict]]:
+        """
+        Scans objects modified since the given time using the CRM search endpoint, sorted by the modification date.
+
+        A single search query can be paged only up to 10k results, so whenever the limit is reached the query window
+        is moved to the modification date of the last returned object. Objects on the window boundary may be returned
+        twice.
+
+        Args:
+            object_type: e.g. companies, contacts, deals
+            properties: properties to return
+            modified_since: epoch milliseconds
+            modified_property: modification date property of the object type
+            modified_before: optional epoch milliseconds, only objects modified before this time are returned
+
+        Returns: Iterator of result pages
+
+        Raises: SearchWindowExhausted if the window can't be moved forward.
+
+        """
+        endpoint = f'crm/v3/objects/{object_type}/search'
+        pager = self._page_sizes.get(endpoint, SEARCH_PAGE_SIZE)
+        properties = list(properties)
+        if modified_property not in properties:
+            properties.append(modified_property)
+
+        window_start = modified_since
+        after = 0
+        while True:
+            filters = [{'propertyName': modified_property, 'operator': 'GTE', 'value': str(window_start)}]
+            if modified_before is not None:
+                filters.append({'propertyName': modified_property, 'operator': 'LT', 'value': str(modified_before)})
+            body = {'filterGroups': [{'filters': filters}],
+                    'sorts': [{'propertyName': modified_property, 'direction': 'ASCENDING'}],
+                    'properties': properties,
+                    'after': after}
+            req = self._request_search_page(endpoint, body, pager)
+            req_response = req.json()
+            results = req_response.get('results') or []
+            pager.on_page(req.elapsed.total_seconds(), len(req.content), len(results))
+            yield results
+
+            next_after = req_response.get('paging', {}).get('next', {}).get('after')
+            if not next_after:
+                return
+
+            if int(next_after) + pager.size > SEARCH_MAX_RESULTS:
+                new_start = None
+                if results:
+                    new_start = iso_to_epoch_ms(results[-1].get('properties', {}).get(modified_property))
+                if new_start is None or new_start <= window_start:
+                    raise SearchWindowExhausted(f'Search of {object_type} exceeded {SEARCH_MAX_RESULTS} results '
+                                                f'modified at {window_start}.')
+                logging.debug(f'Search of {object_type} reached the results limit, moving window to {new_start}')
+                window_start = new_start
+                after = 0
+            else:
+                after = next_after
+
+    def count_objects(self, object_type: str, modified_since: Optional[int] = None,
+                      modified_property: str = 'hs_lastmodifieddate') -> int:
+        """
+        Returns the number of objects, optionally only the ones modified since the given time, using a single
+        search request.
+
+        Args:
+            object_type: e.g. companies, contacts, deals, calls
+            modified_since: optional epoch milliseconds
+            modified_property: modification date property of the object type
+        """
+        endpoint = f'crm/v3/objects/{object_type}/search'
+        filter_groups = []
+        if modified_since is not None:
+            filter_groups.append({'filters': [{'propertyName': modified_property, 'operator': 'GTE',
+                                               'value': str(modified_since)}]})
+        body = {'filterGroups': filter_groups, 'properties': [modified_property], 'limit': 1}
+
+        def request() -> Response:
+            response = self.post_raw(self.base_url + endpoint, json=body)
+            self._check_http_result(response, endpoint)
+            return response
+
+        return int(self._recovery.run(endpoint, body, request).json().get('total') or 0)
+
+    def get_associations(self, from_object_type: str, to_object_type: str, ids: List[str],
+                         api_version: str = 'v4') -> dict:
         """
 
         Args:
             from_object_type: e.g. company, contact
             to_object_type: e.g. company, contact
             ids: List of IDs of from_object type
+            api_version: v4 returns the association type IDs and labels, v3 the association type names
+                         (e.g. call_to_contact) as returned inline with the objects
 
         Returns: Result as dict
 
         """
+        endpoint = f'crm/{api_version}/associations/{from_object_type}/{to_object_type}/batch/read'
         body = {'inputs': [{"id": id_value} for id_value in ids]}
 
-        resp = self.post_raw(f'/crm/v4/associations/{from_object_type}/{to_object_type}/batch/read', json=body)
+        def request() -> Response:
+            response = self.post_raw(self.base_url + endpoint, json=body)
+            self._check_http_result(response, endpoint)
+            return response
 
-        resp.raise_for_status()
+        return self._recovery.run(endpoint, {'ids': len(ids)}, request).json()['results']
 
-        return resp.json()['results']
+    def get_association_type_definitions(self, from_object_type: str, to_object_type: str) -> Dict[str, dict]:
+        """
+        Returns the association types between the object types keyed by the v3 type name (e.g. call_to_contact),
+        as returned inline with the objects and by the v3 batch reads.
+
+        Args:
+            from_object_type: e.g. call, email
+            to_object_type: e.g. contact, company
+
+        Returns: v4 definitions of the types, dicts with `typeId`, `label` and `category`
+
+        """
+        names = self._get_association_results(f'crm/v3/associations/{from_object_type}/{to_object_type}/types')
+        labels = {str(definition.get('typeId')): definition for definition in self._get_association_results(
+            f'crm/v4/associations/{from_object_type}/{to_object_type}/labels')}
+        return {association_type.get('name'): labels.get(str(association_type.get('id')),
+                                                         {'typeId': association_type.get('id')})
+                for association_type in names}
+
+    def _get_association_results(self, endpoint: str) -> List[dict]:
+        def request() -> Response:
+            response = self.get_raw(self.base_url + endpoint)
+            self._check_http_result(response, endpoint)
+            return response
+
+        return self._recovery.run(endpoint, {}, request).json().get('results') or []
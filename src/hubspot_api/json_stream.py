@@ -0,0 +1,161 @@
+"""
+Incremental parsing of HubSpot API response bodies.
+
+The response body is consumed directly from the underlying socket stream, so only the currently parsed item
+is held in memory instead of the whole response text and the complete object tree.
+"""
+from typing import Iterable, Iterator, List, Optional
+
+import ijson
+from requests import Response
+
+JSONError = ijson.JSONError
+
+SCALAR_EVENTS = ('null', 'boolean', 'integer', 'double', 'number', 'string')
+
+
+def iter_items(response: Response, prefix: str = 'item') -> Iterator[dict]:
+    """
+    Yields objects located at the `prefix` path of the response body one by one.
+
+    Args:
+        response: Response of a request sent with `stream=True`
+        prefix: ijson prefix of the objects, e.g. `item` for top level array, `results.item` for the `results` array.
+
+    Returns: Iterator of parsed objects
+
+    """
+    # let urllib3 handle gzip / deflate content encoding
+    response.raw.decode_content = True
+    return ijson.items(response.raw, prefix, use_float=True)
+
+
+class FieldFilter:
+    """
+    Selects fields of parsed records by their dotted paths (e.g. `metadata.text`, array items are addressed
+    as `<path>.item`, same as ijson prefixes).
+
+    A field is kept if it is not under any `exclude` path and it is an ancestor or a descendant of any `include`
+    path (all fields if `include` is not set).
+    """
+
+    def __init__(self, include: Optional[Iterable[str]] = None, exclude: Optional[Iterable[str]] = None):
+        self.include = list(include) if include else None
+        self.exclude = list(exclude or [])
+        self._cache = {}
+
+    def keep(self, path: str) -> bool:
+        if path not in self._cache:
+            self._cache[path] = self._keep(path)
+        return self._cache[path]
+
+    def _keep(self, path: str) -> bool:
+        if any(path == e or path.startswith(e + '.') for e in self.exclude):
+            return False
+        if self.include is None:
+            return True
+        return any(path == i or path.startswith(i + '.') or i.startswith(path + '.') for i in self.include)
+
+    def apply(self, record, path: str = ''):
+        """
+        Returns the record with the unwanted fields removed. Used for records that are already parsed.
+        """
+        if isinstance(record, dict):
+            result = {}
+            for key, value in record.items():
+                child_path = f'{path}.{key}' if path else key
+                if self.keep(child_path):
+                    result[key] = self.apply(value, child_path)
+            return result
+        if isinstance(record, list):
+            child_path = f'{path}.item' if path else 'item'
+            return [self.apply(value, child_path) for value in record]
+        return record
+
+
+class StreamedPage:
+    """
+    Single page of a paged response parsed incrementally from the response stream.
+
+    Iterating the page yields records of the `array_name` array one by one. All scalar values outside of the array
+    (e.g. `has-more`, `vid-offset`, `paging.next.after`) are collected in `meta` keyed by their dotted path, so paging
+    fields are available once the page is consumed, regardless of whether they precede or follow the array.
+
+    Record fields rejected by the optional `field_filter` are skipped at parse time and never materialized.
+    """
+
+    def __init__(self, response: Response, array_name: str, error_context: str = '',
+                 field_filter: Optional[FieldFilter] = None):
+        self.meta = {}
+        self.count = 0
+        self.bytes_read = 0
+        self._response = response
+        self._array_name = array_name
+        self._error_context = error_context
+        self._field_filter = field_filter
+        self._items = self._parse()
+
+    def __iter__(self) -> Iterator[dict]:
+        return self._items
+
+    def chunks(self, size: int) -> Iterator[List[dict]]:
+        """
+        Yields records in lists of max `size` items.
+        """
+        chunk = []
+        for item in self._items:
+            chunk.append(item)
+            if len(chunk) >= size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    def drain(self) -> dict:
+        """
+        Consumes the rest of the page and returns the collected paging fields.
+        """
+        for _ in self._items:
+            pass
+        return self.meta
+
+    def _parse(self) -> Iterator[dict]:
+        item_prefix = f'{self._array_name}.item'
+        array_prefix = f'{self._array_name}.'
+        field_prefix_len = len(item_prefix) + 1
+        field_filter = self._field_filter
+        builder = None
+        self._response.raw.decode_content = True
+        try:
+            for prefix, event, value in ijson.parse(self._response.raw, use_float=True):
+                if builder is not None:
+                    if prefix == item_prefix:
+                        builder.event(event, value)
+                        if event in ('end_map', 'end_array'):
+                            self.count += 1
+                            yield builder.value
+                            builder = None
+                    elif field_filter is None or event == 'map_key' or field_filter.keep(prefix[field_prefix_len:]):
+                        # keys of skipped values are overwritten by the next key
+                        builder.event(event, value)
+                elif prefix == item_prefix:
+                    if event in ('start_map', 'start_array'):
+                        builder = ijson.ObjectBuilder()
+                        builder.event(event, value)
+                    else:
+                        self.count += 1
+                        yield value
+                elif event in SCALAR_EVENTS and not prefix.startswith(array_prefix):
+                    self.meta[prefix] = value
+        except JSONError as e:
+            raise RuntimeError(f'The HS API response is invalid. {self._error_context}. '
+                               f'Status: {self._response.status_code}. {e}')
+        finally:
+            self.bytes_read = self._tell()
+            self._response.close()
+
+    def _tell(self) -> int:
+        try:
+            return self._response.raw.tell()
+        except (AttributeError, OSError, ValueError):
+            return 0
@@ -0,0 +1,174 @@
+"""
+Adaptive page sizing of paged endpoints.
+"""
+import logging
+import threading
+from typing import Callable, Optional
+
+from requests import Response
+from requests.exceptions import RequestException
+
+# page sizes are never tuned below this value
+MIN_PAGE_SIZE = 10
+# pages slower than this are considered heavy and the page size is decreased
+TARGET_LATENCY_S = 5.0
+# pages larger than this are considered heavy and the page size is decreased
+MAX_PAYLOAD_BYTES = 20 * 1024 * 1024
+# max number of page size reductions after a failed request
+MAX_ERROR_RETRIES = 3
+
+
+class AdaptivePageSize:
+    """
+    Tunes the page size (`count` / `limit` parameter) of a single endpoint within its allowed maximum.
+
+    The size is decreased multiplicatively on errors and on slow or large responses and increased gradually back
+    towards the maximum while the responses stay fast and small. If `adaptive` is False the maximum size is always
+    used and only the statistics are collected.
+
+    The pager of an endpoint is shared by all threads fetching the endpoint (partitions, column groups), the updates
+    are serialized by a lock.
+    """
+
+    def __init__(self, endpoint: str, max_size: int, adaptive: bool = True, min_size: int = MIN_PAGE_SIZE,
+                 target_latency: float = TARGET_LATENCY_S, max_payload: int = MAX_PAYLOAD_BYTES):
+        self.endpoint = endpoint
+        self.max_size = max_size
+        self.min_size = min(min_size, max_size)
+        self.adaptive = adaptive
+        self.target_latency = target_latency
+        self.max_payload = max_payload
+        self.size = max_size
+        # upper bound of the size under memory pressure
+        self._limit: Optional[int] = None
+
+        self._consecutive_errors = 0
+        self._pages = 0
+        self._errors = 0
+        self._records = 0
+        self._latency_total = 0.0
+        self._payload_total = 0
+        self._sizes_used = set()
+        self._lock = threading.Lock()
+
+    def on_page(self, latency: float, payload_bytes: int, records: int):
+        """
+        Records a successfully downloaded page and adjusts the size of the next page.
+
+        Args:
+            latency: response time in seconds
+            payload_bytes: size of the response body
+            records: number of records in the page
+        """
+        with self._lock:
+            self._consecutive_errors = 0
+            self._pages += 1
+            self._records += records
+            self._latency_total += latency
+            self._payload_total += payload_bytes
+            self._sizes_used.add(self.size)
+
+            if not self.adaptive:
+                return
+
+            if latency > self.target_latency or payload_bytes > self.max_payload:
+                self._resize(int(self.size * 0.75))
+            elif latency < self.target_latency / 2 and payload_bytes < self.max_payload / 2 and records >= self.size:
+                self._resize(int(self.size * 1.5))
+
+    def on_error(self) -> bool:
+        """
+        Records a failed request and decreases the page size.
+
+        Returns: True if the request should be retried with the decreased page size.
+
+        """
+        with self._lock:
+            self._errors += 1
+            self._consecutive_errors += 1
+            if not self.adaptive or self.size <= self.min_size or self._consecutive_errors > MAX_ERROR_RETRIES:
+                return False
+
+            self._resize(self.size // 2)
+            return True
+
+    def limit(self, factor: float = 0.5):
+        """
+        Decreases the size and keeps it at most at the decreased value until `release_limit` is called.
+        Used under memory pressure, applies also to pagers that are not adaptive.
+        """
+        with self._lock:
+            self._limit = max(self.min_size, int(self.size * factor))
+            self._resize(self._limit)
+
+    def release_limit(self):
+        with self._lock:
+            self._limit = None
+            if not self.adaptive:
+                self.size = self.max_size
+
+    def _resize(self, new_size: int):
+        new_size = max(self.min_size, min(self._limit or self.max_size, new_size))
+        if new_size != self.size:
+            logging.debug(f'Changing page size of {self.endpoint} from {self.size} to {new_size}')
+        self.size = new_size
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'max_size': self.max_size,
+                    'last_size': self.size,
+                    'sizes_used': sorted(self._sizes_used),
+                    'pages': self._pages,
+                    'records': self._records,
+                    'errors': self._errors,
+                    'avg_latency_s': round(self._latency_total / self._pages, 3) if self._pages else 0,
+                    'avg_payload_bytes': int(self._payload_total / self._pages) if self._pages else 0}
+
+
+class PageSizeRegistry:
+    """
+    Keeps a single AdaptivePageSize instance per endpoint for the whole run.
+    """
+
+    def __init__(self, adaptive: bool = False):
+        self.adaptive = adaptive
+        self._pagers = {}
+        self._lock = threading.Lock()
+
+    def get(self, endpoint: str, max_size: int) -> AdaptivePageSize:
+        with self._lock:
+            if endpoint not in self._pagers:
+                self._pagers[endpoint] = AdaptivePageSize(endpoint, max_size, adaptive=self.adaptive)
+            return self._pagers[endpoint]
+
+    def limit_all(self, factor: float = 0.5):
+        for pager in list(self._pagers.values()):
+            pager.limit(factor)
+
+    def release_all(self):
+        for pager in list(self._pagers.values()):
+            pager.release_limit()
+
+    def stats(self) -> dict:
+        return {endpoint: p.stats() for endpoint, p in list(self._pagers.items())}
+
+
+def request_with_page_size(pager: AdaptivePageSize, send: Callable[[int], Response]) -> Response:
+    """
+    Sends a page request sized by the pager. Requests failing on connection errors, timeouts or exhausted retries
+    are repeated with a decreased page size while the pager allows it.
+
+    Args:
+        pager: page size controller of the endpoint
+        send: function sending the request with the given page size
+
+    Returns: response
+
+    """
+    while True:
+        try:
+            return send(pager.size)
+        except RequestException as e:
+            if not pager.on_error():
+                raise
+            logging.warning(f'Request to {pager.endpoint} failed: {e}. Retrying with page size {pager.size}.')
@@ -0,0 +1,118 @@
+"""
+Concurrent fetching of independent partitions of an endpoint.
+"""
+import queue
+import threading
+from typing import Callable, Iterable, Iterator, List, TypeVar
+
+T = TypeVar('T')
+
+DEFAULT_WORKERS = 5
+# max number of fetched items waiting for the consumer per worker
+QUEUE_SIZE_PER_WORKER = 2
+_PUT_TIMEOUT_S = 0.5
+
+# cleared under memory pressure, the workers then fetch ahead only while the consumer has nothing to process
+_fetch_ahead = threading.Event()
+_fetch_ahead.set()
+
+
+def pause_fetch_ahead():
+    _fetch_ahead.clear()
+
+
+def resume_fetch_ahead():
+    _fetch_ahead.set()
+
+
+class _WorkerFinished:
+
+    def __init__(self, error: BaseException = None):
+        self.error = error
+
+
+def merge_partitions(partitions: List[Callable[[], Iterable[T]]], max_workers: int = DEFAULT_WORKERS) -> Iterator[T]:
+    """
+    Iterates the partitions concurrently and yields their items in the order they are fetched.
+
+    Each partition is a function returning an iterable (e.g. a page generator) that is consumed in a worker thread.
+    The number of items waiting for the consumer is bounded, so the workers pause when the consumer is slower.
+    The first error raised by any partition stops the other workers and is re-raised to the consumer.
+
+    Args:
+        partitions: functions returning the partition iterables
+        max_workers: max number of partitions fetched at the same time
+
+    Returns: Iterator of items of all partitions
+
+    """
+    if not partitions:
+        return
+
+    max_workers = max(1, min(max_workers, len(partitions)))
+    items = queue.Queue(maxsize=max_workers * QUEUE_SIZE_PER_WORKER)
+    pending = queue.Queue()
+    for partition in partitions:
+        pending.put(partition)
+    stop = threading.Event()
+
+    def put(item) -> bool:
+        while not stop.is_set():
+            if not _fetch_ahead.is_set() and not items.empty():
+                _fetch_ahead.wait(_PUT_TIMEOUT_S)
+                continue
+            try:
+                items.put(item, timeout=_PUT_TIMEOUT_S)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def work():
+        error = None
+        try:
+            while not stop.is_set():
+                try:
+                    partition = pending.get_nowait()
+                except queue.Empty:
+                    break
+                for item in partition():
+                    if not put(item):
+                        break
+        except BaseException as e:  # re-raised in the consumer thread
+            error = e
+        put(_WorkerFinished(error))
+
+    workers = [threading.Thread(target=work, daemon=True) for _ in range(max_workers)]
+    for worker in workers:
+        worker.start()
+
+    finished = 0
+    try:
+        while finished < len(workers):
+            item = items.get()
+            if isinstance(item, _WorkerFinished):
+                finished += 1
+                if item.error is not None:
+                    raise item.error
+                continue
+            yield item
+    finally:
+        stop.set()
+        for worker in workers:
+            worker.join()
+
+
+def split_evenly(values: List[T], parts: int) -> List[List[T]]:
+    """
+    Splits the values into max `parts` contiguous non-empty chunks of similar size.
+    """
+    parts = max(1, min(parts, len(values)))
+    size, rest = divmod(len(values), parts)
+    chunks = []
+    start = 0
+    for i in range(parts):
+        end = start + size + (1 if i < rest else 0)
+        chunks.append(values[start:end])
+        start = end
+    return [c for c in chunks if c]
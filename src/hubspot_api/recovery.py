@@ -0,0 +1,191 @@
+"""
+Page level recovery of failed requests.
+
+Requests failing with a retryable error (429, 5xx, connection errors and timeouts) after the transport level retries
+are repeated with a jittered exponential backoff, honoring the `Retry-After` header. Each endpoint has a retry budget
+shared by all its pages. Pages that keep failing may be quarantined: the failure is recorded for the report table
+and the paging of the endpoint stops, so the other endpoints can still complete.
+"""
+import functools
+import json
+import logging
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Callable, Dict, Iterable, List, Optional
+
+from requests import Response
+from requests.exceptions import RequestException
+
+DEFAULT_MAX_PAGE_ATTEMPTS = 3
+DEFAULT_ENDPOINT_RETRY_BUDGET = 20
+DEFAULT_BASE_DELAY_S = 2.0
+DEFAULT_MAX_DELAY_S = 120.0
+
+FAILED_PAGES_COLS = ['endpoint', 'parameters', 'status_code', 'error', 'attempts', 'failed_at']
+
+
+class PageRequestError(RuntimeError):
+    """
+    Request of a page failed with an HTTP error status.
+    """
+
+    def __init__(self, message: str, endpoint: str, response: Response):
+        super().__init__(message)
+        self.endpoint = endpoint
+        self.response = response
+        self.status_code = response.status_code
+
+
+class PageQuarantined(RuntimeError):
+    """
+    Page kept failing and was quarantined, the paging of the endpoint can't continue.
+    """
+
+
+def is_retryable(error: Exception) -> bool:
+    if isinstance(error, PageRequestError):
+        return error.status_code == 429 or error.status_code >= 500
+    return isinstance(error, RequestException)
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """
+    Returns the `Retry-After` header value (delay seconds or HTTP date) in seconds.
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+def backoff_delay(attempt: int, base_delay: float, max_delay: float) -> float:
+    """
+    Exponential backoff with full jitter.
+    """
+    return random.uniform(0, min(max_delay, base_delay * 2 ** (attempt - 1)))
+
+
+class PageRecovery:
+    """
+    Retries failed page requests within per-endpoint retry budgets and quarantines pages that keep failing.
+    Shared by both API clients, thread safe.
+    """
+
+    def __init__(self, max_page_attempts: int = DEFAULT_MAX_PAGE_ATTEMPTS,
+                 endpoint_retry_budget: int = DEFAULT_ENDPOINT_RETRY_BUDGET,
+                 quarantine: bool = False, base_delay: float = DEFAULT_BASE_DELAY_S,
+                 max_delay: float = DEFAULT_MAX_DELAY_S):
+        """
+
+        Args:
+            max_page_attempts: max number of attempts of a single page
+            endpoint_retry_budget: max number of retries of all pages of an endpoint in the run
+            quarantine: record pages that keep failing and stop the endpoint instead of failing the run
+            base_delay: backoff base delay in seconds
+            max_delay: max delay between attempts in seconds
+        """
+        self.max_page_attempts = max(1, max_page_attempts)
+        self.endpoint_retry_budget = endpoint_retry_budget
+        self.quarantine = quarantine
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.failed_pages: List[dict] = []
+        self._retries = {}
+        self._quarantined: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def _take_retry(self, endpoint: str) -> bool:
+        with self._lock:
+            used = self._retries.get(endpoint, 0)
+            if used >= self.endpoint_retry_budget:
+                return False
+            self._retries[endpoint] = used + 1
+            return True
+
+    def _get_delay(self, error: Exception, attempt: int) -> float:
+        response = getattr(error, 'response', None)
+        retry_after = parse_retry_after(response.headers.get('Retry-After')) if response is not None else None
+        if retry_after is not None:
+            return min(retry_after, self.max_delay)
+        return backoff_delay(attempt, self.base_delay, self.max_delay)
+
+    def run(self, endpoint: str, parameters: Optional[dict], request: Callable[[], Response]) -> Response:
+        """
+        Sends the request, retrying retryable failures.
+
+        Args:
+            endpoint: endpoint of the page, the retry budget is tracked per endpoint
+            parameters: page parameters, recorded for quarantined pages
+            request: function sending the request and validating the response
+
+        Returns: response
+
+        Raises: PageQuarantined if the page failed and quarantine is enabled, the original error otherwise
+
+        """
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                return request()
+            except (PageRequestError, RequestException) as e:
+                if not is_retryable(e) or attempt >= self.max_page_attempts or not self._take_retry(endpoint):
+                    self._fail(endpoint, parameters, e, attempt)
+                delay = self._get_delay(e, attempt)
+                logging.warning(f'Request to {endpoint} failed (attempt {attempt}): {e}. Retrying in {delay:.1f}s.')
+                time.sleep(delay)
+
+    def _fail(self, endpoint: str, parameters: Optional[dict], error: Exception, attempts: int):
+        status_code = getattr(error, 'status_code', None)
+        if not self.quarantine or status_code == 401:
+            raise error
+        with self._lock:
+            self._quarantined[endpoint] = self._quarantined.get(endpoint, 0) + 1
+            self.failed_pages.append({'endpoint': endpoint,
+                                      'parameters': json.dumps(parameters or {}, default=str),
+                                      'status_code': status_code or '',
+                                      'error': str(error),
+                                      'attempts': attempts,
+                                      'failed_at': datetime.now(timezone.utc).isoformat()})
+        raise PageQuarantined(f'Page of {endpoint} failed after {attempts} attempts and was quarantined: '
+                              f'{error}') from error
+
+    def quarantined_pages(self, endpoints: Optional[Iterable[str]] = None) -> int:
+        """
+        Returns the number of quarantined pages of the endpoints, of all endpoints if not set.
+        """
+        with self._lock:
+            if endpoints is None:
+                return sum(self._quarantined.values())
+            return sum(self._quarantined.get(e, 0) for e in endpoints)
+
+    def stats(self) -> dict:
+        return {'retries': dict(self._retries),
+                'quarantined_pages': len(self.failed_pages)}
+
+
+def stop_on_quarantine(func):
+    """
+    Decorates a page generator to end the paging gracefully once a page is quarantined.
+    """
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        try:
+            yield from func(*args, **kwargs)
+        except PageQuarantined as e:
+            logging.warning(f'{e} The remaining pages of the endpoint are skipped.')
+
+    return wrapper
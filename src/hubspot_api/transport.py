@@ -0,0 +1,186 @@
+"""
+Shared HTTP transport (session + connection pool) of the HubSpot API clients.
+
+keboola.http_client.HttpClient opens a new session for each request, so every page pays a new TCP connection
+and TLS handshake. All clients built on SharedTransportClient send requests through a single pooled keep-alive session.
+"""
+import socket
+import threading
+import time
+from contextlib import nullcontext
+from typing import Callable, ContextManager, List, Optional, Tuple
+
+import requests
+from keboola.http_client import HttpClient
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection
+from urllib3.util import Retry
+
+MAX_RETRIES = 10
+BACKOFF_FACTOR = 0.3
+STATUS_FORCELIST = (429, 500, 502, 504, 524)
+ALLOWED_METHODS = ("GET", "POST", "PATCH", "UPDATE", "PUT", "DELETE")
+
+DEFAULT_POOL_SIZE = 10
+DEFAULT_CONNECT_TIMEOUT = 30
+DEFAULT_READ_TIMEOUT = 300
+# TCP keep-alive probing of idle pooled connections, seconds
+KEEP_ALIVE_IDLE = 60
+KEEP_ALIVE_INTERVAL = 30
+KEEP_ALIVE_COUNT = 4
+
+
+def _keep_alive_socket_options() -> List[Tuple[int, int, int]]:
+    options = [(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)]
+    # platform specific options
+    if hasattr(socket, 'TCP_KEEPIDLE'):
+        options.append((socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, KEEP_ALIVE_IDLE))
+    if hasattr(socket, 'TCP_KEEPINTVL'):
+        options.append((socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, KEEP_ALIVE_INTERVAL))
+    if hasattr(socket, 'TCP_KEEPCNT'):
+        options.append((socket.IPPROTO_TCP, socket.TCP_KEEPCNT, KEEP_ALIVE_COUNT))
+    return options
+
+
+class KeepAliveHTTPAdapter(HTTPAdapter):
+    """
+    HTTPAdapter enabling TCP keep-alive on the pooled connections.
+    """
+
+    def __init__(self, keep_alive: bool = True, **kwargs):
+        self._keep_alive = keep_alive
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        if self._keep_alive:
+            kwargs['socket_options'] = HTTPConnection.default_socket_options + _keep_alive_socket_options()
+        super().init_poolmanager(*args, **kwargs)
+
+
+class RateLimiter:
+    """
+    Spaces requests evenly to max `requests_per_second`, thread safe.
+    """
+
+    def __init__(self, requests_per_second: float):
+        self.interval = 1.0 / requests_per_second
+        self._next_slot = 0.0
+        self._lock = threading.Lock()
+        self.waited_s = 0.0
+
+    def acquire(self):
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.interval
+            delay = slot - now
+            self.waited_s += delay
+        if delay > 0:
+            time.sleep(delay)
+
+
+class HttpTransport:
+    """
+    Pooled keep-alive session shared by all API clients of a run.
+    """
+
+    def __init__(self, pool_size: int = DEFAULT_POOL_SIZE, connect_timeout: float = DEFAULT_CONNECT_TIMEOUT,
+                 read_timeout: float = DEFAULT_READ_TIMEOUT, keep_alive: bool = True,
+                 max_retries: int = MAX_RETRIES, backoff_factor: float = BACKOFF_FACTOR,
+                 status_forcelist: tuple = STATUS_FORCELIST, max_requests_per_second: Optional[float] = None):
+        """
+
+        Args:
+            pool_size: max number of connections kept open per host, should match the number of concurrent requests
+            connect_timeout: TCP connect timeout in seconds
+            read_timeout: max time in seconds between bytes received from the server
+            keep_alive: enable TCP keep-alive on pooled connections
+            max_retries: total number of retries of a request
+            backoff_factor: retry back-off factor
+            status_forcelist: HTTP statuses that are retried
+            max_requests_per_second: request rate budget of all clients of the transport, unlimited if not set
+        """
+        self.pool_size = pool_size
+        self.timeout = (connect_timeout, read_timeout)
+        retry = Retry(total=max_retries, read=max_retries, connect=max_retries, backoff_factor=backoff_factor,
+                      status_forcelist=status_forcelist, allowed_methods=ALLOWED_METHODS)
+        self._adapter = KeepAliveHTTPAdapter(keep_alive=keep_alive, pool_connections=pool_size,
+                                             pool_maxsize=pool_size, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount('http://', self._adapter)
+        self.session.mount('https://', self._adapter)
+        self._requests_sent = 0
+        # the transport is shared by the worker threads, += on the counter is not atomic
+        self._stats_lock = threading.Lock()
+        self._rate_limiter = RateLimiter(max_requests_per_second) if max_requests_per_second else None
+        # context manager factory timing each request (incl. the rate limit wait), e.g. by the run profiler
+        self.request_timer: Callable[[], ContextManager] = nullcontext
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        kwargs.setdefault('timeout', self.timeout)
+        with self.request_timer():
+            if self._rate_limiter:
+                self._rate_limiter.acquire()
+            self._count_request()
+            return self.session.request(method, url, **kwargs)
+
+    def _count_request(self):
+        with self._stats_lock:
+            self._requests_sent += 1
+
+    def stats(self) -> dict:
+        """
+        Connection reuse statistics. Each request that did not open a new connection reused a pooled one.
+        """
+        pools = self._adapter.poolmanager.pools
+        new_connections = 0
+        pool_requests = 0
+        for key in pools.keys():
+            pool = pools[key]
+            new_connections += pool.num_connections
+            pool_requests += pool.num_requests
+        stats = {'pool_size': self.pool_size,
+                 'requests': self._requests_sent,
+                 'http_requests_incl_retries': pool_requests,
+                 'new_connections': new_connections,
+                 'reused_connections': max(pool_requests - new_connections, 0)}
+        if self._rate_limiter:
+            stats['rate_limit_wait_s'] = round(self._rate_limiter.waited_s, 3)
+        return stats
+
+    def close(self):
+        self.session.close()
+
+
+class SharedTransportClient(HttpClient):
+    """
+    HttpClient sending all requests through a shared HttpTransport instead of a new session per request.
+    """
+
+    def __init__(self, base_url: str, transport: Optional[HttpTransport] = None, **kwargs):
+        HttpClient.__init__(self, base_url=base_url, **kwargs)
+        self._transport = transport or HttpTransport()
+
+    @property
+    def transport(self) -> HttpTransport:
+        return self._transport
+
+    # overrides the request of HttpClient using its private members, keboola.http-client is pinned in requirements.txt
+    # and test_clients_share_pooled_connection checks the override before upgrading it
+    def _request_raw(self, method: str, endpoint_path: Optional[str] = None, **kwargs) -> requests.Response:
+        is_absolute_path = kwargs.pop('is_absolute_path', False)
+        url = self._build_url(endpoint_path, is_absolute_path)
+
+        headers = kwargs.pop('headers', None) or {}
+        headers.update(self._default_header)
+
+        if kwargs.pop('ignore_auth', False) is False:
+            headers.update(self._auth_header)
+            kwargs['auth'] = self._auth
+
+        # Merge default and custom parameters when applicable
+        if self._default_params and type(self._default_params) is dict:
+            params = kwargs.pop('params', {}) or {}
+            kwargs['params'] = {**self._default_params, **params}
+
+        return self._transport.request(method, url, headers=headers, **kwargs)
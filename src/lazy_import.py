@@ -0,0 +1,36 @@
+"""
+Deferred import of heavy modules.
+
+pandas, numpy and dateparser (through keboola.utils) take most of the component startup time, while configs that
+extract only the v3 endpoints (e.g. forms, owners) never use them. Modules wrapped in LazyModule are imported
+on the first attribute access.
+"""
+import importlib
+import threading
+from types import ModuleType
+
+
+class LazyModule:
+
+    def __init__(self, name: str):
+        self._name = name
+        self._module = None
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self) -> bool:
+        return self._module is not None
+
+    def _load(self) -> ModuleType:
+        if self._module is None:
+            with self._lock:
+                if self._module is None:
+                    self._module = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, item):
+        # called only for attributes not found on the proxy itself
+        return getattr(self._load(), item)
+
+    def __repr__(self):
+        return f'<LazyModule {self._name} ({"loaded" if self.loaded else "not loaded"})>'
@@ -0,0 +1,184 @@
+"""
+Memory ceiling governor of large extractions.
+
+The resident memory (RSS) of the process is sampled in a background thread and attributed to the endpoints being
+extracted, so the run metrics show the high-water mark of each endpoint. When the RSS approaches the ceiling
+(the configured one or the memory limit of the container) the registered pressure handlers are called, e.g. to
+shrink the page sizes, spill the buffered rows to disk and pause fetching ahead of the consumer. The handlers are
+called again while the pressure lasts and the relief handlers are called once the RSS drops below the relief
+threshold.
+"""
+import gc
+import logging
+import os
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+DEFAULT_INTERVAL_S = 0.5
+# pressure handlers are called when the RSS exceeds this fraction of the ceiling
+DEFAULT_PRESSURE_RATIO = 0.85
+# relief handlers are called when the RSS drops below this fraction of the ceiling
+DEFAULT_RELIEF_RATIO = 0.7
+# pressure handlers are called repeatedly at this interval while the pressure lasts
+PRESSURE_REPEAT_S = 5.0
+
+# memory limit of the container, cgroup v2 and v1
+CGROUP_LIMIT_FILES = ['/sys/fs/cgroup/memory.max', '/sys/fs/cgroup/memory/memory.limit_in_bytes']
+# cgroup v1 reports no limit as a huge number
+UNLIMITED_BYTES = 1 << 60
+
+MB = 1024 * 1024
+
+
+def read_rss_bytes() -> Optional[int]:
+    """
+    Returns the current resident memory of the process, None if it cannot be read.
+    """
+    try:
+        with open('/proc/self/statm', 'r') as inp:
+            return int(inp.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    # peak instead of the current RSS where /proc is not available, in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def container_memory_limit() -> Optional[int]:
+    """
+    Returns the memory limit of the container in bytes, None if the memory is not limited.
+    """
+    for path in CGROUP_LIMIT_FILES:
+        try:
+            with open(path, 'r') as inp:
+                value = inp.read().strip()
+        except OSError:
+            continue
+        if value.isdigit() and int(value) < UNLIMITED_BYTES:
+            return int(value)
+        return None
+    return None
+
+
+def _to_mb(value: Optional[int]) -> Optional[float]:
+    return round(value / MB, 1) if value is not None else None
+
+
+class MemoryGovernor:
+
+    def __init__(self, ceiling_bytes: Optional[int], pressure_ratio: float = DEFAULT_PRESSURE_RATIO,
+                 relief_ratio: float = DEFAULT_RELIEF_RATIO, interval_s: float = DEFAULT_INTERVAL_S,
+                 read_rss: Callable[[], Optional[int]] = read_rss_bytes):
+        """
+
+        Args:
+            ceiling_bytes: memory ceiling of the process, only the high-water marks are tracked if None
+            pressure_ratio: fraction of the ceiling above which the pressure handlers are called
+            relief_ratio: fraction of the ceiling below which the relief handlers are called
+            interval_s: sampling interval of the RSS
+            read_rss: function returning the current RSS in bytes
+        """
+        self.ceiling_bytes = ceiling_bytes
+        self.pressure_ratio = pressure_ratio
+        self.relief_ratio = relief_ratio
+        self.interval_s = interval_s
+        self.under_pressure = False
+        self.pressure_events = 0
+        self.peak_rss = 0
+        self._read_rss = read_rss
+        self._lock = threading.Lock()
+        self._handlers: List[Tuple[Callable[[], None], Callable[[], None]]] = []
+        # endpoint extracted by each thread, several portals may be extracted at the same time
+        self._active: Dict[int, str] = {}
+        self._high_water: Dict[str, int] = {}
+        self._last_pressure = 0.0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def add_handlers(self, on_pressure: Callable[[], None], on_relief: Callable[[], None]):
+        with self._lock:
+            self._handlers.append((on_pressure, on_relief))
+
+    def remove_handlers(self, on_pressure: Callable[[], None], on_relief: Callable[[], None]):
+        with self._lock:
+            self._handlers.remove((on_pressure, on_relief))
+
+    def start_endpoint(self, name: str):
+        """
+        Attributes the RSS sampled from now on to the endpoint until the calling thread starts another one.
+        """
+        with self._lock:
+            self._active[threading.get_ident()] = name
+            self._high_water.setdefault(name, 0)
+        self.check()
+
+    def end_endpoint(self):
+        with self._lock:
+            self._active.pop(threading.get_ident(), None)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='memory-governor', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval_s):
+            self.check()
+
+    def check(self):
+        """
+        Samples the RSS, updates the high-water marks and calls the handlers when the pressure starts or ends.
+        """
+        rss = self._read_rss()
+        if rss is None:
+            return
+        with self._lock:
+            self.peak_rss = max(self.peak_rss, rss)
+            for name in self._active.values():
+                self._high_water[name] = max(self._high_water[name], rss)
+            handlers = list(self._handlers)
+
+        if self.ceiling_bytes is None:
+            return
+        if rss >= self.ceiling_bytes * self.pressure_ratio:
+            if not self.under_pressure or time.monotonic() - self._last_pressure >= PRESSURE_REPEAT_S:
+                self._on_pressure(rss, handlers)
+        elif self.under_pressure and rss < self.ceiling_bytes * self.relief_ratio:
+            self.under_pressure = False
+            logging.info(f'Memory usage {_to_mb(rss)} MB is back below the limit, resuming')
+            self._call(h[1] for h in handlers)
+
+    def _on_pressure(self, rss: int, handlers: list):
+        self.under_pressure = True
+        self.pressure_events += 1
+        self._last_pressure = time.monotonic()
+        with self._lock:
+            endpoints = sorted(set(self._active.values()))
+        logging.warning(f'Memory usage {_to_mb(rss)} MB is approaching the ceiling {_to_mb(self.ceiling_bytes)} MB '
+                        f'while extracting {", ".join(endpoints) or "-"}, decreasing page sizes and buffers')
+        self._call(h[0] for h in handlers)
+        gc.collect()
+
+    @staticmethod
+    def _call(handlers):
+        for handler in handlers:
+            try:
+                handler()
+            except Exception as e:
+                logging.warning(f'Memory governor handler failed: {e}')
+
+    def stats(self) -> dict:
+        with self._lock:
+            high_water = {name: _to_mb(rss) for name, rss in self._high_water.items()}
+        return {'ceiling_mb': _to_mb(self.ceiling_bytes),
+                'peak_rss_mb': _to_mb(self.peak_rss),
+                'pressure_events': self.pressure_events,
+                'high_water_mb': high_water}
@@ -0,0 +1,135 @@
+"""
+Dry-run planning of the extraction.
+
+The number of records of each endpoint is taken from a cheap count probe (a single CRM search request returning
+the total) where the API offers one, otherwise from the statistics of the endpoint stored in the state by the previous
+run. The expected pages and requests are derived from the page size of the path that the run would take and
+the duration is estimated from the observed latency of the endpoint, the number of concurrent workers and the request
+rate limit.
+"""
+import logging
+import math
+from typing import Callable, Dict, List, Optional
+
+from hubspot_api import client_service, client_v3
+
+# expected latency of endpoints without statistics from a previous run
+DEFAULT_LATENCY_S = 0.5
+
+PLAN_COLS = ['endpoint', 'path', 'records', 'records_source', 'page_size', 'pages', 'requests', 'workers',
+             'estimated_seconds']
+
+# (endpoint, path): (API endpoint, max page size), page size None for endpoints returned in a single response
+ENDPOINT_PATHS = {
+    ('companies', 'full'): (client_service.COMPANIES_ALL, 250),
+    ('companies', 'recent'): (client_service.COMPANIES_RECENT, 1000),
+    ('companies', 'incremental'): ('crm/v3/objects/companies/search', client_v3.SEARCH_PAGE_SIZE),
+    ('contacts', 'full'): (client_service.CONTACTS_ALL, 100),
+    ('contacts', 'recent'): (client_service.CONTACTS_RECENT, 100),
+    ('contacts', 'incremental'): (client_service.CONTACTS_RECENT, 100),
+    ('deals', 'full'): (client_service.DEALS_ALL, 250),
+    ('deals', 'recent'): (client_service.DEALS_RECENT, 100),
+    ('campaigns', 'full'): (client_service.CAMPAIGNS_BY_ID, 1000),
+    ('campaigns', 'recent'): (client_service.CAMPAIGNS_BY_ID_RECENT, 1000),
+    ('email_events', 'full'): (client_service.EMAIL_EVENTS, 1000),
+    ('email_events', 'recent'): (client_service.EMAIL_EVENTS, 1000),
+    ('activities', 'full'): (client_service.ENGAGEMENTS_PAGED, 250),
+    ('activities', 'recent'): (client_service.ENGAGEMENTS_PAGED_SINCE, 250),
+    ('lists', 'full'): (client_service.LISTS, 250),
+    ('list_memberships', 'full'): (client_service.LIST_CONTACTS, 100),
+    ('list_memberships', 'incremental'): (client_service.LIST_CONTACTS, 100),
+    ('owners', 'full'): (client_service.OWNERS, None),
+    ('pipelines', 'full'): (client_service.PIPELINES, None),
+    ('calls', 'full'): ('crm/v3/objects/calls', 100),
+    ('emails', 'full'): ('crm/v3/objects/emails', 100),
+    ('meetings', 'full'): ('crm/v3/objects/meetings', 100),
+    ('forms', 'full'): ('marketing/v3/forms', 100),
+    ('marketing_email_statistics', 'full'): (client_service.MARKETING_EMAILS_STATISTICS, 250),
+    ('marketing_email_statistics', 'incremental'): (client_service.MARKETING_EMAILS_STATISTICS, 250),
+}
+
+
+def estimate_seconds(requests: int, latency: float, workers: int = 1,
+                     requests_per_second: Optional[float] = None) -> float:
+    """
+    Requests are sent sequentially by each worker, the rate limit is the lower bound of the duration.
+    """
+    seconds = requests * latency / max(1, workers)
+    if requests_per_second:
+        seconds = max(seconds, requests / requests_per_second)
+    return round(seconds, 1)
+
+
+class RunPlanner:
+
+    def __init__(self, endpoint_stats: Dict[str, dict], requests_per_second: Optional[float] = None):
+        """
+
+        Args:
+            endpoint_stats: statistics (pages, records, avg_latency_s) of the API endpoints from the previous run
+            requests_per_second: request rate limit of the run
+        """
+        self._endpoint_stats = endpoint_stats
+        self._requests_per_second = requests_per_second
+        self.plans: List[dict] = []
+
+    def _count(self, endpoint: str, count: Optional[Callable[[], int]]) -> Optional[int]:
+        if count is None:
+            return None
+        try:
+            return count()
+        except Exception as e:
+            logging.warning(f'Count probe of {endpoint} failed, using the statistics of the previous run: {e}')
+            return None
+
+    def add(self, endpoint: str, path: str, count: Optional[Callable[[], int]] = None,
+            requests_per_record: int = 0, requests_per_page: int = 0,
+            workers: int = 1) -> dict:
+        """
+        Plans a single endpoint.
+
+        Args:
+            endpoint: configured endpoint, e.g. companies
+            path: full, recent or incremental
+            count: count probe returning the number of records, the previous run statistics are used if not set
+            requests_per_record: additional requests sent for each record (e.g. campaign details)
+            requests_per_page: additional requests sent for each page (e.g. association batches)
+            workers: number of concurrent workers of the endpoint
+        """
+        api_endpoint, page_size = ENDPOINT_PATHS[(endpoint, path)]
+        cached = self._endpoint_stats.get(api_endpoint) or {}
+
+        records = self._count(endpoint, count)
+        records_source = 'probe'
+        pages = None
+        if records is None and cached:
+            records = cached.get('records')
+            pages = cached.get('pages')
+            records_source = 'previous_run'
+        elif records is None:
+            records_source = 'unknown'
+
+        if page_size is None:
+            pages = 1
+        elif records is not None:
+            pages = max(1, math.ceil(records / page_size))
+
+        requests = None
+        seconds = None
+        if pages is not None:
+            requests = pages + pages * requests_per_page + (records or 0) * requests_per_record
+            seconds = estimate_seconds(requests, cached.get('avg_latency_s') or DEFAULT_LATENCY_S, workers,
+                                       self._requests_per_second)
+
+        plan = {'endpoint': endpoint, 'path': path, 'records': records, 'records_source': records_source,
+                'page_size': page_size, 'pages': pages, 'requests': requests, 'workers': workers,
+                'estimated_seconds': seconds}
+        self.plans.append(plan)
+        return plan
+
+    def summary(self) -> dict:
+        known = [p for p in self.plans if p['requests'] is not None]
+        return {'requests': sum(p['requests'] for p in known),
+                # endpoints are extracted one after another
+                'estimated_seconds': round(sum(p['estimated_seconds'] for p in known), 1),
+                'unknown_endpoints': [p['endpoint'] for p in self.plans if p['requests'] is None]}
@@ -0,0 +1,154 @@
+"""
+Profiling of production runs.
+
+StageProfiler splits the wall time of each endpoint into the time spent waiting on HTTP requests (`fetch`), writing
+the output files (`write`) and the rest (`transform` - parsing, flattening, child table explosion). The fetch time is
+summed over all threads, so with parallel fetching it may exceed the wall time and `transform` is then 0.
+
+SamplingProfiler samples the stacks of all threads at a fixed interval in a background thread and writes them in the
+folded stacks format (`frame;frame;frame count` per line) readable by flamegraph.pl, speedscope or inferno.
+"""
+import csv
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+from typing import Dict, List, Optional
+
+STAGE_FETCH = 'fetch'
+STAGE_TRANSFORM = 'transform'
+STAGE_WRITE = 'write'
+
+STAGE_COLS = ['endpoint', 'wall_s', 'fetch_s', 'transform_s', 'write_s', 'requests', 'writes']
+
+DEFAULT_SAMPLING_INTERVAL_MS = 10
+
+
+class StageProfiler:
+
+    def __init__(self, enabled: bool = False):
+        """
+
+        Args:
+            enabled: measure the stages, all calls are no-ops if False
+        """
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._endpoints: Dict[str, dict] = {}
+        self._endpoint: Optional[str] = None
+        self._endpoint_start = 0.0
+
+    def start_endpoint(self, name: str):
+        """
+        Ends the current endpoint and starts measuring the next one. Endpoints are extracted one after another.
+        """
+        if not self.enabled:
+            return
+        self.stop()
+        self._endpoint = name
+        self._endpoint_start = time.perf_counter()
+        self._get_endpoint(name)
+
+    def stop(self):
+        if not self.enabled or self._endpoint is None:
+            return
+        with self._lock:
+            self._endpoints[self._endpoint]['wall_s'] += time.perf_counter() - self._endpoint_start
+        self._endpoint = None
+
+    def _get_endpoint(self, name: str) -> dict:
+        with self._lock:
+            return self._endpoints.setdefault(name, {'wall_s': 0.0, STAGE_FETCH: 0.0, STAGE_WRITE: 0.0,
+                                                     'requests': 0, 'writes': 0})
+
+    def stage(self, name: str):
+        """
+        Returns a context manager adding its duration to the stage of the current endpoint.
+        """
+        if not self.enabled:
+            return nullcontext()
+        return self._measure(name)
+
+    @contextmanager
+    def _measure(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            endpoint = self._get_endpoint(self._endpoint or 'other')
+            with self._lock:
+                endpoint[name] += elapsed
+                endpoint['requests' if name == STAGE_FETCH else 'writes'] += 1
+
+    def breakdown(self) -> List[dict]:
+        """
+        Returns the stage times of each endpoint in the order the endpoints were extracted.
+        """
+        rows = []
+        with self._lock:
+            for name, stages in self._endpoints.items():
+                transform = max(0.0, stages['wall_s'] - stages[STAGE_FETCH] - stages[STAGE_WRITE])
+                rows.append({'endpoint': name,
+                             'wall_s': round(stages['wall_s'], 3),
+                             'fetch_s': round(stages[STAGE_FETCH], 3),
+                             'transform_s': round(transform, 3),
+                             'write_s': round(stages[STAGE_WRITE], 3),
+                             'requests': stages['requests'],
+                             'writes': stages['writes']})
+        return rows
+
+    def write_breakdown(self, file_path: str):
+        with open(file_path, 'w', encoding='utf-8', newline='') as out:
+            writer = csv.DictWriter(out, STAGE_COLS, lineterminator='\n')
+            writer.writeheader()
+            writer.writerows(self.breakdown())
+
+
+class SamplingProfiler:
+
+    def __init__(self, interval_ms: float = DEFAULT_SAMPLING_INTERVAL_MS):
+        self.interval_s = interval_ms / 1000
+        self.samples = 0
+        self._stacks = Counter()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval_s):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                self._stacks[self._fold(names.get(thread_id, str(thread_id)), frame)] += 1
+            self.samples += 1
+
+    @staticmethod
+    def _fold(thread_name: str, frame) -> str:
+        frames = []
+        while frame is not None:
+            code = frame.f_code
+            frames.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+            frame = frame.f_back
+        frames.append(thread_name)
+        # semicolons separate the frames of the folded format
+        return ';'.join(f.replace(';', ',') for f in reversed(frames))
+
+    def write_folded(self, file_path: str):
+        with open(file_path, 'w', encoding='utf-8') as out:
+            for stack, count in self._stacks.most_common():
+                out.write(f'{stack} {count}\n')
+        logging.info(f'Sampling profile with {self.samples} samples written into {os.path.basename(file_path)}')
@@ -0,0 +1,53 @@
+"""
+Normalization of the property `versions` lists (property history) into a long table.
+
+Each version of each property is emitted as a single row, so the nested version lists do not have to be
+serialized into the cells of the main object tables.
+"""
+from typing import Iterable, Iterator, List
+
+PROPERTY_HISTORY_COLS = ['object_id', 'property', 'value', 'timestamp', 'source', 'source_id']
+# versions of the same timestamp may differ by the source, e.g. a workflow updating the property set by an import
+PROPERTY_HISTORY_PK = ['object_id', 'property', 'timestamp', 'source', 'source_id']
+
+PROPERTY_PREFIX = 'properties.'
+VERSIONS_SUFFIX = '.versions'
+
+
+def get_versions_columns(columns: Iterable[str]) -> List[str]:
+    """
+    Returns flattened `properties.<name>.versions` columns.
+    """
+    return [c for c in columns if c.startswith(PROPERTY_PREFIX) and c.endswith(VERSIONS_SUFFIX)]
+
+
+def get_property_name(versions_column: str) -> str:
+    return versions_column[len(PROPERTY_PREFIX):-len(VERSIONS_SUFFIX)]
+
+
+def iter_property_history(page, id_column: str, versions_columns: List[str]) -> Iterator[dict]:
+    """
+    Yields property history rows of all `versions_columns` of the page in a single pass over its rows.
+
+    Args:
+        page: pandas DataFrame with flattened object properties
+        id_column: object id column, e.g. `canonical-vid`, `companyId`, `dealId`
+        versions_columns: flattened versions columns, see get_versions_columns()
+
+    Returns: Iterator of rows with PROPERTY_HISTORY_COLS keys
+
+    """
+    property_names = [get_property_name(c) for c in versions_columns]
+    columns = [page[c].tolist() for c in versions_columns]
+    for object_id, *row_versions in zip(page[id_column].tolist(), *columns):
+        for property_name, versions in zip(property_names, row_versions):
+            # missing values are filled with empty strings / NaN
+            if not isinstance(versions, list):
+                continue
+            for version in versions:
+                yield {'object_id': object_id,
+                       'property': property_name,
+                       'value': version.get('value'),
+                       'timestamp': version.get('timestamp'),
+                       'source': version.get('source'),
+                       'source_id': version.get('sourceId')}
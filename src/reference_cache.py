@@ -0,0 +1,79 @@
+"""
+Content-hash cache of small reference endpoints (owners, pipelines).
+
+The reference tables rarely change, so the hash of the payload written by the last run is kept in the state and
+the tables are written (and loaded into Storage) only when the hash changes. Optionally, the payloads are shared
+through a cache directory by all configurations extracting the same portal, so only the first run within
+`max_age_s` requests the API.
+"""
+import gzip
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+from typing import List, Optional
+
+DEFAULT_MAX_AGE_S = 3600
+
+
+def payload_hash(objects: List[dict]) -> str:
+    return hashlib.sha256(json.dumps(objects, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+class ReferenceCache:
+
+    def __init__(self, hashes: dict, shared_dir: Optional[str] = None, portal_id: Optional[str] = None,
+                 max_age_s: int = DEFAULT_MAX_AGE_S):
+        """
+
+        Args:
+            hashes: payload hashes of the last run by endpoint, kept in the state and updated in place
+            shared_dir: cache directory shared by configurations, payloads are not shared if not set
+            portal_id: portal the payloads belong to, required by the shared cache
+            max_age_s: max age of a shared payload
+        """
+        self._hashes = hashes
+        self._shared_dir = os.path.join(shared_dir, str(portal_id)) if shared_dir and portal_id else None
+        self._max_age_s = max_age_s
+
+    def _shared_path(self, name: str) -> str:
+        return os.path.join(self._shared_dir, f'{name}.json.gz')
+
+    def load_shared(self, name: str) -> Optional[List[dict]]:
+        """
+        Returns the shared payload if it is fresh, None otherwise.
+        """
+        if not self._shared_dir or not os.path.isfile(self._shared_path(name)):
+            return None
+        try:
+            with gzip.open(self._shared_path(name), 'rt', encoding='utf-8') as inp:
+                cached = json.load(inp)
+        except (OSError, ValueError) as e:
+            logging.warning(f'Shared cache of {name} is not readable, requesting the API: {e}')
+            return None
+        if time.time() - cached.get('fetched_at', 0) > self._max_age_s:
+            return None
+        return cached['objects']
+
+    def store_shared(self, name: str, objects: List[dict]):
+        if not self._shared_dir:
+            return
+        os.makedirs(self._shared_dir, exist_ok=True)
+        # written into a temporary file first, so concurrent runs never read a partial payload
+        fd, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=self._shared_dir)
+        os.close(fd)
+        with gzip.open(tmp_path, 'wt', encoding='utf-8') as out:
+            json.dump({'fetched_at': time.time(), 'objects': objects}, out, default=str)
+        os.replace(tmp_path, self._shared_path(name))
+
+    def update(self, name: str, objects: List[dict]) -> bool:
+        """
+        Stores the payload hash, returns False if it is the same as in the last run.
+        """
+        new_hash = payload_hash(objects)
+        if self._hashes.get(name) == new_hash:
+            return False
+        self._hashes[name] = new_hash
+        return True
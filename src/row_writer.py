@@ -0,0 +1,92 @@
+"""
+Headless CSV writer of dict rows with a precomputed header.
+
+ElasticDictWriter checks every row for new fields, writes each header variant into a separate temporary file and
+copies everything into the result file on close. SchemaRowWriter starts with the header known upfront (the table
+schema cached in the state from the previous run and the requested properties) and writes the rows straight into
+the result file through a key -> index mapping. Keys not in the header are appended to the column list, which is
+written into the table manifest, so the file header never has to be rewritten. Only rows written before such growth
+are padded to the final width on close.
+"""
+import csv
+import os
+from typing import Dict, Iterable, List
+
+DEFAULT_NESTED_KEY = 'properties'
+
+
+class SchemaRowWriter:
+
+    def __init__(self, file_path: str, columns: Iterable[str], nested_key: str = DEFAULT_NESTED_KEY):
+        """
+
+        Args:
+            file_path: result headless CSV file, created with the first row
+            columns: initial columns, e.g. the cached table schema
+            nested_key: key of a nested dict (v3 object `properties`) whose fields are written as columns
+        """
+        self.file_path = file_path
+        self.columns: List[str] = list(dict.fromkeys(columns))
+        self._index: Dict[str, int] = {c: i for i, c in enumerate(self.columns)}
+        self._nested_key = nested_key
+        self._file = None
+        self._writer = None
+        self.rows = 0
+        # number of rows written before the last header growth, those are shorter than the final header
+        self._short_rows = 0
+
+    def _add_column(self, column: str) -> int:
+        self._index[column] = len(self.columns)
+        self.columns.append(column)
+        self._short_rows = self.rows
+        return self._index[column]
+
+    def writerow(self, row: dict):
+        """
+        Writes a row, fields of the nested dict override top-level fields of the same name. The row is not modified.
+        """
+        index = self._index
+        values = [''] * len(self.columns)
+        nested = row.get(self._nested_key)
+        items = row.items()
+        if isinstance(nested, dict):
+            items = [i for i in items if i[0] != self._nested_key] + list(nested.items())
+        for key, value in items:
+            position = index.get(key)
+            if position is None:
+                position = self._add_column(key)
+                values.append('')
+            values[position] = value
+
+        if self._writer is None:
+            self._file = open(self.file_path, 'w', encoding='utf-8', newline='')
+            self._writer = csv.writer(self._file, lineterminator='\n')
+        self._writer.writerow(values)
+        self.rows += 1
+
+    def writerows(self, rows: Iterable[dict]):
+        for row in rows:
+            self.writerow(row)
+
+    def close(self):
+        """
+        Closes the file, rows written before the header grew are padded to the final number of columns.
+        """
+        if self._file is None:
+            return
+        self._file.close()
+        self._file = None
+        if self._short_rows:
+            self._pad_short_rows()
+
+    def _pad_short_rows(self):
+        width = len(self.columns)
+        tmp_path = self.file_path + '.tmp'
+        with open(self.file_path, 'r', encoding='utf-8', newline='') as inp, \
+                open(tmp_path, 'w', encoding='utf-8', newline='') as out:
+            writer = csv.writer(out, lineterminator='\n')
+            for row in csv.reader(inp):
+                if len(row) < width:
+                    row.extend([''] * (width - len(row)))
+                writer.writerow(row)
+        os.replace(tmp_path, self.file_path)
@@ -0,0 +1,182 @@
+"""
+Compact typed storage of child table rows.
+
+Child rows (deal stage history, form submissions, association edges) used to be built as per-object DataFrames and
+converted to strings right away, so every id and epoch millis timestamp was kept as a Python string. Here the values
+are kept in typed columns until they are written: ids and timestamps in int64 arrays, small enums (e.g. `source`,
+object types) as codes of interned strings and only the remaining values as text.
+"""
+import csv
+import numbers
+import sys
+from array import array
+from typing import Dict, Iterator, List, Optional, Sequence
+
+# column types
+INT = 'int'
+ENUM = 'enum'
+TEXT = 'text'
+
+_INT64_MIN = -2 ** 63
+_INT64_MAX = 2 ** 63 - 1
+
+
+def format_value(value) -> str:
+    return '' if value is None else str(value)
+
+
+def to_int(value) -> Optional[int]:
+    """
+    Returns the value as int64 if it is an integer (incl. numpy integers) or its decimal string, None otherwise.
+    """
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, str):
+        if not value or not value.lstrip('-').isdigit():
+            return None
+    elif not isinstance(value, numbers.Integral):
+        return None
+    value = int(value)
+    if _INT64_MIN <= value <= _INT64_MAX:
+        return value
+    return None
+
+
+def normalize(value, column_type: str):
+    """
+    Returns the compact hashable form of the value: int for integer values of INT columns,
+    interned string for ENUM columns and string otherwise.
+    """
+    if column_type == INT:
+        int_value = to_int(value)
+        if int_value is not None:
+            return int_value
+    text = format_value(value)
+    return sys.intern(text) if column_type == ENUM else text
+
+
+class _IntColumn:
+
+    def __init__(self):
+        self.values = array('q')
+        self.missing = bytearray()
+
+    def append(self, value) -> bool:
+        """
+        Returns False if the value is not an integer and the column has to fall back to text.
+        """
+        if value is None or value == '':
+            self.values.append(0)
+            self.missing.append(1)
+            return True
+        int_value = to_int(value)
+        if int_value is None:
+            return False
+        self.values.append(int_value)
+        self.missing.append(0)
+        return True
+
+    def get(self, index: int) -> str:
+        return '' if self.missing[index] else str(self.values[index])
+
+    def to_text(self) -> '_TextColumn':
+        column = _TextColumn()
+        column.values = [self.get(i) for i in range(len(self.values))]
+        return column
+
+
+class _EnumColumn:
+
+    def __init__(self):
+        self.codes = array('I')
+        self.labels: List[str] = []
+        self._lookup: Dict[str, int] = {}
+
+    def append(self, value) -> bool:
+        label = format_value(value)
+        code = self._lookup.get(label)
+        if code is None:
+            code = self._lookup[label] = len(self.labels)
+            self.labels.append(sys.intern(label))
+        self.codes.append(code)
+        return True
+
+    def get(self, index: int) -> str:
+        return self.labels[self.codes[index]]
+
+
+class _TextColumn:
+
+    def __init__(self):
+        self.values: List[str] = []
+
+    def append(self, value) -> bool:
+        self.values.append(format_value(value))
+        return True
+
+    def get(self, index: int) -> str:
+        return self.values[index]
+
+
+_COLUMN_CLASSES = {INT: _IntColumn, ENUM: _EnumColumn, TEXT: _TextColumn}
+
+
+class TypedRowBuffer:
+    """
+    Column oriented buffer of rows with a fixed set of typed columns. Values are formatted to text only when
+    the rows are written. INT columns receiving a non integer value fall back to text.
+    """
+
+    def __init__(self, columns: List[str], column_types: Dict[str, str]):
+        """
+
+        Args:
+            columns: row columns
+            column_types: type (INT, ENUM, TEXT) of the columns, TEXT if not set
+        """
+        self.columns = list(columns)
+        self._column_types = column_types
+        self._data = []
+        self.clear()
+
+    def clear(self):
+        self._data = [_COLUMN_CLASSES[self._column_types.get(c, TEXT)]() for c in self.columns]
+        self._rows = 0
+
+    def __len__(self) -> int:
+        return self._rows
+
+    def append(self, values: Sequence):
+        """
+        Adds a row, values are ordered as `columns`.
+        """
+        for position, value in enumerate(values):
+            column = self._data[position]
+            if not column.append(value):
+                column = self._data[position] = column.to_text()
+                column.append(value)
+        self._rows += 1
+
+    def append_dict(self, row: dict):
+        self.append([row.get(c) for c in self.columns])
+
+    def __iter__(self) -> Iterator[List[str]]:
+        """
+        Yields rows formatted to text.
+        """
+        for index in range(self._rows):
+            yield [column.get(index) for column in self._data]
+
+    def write(self, file_path: str) -> int:
+        """
+        Appends the rows to a headless CSV file and clears the buffer.
+
+        Returns: number of written rows
+
+        """
+        count = self._rows
+        if count:
+            with open(file_path, 'a', encoding='utf-8', newline='') as out:
+                csv.writer(out, lineterminator='\n').writerows(self)
+        self.clear()
+        return count
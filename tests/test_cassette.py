@@ -0,0 +1,95 @@
+import gzip
+import json
+import os
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from hubspot_api.cassette import CassetteMiss, CassetteTransport, MODE_RECORD, MODE_REPLAY, REDACTED
+from hubspot_api.transport import SharedTransportClient
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        body = json.dumps({'path': self.path.split('?')[0], 'contacts': [{'email': 'a@b.com', 'id': 1}]}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestCassetteTransport(unittest.TestCase):
+
+    def setUp(self):
+        self.server = HTTPServer(('127.0.0.1', 0), _Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.base_url = f'http://127.0.0.1:{self.server.server_port}/'
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.cassette_path = os.path.join(self.tmp_dir.name, 'run.jsonl.gz')
+
+    def tearDown(self):
+        self.server.server_close()
+        self.tmp_dir.cleanup()
+
+    def test_record_and_replay(self):
+        recorder = CassetteTransport(self.cassette_path, mode=MODE_RECORD, redact_fields=['email'])
+        client = SharedTransportClient(self.base_url, transport=recorder, default_params={'hapikey': 'secret'})
+        recorded = client.get_raw('contacts', params={'since': 1600000000000})
+        # the recorded response is still streamable
+        self.assertEqual(json.load(recorded.raw)['contacts'][0]['email'], 'a@b.com')
+        recorder.close()
+        self.server.shutdown()
+
+        with gzip.open(self.cassette_path, 'rt') as inp:
+            content = inp.read()
+        self.assertNotIn('secret', content)
+        self.assertNotIn('a@b.com', content)
+
+        player = CassetteTransport(self.cassette_path, mode=MODE_REPLAY)
+        client = SharedTransportClient(self.base_url, transport=player, default_params={'hapikey': 'other'})
+        # the time window shifted since the recording
+        replayed = client.get_raw('contacts', params={'since': 1600000999999})
+        self.assertEqual(replayed.status_code, 200)
+        self.assertEqual(replayed.json()['contacts'][0], {'email': REDACTED, 'id': 1})
+        self.assertEqual(json.load(replayed.raw)['contacts'][0]['id'], 1)
+        self.assertEqual(player.stats()['requests'], 1)
+
+        with self.assertRaises(CassetteMiss):
+            client.get_raw('deals')
+
+    def test_responses_written_as_recorded(self):
+        recorder = CassetteTransport(self.cassette_path, mode=MODE_RECORD)
+        client = SharedTransportClient(self.base_url, transport=recorder)
+        client.get_raw('contacts')
+        client.get_raw('deals')
+        # the recorded responses are in the compressed stream, not kept until close
+        recorder._out.flush()
+        with gzip.open(self.cassette_path, 'rt') as inp:
+            self.assertIn('/contacts', inp.readline())
+        self.assertEqual(recorder.stats()['recorded_responses'], 2)
+        recorder.close()
+
+        with gzip.open(self.cassette_path, 'rt') as inp:
+            self.assertEqual(len(inp.readlines()), 2)
+
+    def test_personal_data_redacted_by_default(self):
+        recorder = CassetteTransport(self.cassette_path, mode=MODE_RECORD)
+        client = SharedTransportClient(self.base_url, transport=recorder)
+        client.get_raw('contacts')
+        recorder.close()
+
+        with gzip.open(self.cassette_path, 'rt') as inp:
+            content = inp.read()
+        self.assertNotIn('a@b.com', content)
+        self.assertIn(REDACTED, content)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,140 @@
+import datetime
+import unittest
+from unittest import mock
+
+import pandas as pd
+
+from hubspot_api import client_service, client_v3
+
+
+def _response(body: dict):
+    response = mock.Mock()
+    response.status_code = 200
+    response.json.return_value = body
+    response.content = b'{}'
+    response.elapsed = datetime.timedelta(seconds=0.1)
+    return response
+
+
+class TestEmailStatistics(unittest.TestCase):
+
+    def test_pages_fetched_up_to_total_count(self):
+        client = client_service.HubspotClientService('token', 'Private App Token')
+        requested_offsets = []
+
+        def get_raw(url, params, **kwargs):
+            requested_offsets.append(params['offset'])
+            ids = range(params['offset'], min(params['offset'] + params['limit'], 700))
+            return _response({'objects': [{'id': i} for i in ids], 'totalCount': 700, 'offset': params['offset']})
+
+        with mock.patch.object(client, 'get_raw', side_effect=get_raw):
+            pages = list(client.get_email_statistics(updated_since=1000, max_workers=2))
+
+        self.assertEqual(sorted(requested_offsets), [0, 250, 500])
+        self.assertEqual(sorted(p[0]['id'] for p in pages), [0, 250, 500])
+
+    def test_pages_strided_by_returned_page_size(self):
+        client = client_service.HubspotClientService('token', 'Private App Token')
+        requests = []
+
+        def get_raw(url, params, **kwargs):
+            requests.append((params['offset'], params['limit']))
+            # fewer records than requested are returned
+            ids = range(params['offset'], min(params['offset'] + min(params['limit'], 100), 300))
+            return _response({'objects': [{'id': i} for i in ids], 'totalCount': 300})
+
+        with mock.patch.object(client, 'get_raw', side_effect=get_raw):
+            pages = list(client.get_email_statistics(max_workers=2))
+
+        self.assertEqual(sorted(r['id'] for p in pages for r in p), list(range(300)))
+        self.assertEqual(sorted(requests[1:]), [(100, 100), (200, 100)])
+
+
+class TestListMemberships(unittest.TestCase):
+
+    def test_each_list_paged_by_vid_offset(self):
+        client = client_service.HubspotClientService('token', 'Private App Token')
+
+        def get_raw(url, params, **kwargs):
+            list_id = int(url.split('/')[-3])
+            if 'vidOffset' not in params:
+                return _response({'contacts': [{'canonical-vid': list_id * 10, 'addedAt': 1}],
+                                  'has-more': True, 'vid-offset': 5})
+            return _response({'contacts': [{'vid': list_id * 10 + 1, 'addedAt': 2}], 'has-more': False})
+
+        with mock.patch.object(client, 'get_raw', side_effect=get_raw):
+            rows = [r for page in client.get_list_memberships([1, 2], max_workers=2) for r in page]
+
+        self.assertEqual(sorted((r['list_id'], r['contact_vid'], r['added_at']) for r in rows),
+                         [(1, 10, 1), (1, 11, 2), (2, 20, 1), (2, 21, 2)])
+
+
+class TestActivitiesParallel(unittest.TestCase):
+
+    def test_recent_activities_partitioned_with_legacy_columns(self):
+        client = client_service.HubspotClientService('token', 'Private App Token')
+
+        def get_raw(url, params, **kwargs):
+            return _response({'results': [{'engagement': {'id': params['offset'], 'type': 'NOTE'},
+                                           'associations': {'contactIds': [1]}}],
+                              'total': 3, 'hasMore': True, 'offset': params['offset'] + 1})
+
+        def build_page_df(records, default_cols):
+            return pd.json_normalize(records).reindex(columns=default_cols)
+
+        with mock.patch.object(client, 'get_raw', side_effect=get_raw), \
+                mock.patch.object(client, '_build_page_df', side_effect=build_page_df):
+            pages = list(client.get_activities_parallel(datetime.datetime(2020, 1, 1), max_workers=2))
+
+        _, default_cols = client._get_activities_field_filter(False, None)
+        self.assertEqual(sorted(p['engagement.id'][0] for p in pages), [0, 1, 2])
+        self.assertTrue(all(list(p.columns) == default_cols for p in pages))
+        self.assertEqual(pages[0]['associations.contactIds'][0], [1])
+
+    def test_offset_stride_follows_capped_page_size(self):
+        client = client_service.HubspotClientService('token', 'Private App Token')
+        requests = []
+
+        def get_raw(url, params, **kwargs):
+            requests.append((params['offset'], params['count']))
+            # the endpoint returns max 100 records whatever count is requested
+            ids = range(params['offset'], min(params['offset'] + min(params['count'], 100), 250))
+            return _response({'results': [{'engagement': {'id': i}} for i in ids], 'total': 250, 'hasMore': True})
+
+        with mock.patch.object(client, 'get_raw', side_effect=get_raw), \
+                mock.patch.object(client, '_build_page_df',
+                                  side_effect=lambda records, default_cols: pd.json_normalize(records)):
+            pages = list(client.get_activities_parallel(datetime.datetime(2020, 1, 1), max_workers=2))
+
+        self.assertEqual(sorted(i for p in pages for i in p['engagement.id']), list(range(250)))
+        self.assertEqual(sorted(requests[1:]), [(100, 100), (200, 100)])
+
+    def test_full_scan_fetched_ahead_by_single_worker(self):
+        client = client_service.HubspotClientService('token', 'Private App Token')
+        with mock.patch.object(client, 'get_activities', return_value=iter(['page1', 'page2'])) as get_activities:
+            pages = list(client.get_activities_parallel(None, True, ['engagement.type']))
+        get_activities.assert_called_once_with(None, True, ['engagement.type'])
+        self.assertEqual(pages, ['page1', 'page2'])
+
+
+class TestCompaniesModifiedSince(unittest.TestCase):
+
+    def test_full_scan_fallback_skips_searched_companies(self):
+        client = client_service.HubspotClientService('token', 'Private App Token')
+
+        def search(*args, **kwargs):
+            yield [{'id': '1', 'properties': {'name': 'a'}}]
+            raise client_v3.SearchWindowExhausted('exhausted')
+
+        full_scan = [pd.DataFrame({'companyId': [1, 2], 'properties.name.value': ['a', 'b']})]
+        with mock.patch.object(client._client_v3, 'search_objects_modified_since', side_effect=search), \
+                mock.patch.object(client, '_build_page_df',
+                                  side_effect=lambda records, default_cols: pd.json_normalize(records)), \
+                mock.patch.object(client, 'get_companies', return_value=full_scan):
+            pages = list(client.get_companies_modified_since({}, 1000))
+
+        self.assertEqual([page['companyId'].tolist() for page in pages], [[1], [2]])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,94 @@
+import datetime
+import unittest
+from unittest import mock
+
+from hubspot_api import client_v3
+
+
+def _response(body: dict):
+    response = mock.Mock()
+    response.status_code = 200
+    response.json.return_value = body
+    response.content = b'{}'
+    response.elapsed = datetime.timedelta(seconds=0.1)
+    return response
+
+
+def _company(company_id, modified):
+    return {'id': company_id, 'properties': {'hs_lastmodifieddate': modified}}
+
+
+class TestSearch(unittest.TestCase):
+
+    def setUp(self):
+        self.client = client_v3.ClientV3('token', 'Private App Token')
+
+    def test_iso_to_epoch_ms(self):
+        self.assertEqual(client_v3.iso_to_epoch_ms('1970-01-01T00:00:01.500Z'), 1500)
+        self.assertIsNone(client_v3.iso_to_epoch_ms(None))
+
+    def test_search_moves_window_at_results_limit(self):
+        bodies = []
+        responses = iter([
+            _response({'results': [_company('1', '1970-01-01T00:00:02Z')], 'paging': {'next': {'after': '9950'}}}),
+            _response({'results': [_company('2', '1970-01-01T00:00:03Z')]})])
+
+        def post(url, json):
+            bodies.append(dict(json))
+            return next(responses)
+
+        with mock.patch.object(self.client, 'post_raw', side_effect=post):
+            pages = list(self.client.search_objects_modified_since('companies', ['name'], 1000))
+
+        self.assertEqual([[r['id'] for r in p] for p in pages], [['1'], ['2']])
+        self.assertEqual(bodies[0]['filterGroups'][0]['filters'][0]['value'], '1000')
+        self.assertEqual(bodies[1]['filterGroups'][0]['filters'][0]['value'], '2000')
+        self.assertEqual(bodies[1]['after'], 0)
+        self.assertIn('hs_lastmodifieddate', bodies[0]['properties'])
+
+    def test_search_window_exhausted(self):
+        response = _response({'results': [_company('1', '1970-01-01T00:00:01Z')],
+                              'paging': {'next': {'after': '9950'}}})
+        with mock.patch.object(self.client, 'post_raw', return_value=response):
+            with self.assertRaises(client_v3.SearchWindowExhausted):
+                list(self.client.search_objects_modified_since('companies', ['name'], 1000))
+
+    def test_search_modified_before_filter(self):
+        bodies = []
+
+        def post(url, json):
+            bodies.append(dict(json))
+            return _response({'results': []})
+
+        with mock.patch.object(self.client, 'post_raw', side_effect=post):
+            list(self.client.search_objects_modified_since('contacts', ['email'], 1000,
+                                                           modified_property='lastmodifieddate',
+                                                           modified_before=5000))
+
+        filters = bodies[0]['filterGroups'][0]['filters']
+        self.assertEqual([(f['propertyName'], f['operator'], f['value']) for f in filters],
+                         [('lastmodifieddate', 'GTE', '1000'), ('lastmodifieddate', 'LT', '5000')])
+
+
+class TestAssociationTypes(unittest.TestCase):
+
+    def test_type_names_mapped_to_labels(self):
+        client = client_v3.ClientV3('token', 'Private App Token')
+        responses = {'crm/v3/associations/call/contact/types': {'results': [{'id': '194', 'name': 'call_to_contact'},
+                                                                            {'id': '9', 'name': 'unknown'}]},
+                     'crm/v4/associations/call/contact/labels': {'results': [
+                         {'typeId': 194, 'label': 'Decision maker', 'category': 'USER_DEFINED'}]}}
+
+        def get(url):
+            return _response(responses[url[len(client_v3.BASE_URL):]])
+
+        with mock.patch.object(client, 'get_raw', side_effect=get):
+            definitions = client.get_association_type_definitions('call', 'contact')
+
+        self.assertEqual(definitions, {'call_to_contact': {'typeId': 194, 'label': 'Decision maker',
+                                                           'category': 'USER_DEFINED'},
+                                       'unknown': {'typeId': '9'}})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,46 @@
+import os
+import tempfile
+import unittest
+
+import column_join
+
+
+class TestColumnGroupJoin(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_groups_joined_by_id_with_spill(self):
+        joined = column_join.ColumnGroupJoin('companyId', buffer_size=2, directory=self.tmp_dir.name)
+        joined.add(1, [{'companyId': 10, 'properties.b.value': 'b10'},
+                       {'companyId': 2, 'properties.b.value': 'b2'}])
+        joined.add(0, [{'companyId': 2, 'isDeleted': False, 'properties.a.value': 'a2'},
+                       {'companyId': 10, 'isDeleted': True, 'properties.a.value': 'a10'},
+                       {'companyId': '', 'properties.a.value': 'no id'}])
+        joined.add(1, [{'companyId': 3, 'properties.b.value': 'b3'}])
+        self.assertTrue(os.listdir(self.tmp_dir.name))
+
+        self.assertEqual(list(joined), [
+            {'companyId': 2, 'isDeleted': False, 'properties.a.value': 'a2', 'properties.b.value': 'b2'},
+            {'companyId': 3, 'properties.b.value': 'b3'},
+            {'companyId': 10, 'isDeleted': True, 'properties.a.value': 'a10', 'properties.b.value': 'b10'}])
+        self.assertEqual(joined.rows_added, 5)
+
+        joined.close()
+        self.assertEqual(os.listdir(self.tmp_dir.name), [])
+
+    def test_objects_missing_from_group_skipped(self):
+        joined = column_join.ColumnGroupJoin('dealId', groups=2, directory=self.tmp_dir.name)
+        joined.add(0, [{'dealId': 1, 'properties.a.value': 'a1'}, {'dealId': 2, 'properties.a.value': 'a2'}])
+        joined.add(1, [{'dealId': 1, 'properties.b.value': 'b1'}, {'dealId': 3, 'properties.b.value': 'b3'}])
+
+        self.assertEqual(list(joined), [{'dealId': 1, 'properties.a.value': 'a1', 'properties.b.value': 'b1'}])
+        self.assertEqual(joined.incomplete, 2)
+        joined.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
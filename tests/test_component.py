@@ -3,11 +3,313 @@ Created on 12. 11. 2018
 
 @author: esner
 '''
+import csv
+import io
+import json
+import os
+import tempfile
 import unittest
+from unittest import mock
+
+import pandas as pd
+
+import profiling
+from hubspot_api import json_stream, recovery
+from component import (Component, STATE_COMPANIES_LAST_MODIFIED, STATE_CONTACTS_LAST_MODIFIED,
+                       STATE_LISTS_UPDATED_AT, STATE_PROPERTY_NAMES, STATE_TABLE_SCHEMAS)
+from hubspot_api.client_service import CONTACT_DEFAULT_PROPERTIES, HubspotClientService
 
 
 class TestComponent(unittest.TestCase):
-    pass
+
+    def test_portal_copy_has_own_tables_and_state(self):
+        comp = Component.__new__(Component)
+        comp.data_folder_path = '/data'
+        comp._state = {}
+        comp._table_prefix = ''
+        portal_state = {STATE_TABLE_SCHEMAS: {'x': ['id']}}
+
+        worker = comp._for_portal('123', portal_state)
+        worker._state['companies_last_modified'] = 1
+
+        self.assertEqual(worker._get_out_path('owners.csv'), os.path.join('/data', 'out', 'tables',
+                                                                          'portal_123_owners.csv'))
+        self.assertEqual(comp._get_out_path('owners.csv'), os.path.join('/data', 'out', 'tables', 'owners.csv'))
+        self.assertEqual(worker._object_schemas, {'x': ['id']})
+        self.assertEqual(comp._state, {})
+
+    def test_all_properties_resolved_from_cache(self):
+        comp = Component.__new__(Component)
+        comp._state = {}
+        client = mock.Mock()
+        client.get_property_names.return_value = ['name', 'custom_score']
+
+        self.assertEqual(comp._resolve_properties(client, 'companies', ['name']), ['name'])
+        self.assertEqual(comp._resolve_properties(client, 'companies', ['ALL']), ['name', 'custom_score'])
+        self.assertEqual(comp._resolve_properties(client, 'companies', ['all']), ['name', 'custom_score'])
+        client.get_property_names.assert_called_once_with('companies')
+        self.assertEqual(comp._state[STATE_PROPERTY_NAMES]['companies']['names'], ['name', 'custom_score'])
+
+    def test_default_contact_properties_track_last_modified(self):
+        comp = Component.__new__(Component)
+        comp._state = {}
+        client = HubspotClientService('token', 'Private App Token')
+        _, default_cols = client._get_contact_properties_and_cols({'include_versions': False},
+                                                                  list(CONTACT_DEFAULT_PROPERTIES))
+        self.assertIn('properties.lastmodifieddate.value', default_cols)
+
+        record = {'canonical-vid': 1, 'properties': {'lastmodifieddate': {'value': '1600000000000'}}}
+        # the page as built by _build_page_df from the columns of the default properties
+        page = pd.json_normalize([record]).reindex(columns=default_cols).fillna('')
+        with mock.patch.object(client, 'get_contacts', return_value=[page]) as get_contacts:
+            pages = list(comp._get_contacts_incremental(client, None, None, {}, False))
+
+        self.assertEqual(get_contacts.call_args[0][2], CONTACT_DEFAULT_PROPERTIES)
+
+        self.assertEqual(pages[0]['properties.lastmodifieddate.value'].tolist(), ['1600000000000'])
+        self.assertEqual(comp._state[STATE_CONTACTS_LAST_MODIFIED], 1600000000000)
+
+    def test_default_contacts_header(self):
+        client = HubspotClientService('token', 'Private App Token')
+        _, columns = client._get_contact_properties_and_cols({'include_source': False, 'include_timestamp': False,
+                                                              'include_versions': False})
+        self.assertEqual(columns, [
+            'addedAt', 'canonical-vid', 'form-submissions', 'identity-profiles', 'is-contact', 'list-memberships',
+            'merge-audits', 'merged-vids', 'portal-id', 'profile-token', 'profile-url', 'vid',
+            'properties.addedAt.value', 'properties.canonical-vid.value', 'properties.form-submissions.value',
+            'properties.identity-profiles.value', 'properties.is-contact.value', 'properties.list-memberships.value',
+            'properties.merge-audits.value', 'properties.merged-vids.value', 'properties.portal-id.value',
+            'properties.profile-token.value', 'properties.profile-url.value', 'properties.vid.value'])
+
+    def test_state_kept_after_quarantined_page(self):
+        comp = Component.__new__(Component)
+        comp._state = {STATE_CONTACTS_LAST_MODIFIED: 1000}
+        client = mock.Mock()
+        client.has_quarantined_pages.return_value = True
+        page = pd.DataFrame({'properties.lastmodifieddate.value': ['2000']})
+
+        pages = list(comp._track_last_modified([page], 'properties.lastmodifieddate.value',
+                                               STATE_CONTACTS_LAST_MODIFIED, client, ['contacts']))
+
+        self.assertEqual(len(pages), 1)
+        self.assertEqual(comp._state[STATE_CONTACTS_LAST_MODIFIED], 1000)
+        client.has_quarantined_pages.assert_called_once_with('contacts')
+
+    def test_column_groups_skip_incomplete_and_later_modified_objects(self):
+        comp = Component.__new__(Component)
+        comp.incremental = True
+        comp._state = {STATE_COMPANIES_LAST_MODIFIED: 9999999999999}
+        configuration = mock.Mock()
+        configuration.parameters = {'property_group_size': 1}
+        requested = []
+
+        def fetch(group_fields, primary):
+            requested.append(group_fields)
+            if group_fields[0] == 'a':
+                # company 3 was modified after the scans started
+                return [pd.DataFrame({'companyId': [1, 2, 3], 'isDeleted': [False, False, False],
+                                      'properties.a.value': ['a1', 'a2', 'a3'],
+                                      'properties.hs_lastmodifieddate.value': ['100', '100', '9999999999999']})]
+            # company 2 was created after the scan of this group
+            return [pd.DataFrame({'companyId': [1, 3], 'isDeleted': [False, False],
+                                  'properties.b.value': ['b1', 'b3'],
+                                  'properties.hs_lastmodifieddate.value': ['100', '100']})]
+
+        with mock.patch.object(Component, 'configuration', new_callable=mock.PropertyMock,
+                               return_value=configuration):
+            pages = list(comp._get_in_column_groups(fetch, ['a', 'b'], 'companyId', 'hs_lastmodifieddate',
+                                                    STATE_COMPANIES_LAST_MODIFIED))
+
+        self.assertEqual(sorted(requested), [['a', 'hs_lastmodifieddate'], ['b', 'hs_lastmodifieddate']])
+        self.assertEqual(pages[0].to_dict('records'), [{'companyId': 1, 'isDeleted': False,
+                                                        'properties.a.value': 'a1', 'properties.b.value': 'b1',
+                                                        'properties.hs_lastmodifieddate.value': '100'}])
+        # the later modified company is fetched again by the next run
+        self.assertLess(comp._state[STATE_COMPANIES_LAST_MODIFIED], 9999999999999)
+
+    def test_list_memberships_replace_completely_fetched_lists(self):
+        comp = Component.__new__(Component)
+        comp._state = {STATE_LISTS_UPDATED_AT: {'1': 5, '3': 7}}
+        comp._table_prefix = ''
+        comp._edge_sets = {}
+        comp._edge_set_pks = {}
+        comp._edge_set_delete_where = {}
+        comp._run_metrics = {}
+        comp.incremental = True
+        comp._profiler = profiling.StageProfiler()
+        client = mock.Mock()
+        client.get_list_updates.return_value = [(1, 10), (2, 20), (3, 7)]
+        client.get_list_memberships.return_value = [[{'list_id': 1, 'contact_vid': 11, 'added_at': 1}],
+                                                    [{'list_id': 2, 'contact_vid': 21, 'added_at': 2}]]
+        # list 2 stopped on a quarantined page
+        client.has_quarantined_pages.side_effect = lambda endpoint: '/2/' in endpoint
+
+        with tempfile.TemporaryDirectory() as data_dir:
+            comp.data_folder_path = data_dir
+            os.makedirs(os.path.join(data_dir, 'out', 'tables'))
+            comp.get_list_memberships(client, [])
+            comp._write_edge_sets()
+            with open(os.path.join(data_dir, 'out', 'tables', 'list_memberships.csv.manifest')) as inp:
+                manifest = json.load(inp)
+
+        client.get_list_memberships.assert_called_once_with([1, 2])
+        self.assertEqual(comp._state[STATE_LISTS_UPDATED_AT], {'1': 10, '3': 7})
+        self.assertEqual(manifest['delete_where_column'], 'list_id')
+        self.assertEqual(manifest['delete_where_values'], ['1'])
+
+    def test_quarantined_reference_objects_not_written(self):
+        comp = Component.__new__(Component)
+        comp._state = {}
+        comp._portal_id = None
+        comp._run_metrics = {}
+        client = mock.Mock()
+        client.has_quarantined_pages.return_value = True
+        configuration = mock.Mock()
+
+        with mock.patch.object(Component, 'configuration', new_callable=mock.PropertyMock,
+                               return_value=configuration):
+            for settings in ({}, {'enabled': True}):
+                configuration.parameters = {'reference_cache': settings}
+                self.assertIsNone(comp._get_reference_objects(client, 'owners', lambda: iter([]), 'owners/v2/'))
+
+        client.has_quarantined_pages.assert_called_with('owners/v2/')
+        self.assertEqual(comp._state.get('reference_hashes'), {})
+
+    def test_engagement_associations_inline_and_batched(self):
+        comp = Component.__new__(Component)
+        comp._table_prefix = ''
+        comp._object_schemas = {}
+        comp._edge_sets = {}
+        comp._edge_set_pks = {}
+        comp.incremental = False
+        comp._profiler = profiling.StageProfiler(enabled=True)
+        comp._profiler.start_endpoint('calls')
+        client = mock.Mock()
+        client.get_v3_engagement_object.return_value = [[
+            {'id': '1', 'properties': {'hs_call_title': 'a'},
+             'associations': {'contacts': {'results': [{'id': '7', 'type': 'call_to_contact_unlabeled'},
+                                                       {'id': '7', 'type': 'call_to_contact'}]}}},
+            {'id': '2', 'properties': {'hs_call_title': 'b'},
+             'associations': {'contacts': {'results': [{'id': '8', 'type': 'call_to_contact'}],
+                                           'paging': {'next': {'after': '1'}}}}}]]
+        client.get_associations.return_value = [{'from': {'id': '2'}, 'to': [{'id': 9, 'type': 'call_to_contact'}]}]
+        client.get_association_type_definitions.return_value = {
+            'call_to_contact': {'typeId': 194, 'label': 'Decision maker', 'category': 'USER_DEFINED'},
+            'call_to_contact_unlabeled': {'typeId': 1, 'label': None, 'category': 'HUBSPOT_DEFINED'}}
+
+        with tempfile.TemporaryDirectory() as data_dir:
+            comp.data_folder_path = data_dir
+            os.makedirs(os.path.join(data_dir, 'out', 'tables'))
+            comp._dowload_crm_v3_object(client, 'calls', ['hs_call_title'], associations=['contact'])
+
+            with open(os.path.join(data_dir, 'out', 'tables', 'calls.csv')) as inp:
+                self.assertNotIn('call_to_contact', inp.read())
+
+        client.get_v3_engagement_object.assert_called_once_with('calls', ['hs_call_title'], ['contact'])
+        # the truncated inline associations are read by a batch request
+        client.get_associations.assert_called_once_with('call', 'contact', ['2'], 'v3')
+        client.get_association_type_definitions.assert_called_once_with('call', 'contact')
+        self.assertEqual(sorted(comp._edge_sets['engagement_associations.csv']),
+                         [(1, 'call', 7, 'contact', 'call_to_contact,call_to_contact_unlabeled', 'Decision maker',
+                           'HUBSPOT_DEFINED,USER_DEFINED'),
+                          (2, 'call', 9, 'contact', 'call_to_contact', 'Decision maker', 'USER_DEFINED')])
+        # the rows of a page are written as a single write
+        self.assertEqual(comp._profiler.breakdown()[0]['writes'], 1)
+
+    def test_engagement_streamed_page_written(self):
+        comp = Component.__new__(Component)
+        comp._table_prefix = ''
+        comp._object_schemas = {}
+        comp._edge_sets = {}
+        comp._edge_set_pks = {}
+        comp.incremental = False
+        comp._profiler = profiling.StageProfiler()
+        response = mock.Mock()
+        response.raw = io.BytesIO(b'{"results": [{"id": "1", "properties": {"hs_call_title": "a"}, "associations": '
+                                  b'{"contacts": {"results": [{"id": "7", "type": "call_to_contact"}]}}}]}')
+        client = mock.Mock()
+        client.get_v3_engagement_object.return_value = [json_stream.StreamedPage(response, 'results')]
+        client.get_association_type_definitions.return_value = {}
+
+        with tempfile.TemporaryDirectory() as data_dir:
+            comp.data_folder_path = data_dir
+            os.makedirs(os.path.join(data_dir, 'out', 'tables'))
+            comp._dowload_crm_v3_object(client, 'calls', ['hs_call_title'], associations=['contact'])
+
+            with open(os.path.join(data_dir, 'out', 'tables', 'calls.csv')) as inp:
+                rows = list(csv.reader(inp))
+
+        self.assertEqual(rows, [['1', 'a']])
+        self.assertEqual(list(comp._edge_sets['engagement_associations.csv']),
+                         [(1, 'call', 7, 'contact', 'call_to_contact', '', '')])
+
+    def test_quarantined_association_batch_skipped(self):
+        comp = Component.__new__(Component)
+        comp._table_prefix = ''
+        comp._object_schemas = {}
+        comp._edge_sets = {}
+        comp._edge_set_pks = {}
+        comp.incremental = False
+        comp._profiler = profiling.StageProfiler()
+        client = mock.Mock()
+        client.get_v3_engagement_object.return_value = [[{'id': '1', 'properties': {}}]]
+        client.get_associations.side_effect = recovery.PageQuarantined('quarantined')
+        client.get_association_type_definitions.side_effect = recovery.PageQuarantined('quarantined')
+
+        with tempfile.TemporaryDirectory() as data_dir:
+            comp.data_folder_path = data_dir
+            os.makedirs(os.path.join(data_dir, 'out', 'tables'))
+            comp._dowload_crm_v3_object(client, 'calls', [], associations=['contact'], associations_mode='batch')
+
+        client.get_associations.assert_called_once_with('call', 'contact', ['1'], 'v3')
+        self.assertNotIn('engagement_associations.csv', comp._edge_sets)
+
+    def test_contact_association_types_kept(self):
+        comp = Component.__new__(Component)
+        comp._edge_sets = {}
+        comp._edge_set_pks = {}
+        association_types = [{'category': 'HUBSPOT_DEFINED', 'typeId': 279, 'label': None},
+                             {'category': 'USER_DEFINED', 'typeId': 1, 'label': 'Primary'}]
+        comp._write_associations('contact', 'company', [
+            {'from': {'id': 1}, 'to': [{'toObjectId': 5, 'associationTypes': association_types}]}])
+        self.assertEqual(list(comp._edge_sets['object_associations.csv']),
+                         [(1, 'contact', 5, 'company', str(association_types))])
+
+    def test_dry_run_keeps_table_schemas(self):
+        comp = Component.__new__(Component)
+        comp._state = {STATE_TABLE_SCHEMAS: {'x': ['id']}}
+        comp._object_schemas = comp._state[STATE_TABLE_SCHEMAS]
+        comp._run_metrics = {}
+        comp._writer_cache = {}
+        comp._table_prefix = ''
+        plans = [{'endpoint': 'owners', 'records': 3}]
+
+        with tempfile.TemporaryDirectory() as data_dir:
+            comp.data_folder_path = data_dir
+            os.makedirs(os.path.join(data_dir, 'out', 'tables'))
+            with mock.patch.object(comp, '_get_token', return_value=('token', 'API Key')), \
+                    mock.patch.object(comp, '_plan_portal', return_value=(plans, {})), \
+                    mock.patch.object(comp, 'write_manifest'):
+                comp._dry_run({})
+
+            with open(os.path.join(data_dir, 'out', 'tables', 'run_plan.csv')) as inp:
+                rows = list(csv.DictReader(inp))
+
+        self.assertEqual([(r['endpoint'], r['records']) for r in rows], [('owners', '3')])
+        self.assertEqual(comp._state[STATE_TABLE_SCHEMAS], {'x': ['id']})
+
+    def test_cassette_saved_when_extraction_fails(self):
+        comp = Component.__new__(Component)
+        comp._memory_governor = None
+        comp._run_metrics = {}
+
+        with mock.patch.object(comp, '_build_transport'), \
+                mock.patch('component.HubspotClientService') as client_cls, \
+                mock.patch.object(comp, '_extract_endpoints', side_effect=RuntimeError('failed')):
+            with self.assertRaises(RuntimeError):
+                comp._extract({}, 'token', 'API Key', {})
+
+        client_cls.return_value.transport.close.assert_called_once_with()
 
 
 if __name__ == "__main__":
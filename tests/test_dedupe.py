@@ -0,0 +1,51 @@
+import csv
+import os
+import tempfile
+import unittest
+
+import dedupe
+
+
+class TestDedupe(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, 'table.csv')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def _write(self, rows):
+        with open(self.path, 'w', encoding='utf-8', newline='') as out:
+            csv.writer(out, lineterminator='\n').writerows(rows)
+
+    def _read(self):
+        with open(self.path, encoding='utf-8', newline='') as inp:
+            return list(csv.reader(inp))
+
+    def test_find_columns(self):
+        self.assertEqual(dedupe.find_columns(['portal-id', 'canonical-vid'], ['canonical_vid', 'portal_id']), [1, 0])
+        self.assertEqual(dedupe.find_columns(['dealId', 'name'], ['dealId ']), [0])
+        self.assertIsNone(dedupe.find_columns(['name'], ['dealId']))
+
+    def test_keeps_last_row_without_version(self):
+        self._write([['1', 'a'], ['2', 'b'], ['1', 'c\nmultiline']])
+        removed = dedupe.dedupe_csv(self.path, [0])
+        self.assertEqual(removed, 1)
+        self.assertEqual(self._read(), [['2', 'b'], ['1', 'c\nmultiline']])
+
+    def test_keeps_highest_version(self):
+        self._write([['1', '200', 'new'], ['2', '100', 'b'], ['1', '100', 'old']])
+        removed = dedupe.dedupe_csv(self.path, [0], version_index=1)
+        self.assertEqual(removed, 1)
+        self.assertEqual(self._read(), [['1', '200', 'new'], ['2', '100', 'b']])
+
+    def test_no_duplicates_not_rewritten(self):
+        self._write([['1', 'a'], ['2', 'b']])
+        mtime = os.stat(self.path).st_mtime_ns
+        self.assertEqual(dedupe.dedupe_csv(self.path, [0]), 0)
+        self.assertEqual(os.stat(self.path).st_mtime_ns, mtime)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,43 @@
+import csv
+import os
+import tempfile
+import unittest
+
+import edge_set
+import typed_rows
+
+
+class TestEdgeSet(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_unique_sorted_rows_with_spill(self):
+        edges = edge_set.EdgeSet(['from_id', 'to_id'], buffer_size=2, directory=self.tmp_dir.name)
+        edges.add_all([(3, 1), (1, 2), (3, 1), (1, 2), (2, None)])
+        edges.add_dict({'to_id': 5, 'from_id': 1})
+
+        path = os.path.join(self.tmp_dir.name, 'edges.csv')
+        written = edges.write(path)
+
+        with open(path, encoding='utf-8', newline='') as inp:
+            rows = list(csv.reader(inp))
+        self.assertEqual(rows, [['1', '2'], ['1', '5'], ['2', ''], ['3', '1']])
+        self.assertEqual(written, 4)
+        self.assertEqual(edges.rows_added, 6)
+        self.assertEqual(os.listdir(self.tmp_dir.name), ['edges.csv'])
+
+    def test_typed_columns_sorted_numerically(self):
+        edges = edge_set.EdgeSet(['from_id', 'to_type'], buffer_size=2, directory=self.tmp_dir.name,
+                                 column_types={'from_id': typed_rows.INT, 'to_type': typed_rows.ENUM})
+        edges.add_all([(10, 'deal'), ('9', 'deal'), ('abc', 'deal'), (10, 'deal'), (None, 'deal')])
+
+        self.assertEqual(list(edges), [(9, 'deal'), (10, 'deal'), ('', 'deal'), ('abc', 'deal')])
+        edges.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,28 @@
+import os
+import subprocess
+import sys
+import unittest
+
+SRC_PATH = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'src')
+
+
+class TestImports(unittest.TestCase):
+
+    def test_heavy_modules_not_imported_at_startup(self):
+        probe = ('import sys, component; '
+                 'print(",".join(m for m in ("pandas", "numpy", "keboola.utils", "keboola.csvwriter") '
+                 'if m in sys.modules))')
+        result = subprocess.run([sys.executable, '-c', probe], cwd=SRC_PATH, capture_output=True, text=True,
+                                check=True)
+        self.assertEqual(result.stdout.strip(), '')
+
+    def test_lazy_module_loads_on_access(self):
+        from lazy_import import LazyModule
+        module = LazyModule('json')
+        self.assertFalse(module.loaded)
+        self.assertEqual(module.dumps([1]), '[1]')
+        self.assertTrue(module.loaded)
+
+
+if __name__ == "__main__":
+    unittest.main()
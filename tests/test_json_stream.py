@@ -0,0 +1,64 @@
+import io
+import unittest
+from unittest import mock
+
+from hubspot_api import json_stream
+
+
+def _response(body: bytes):
+    response = mock.Mock()
+    response.raw = io.BytesIO(body)
+    return response
+
+
+class TestJsonStream(unittest.TestCase):
+
+    def test_iter_items_top_level_array(self):
+        response = _response(b'[{"pipelineId": "default", "stages": [{"stageId": "a"}]}, {"pipelineId": "b"}]')
+        items = list(json_stream.iter_items(response))
+        self.assertEqual([i['pipelineId'] for i in items], ['default', 'b'])
+        self.assertEqual(items[0]['stages'], [{'stageId': 'a'}])
+
+    def test_iter_items_floats(self):
+        response = _response(b'[{"probability": 0.2}]')
+        self.assertIsInstance(next(json_stream.iter_items(response))['probability'], float)
+
+    def test_streamed_page_collects_paging_fields(self):
+        response = _response(b'{"contacts": [{"vid": 1, "list-memberships": [{"vid": 5}]}, {"vid": 2}], '
+                             b'"has-more": true, "vid-offset": 2}')
+        page = json_stream.StreamedPage(response, 'contacts')
+        self.assertEqual([c['vid'] for c in page], [1, 2])
+        self.assertEqual(page.meta, {'has-more': True, 'vid-offset': 2})
+        self.assertEqual(page.count, 2)
+
+    def test_streamed_page_nested_paging_before_results(self):
+        response = _response(b'{"paging": {"next": {"after": "20"}}, "results": [{"id": "1"}, {"id": "2"}, '
+                             b'{"id": "3"}]}')
+        page = json_stream.StreamedPage(response, 'results')
+        self.assertEqual([len(c) for c in page.chunks(2)], [2, 1])
+        self.assertEqual(page.drain()['paging.next.after'], '20')
+
+    def test_streamed_page_field_filter(self):
+        response = _response(b'{"results": [{"engagement": {"id": 1, "type": "EMAIL"}, '
+                             b'"metadata": {"html": {"a": [1]}, "subject": "s", "text": "t"}, '
+                             b'"associations": {"contactIds": [1, 2]}}], "hasMore": false}')
+        field_filter = json_stream.FieldFilter(include=['engagement.id', 'metadata', 'associations.contactIds'],
+                                               exclude=['metadata.text', 'metadata.html'])
+        page = json_stream.StreamedPage(response, 'results', field_filter=field_filter)
+        self.assertEqual(list(page), [{'engagement': {'id': 1}, 'metadata': {'subject': 's'},
+                                       'associations': {'contactIds': [1, 2]}}])
+        self.assertEqual(page.meta, {'hasMore': False})
+
+    def test_field_filter_apply(self):
+        field_filter = json_stream.FieldFilter(exclude=['metadata.text'])
+        record = {'metadata': {'text': 't', 'to': [{'email': 'e'}]}, 'id': 1}
+        self.assertEqual(field_filter.apply(record), {'metadata': {'to': [{'email': 'e'}]}, 'id': 1})
+
+    def test_streamed_page_invalid_body(self):
+        response = _response(b'{"results": [{"id": ')
+        with self.assertRaises(RuntimeError):
+            json_stream.StreamedPage(response, 'results').drain()
+
+
+if __name__ == "__main__":
+    unittest.main()
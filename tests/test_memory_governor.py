@@ -0,0 +1,42 @@
+import unittest
+
+import memory_governor
+
+MB = memory_governor.MB
+
+
+class TestMemoryGovernor(unittest.TestCase):
+
+    def test_pressure_and_relief_handlers(self):
+        samples = iter([100 * MB, 300 * MB, 900 * MB, 950 * MB, 600 * MB])
+        calls = []
+        governor = memory_governor.MemoryGovernor(1000 * MB, read_rss=lambda: next(samples))
+        governor.add_handlers(lambda: calls.append('pressure'), lambda: calls.append('relief'))
+
+        governor.start_endpoint('owners')
+        governor.start_endpoint('contacts')
+        governor.check()
+        # still under pressure, handlers are not repeated before PRESSURE_REPEAT_S
+        governor.check()
+        governor.end_endpoint()
+        governor.check()
+
+        self.assertEqual(calls, ['pressure', 'relief'])
+        self.assertFalse(governor.under_pressure)
+        self.assertEqual(governor.stats(), {'ceiling_mb': 1000.0, 'peak_rss_mb': 950.0, 'pressure_events': 1,
+                                            'high_water_mb': {'owners': 100.0, 'contacts': 950.0}})
+
+    def test_without_ceiling_only_measures(self):
+        calls = []
+        governor = memory_governor.MemoryGovernor(None, read_rss=lambda: 2000 * MB)
+        governor.add_handlers(lambda: calls.append('pressure'), lambda: calls.append('relief'))
+        governor.start_endpoint('deals')
+        self.assertEqual(calls, [])
+        self.assertEqual(governor.stats()['high_water_mb'], {'deals': 2000.0})
+
+    def test_reads_rss(self):
+        self.assertGreater(memory_governor.read_rss_bytes(), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,65 @@
+import unittest
+
+from requests.exceptions import ReadTimeout
+
+from hubspot_api import paging
+
+
+class TestAdaptivePageSize(unittest.TestCase):
+
+    def test_fixed_size_collects_stats(self):
+        pager = paging.AdaptivePageSize('contacts', 100, adaptive=False)
+        pager.on_page(10.0, 100, 100)
+        self.assertEqual(pager.size, 100)
+        self.assertFalse(pager.on_error())
+        self.assertEqual(pager.stats()['pages'], 1)
+        self.assertEqual(pager.stats()['errors'], 1)
+
+    def test_slow_page_shrinks_and_fast_page_grows(self):
+        pager = paging.AdaptivePageSize('deals', 250)
+        pager.on_page(10.0, 1000, 250)
+        self.assertEqual(pager.size, 187)
+        pager.on_page(0.5, 1000, 187)
+        self.assertEqual(pager.size, 250)
+        self.assertEqual(pager.stats()['sizes_used'], [187, 250])
+
+    def test_limit_caps_size_until_released(self):
+        pager = paging.AdaptivePageSize('deals', 250, adaptive=False)
+        pager.limit()
+        self.assertEqual(pager.size, 125)
+        pager.on_page(0.5, 1000, 125)
+        self.assertEqual(pager.size, 125)
+        pager.release_limit()
+        self.assertEqual(pager.size, 250)
+
+        pager = paging.AdaptivePageSize('contacts', 100)
+        pager.limit()
+        pager.on_page(0.5, 1000, 50)
+        self.assertEqual(pager.size, 50)
+
+    def test_request_retried_with_smaller_size(self):
+        pager = paging.AdaptivePageSize('events', 1000)
+        sizes = []
+
+        def send(size):
+            sizes.append(size)
+            if size > 250:
+                raise ReadTimeout('timeout')
+            return 'response'
+
+        self.assertEqual(paging.request_with_page_size(pager, send), 'response')
+        self.assertEqual(sizes, [1000, 500, 250])
+
+    def test_request_gives_up(self):
+        pager = paging.AdaptivePageSize('events', 20)
+
+        def send(size):
+            raise ReadTimeout('timeout')
+
+        with self.assertRaises(ReadTimeout):
+            paging.request_with_page_size(pager, send)
+        self.assertEqual(pager.size, pager.min_size)
+
+
+if __name__ == "__main__":
+    unittest.main()
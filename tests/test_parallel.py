@@ -0,0 +1,27 @@
+import unittest
+
+from hubspot_api import parallel
+
+
+class TestParallel(unittest.TestCase):
+
+    def test_merge_partitions_yields_all_items(self):
+        partitions = [lambda i=i: iter(range(i * 10, i * 10 + 10)) for i in range(4)]
+        items = list(parallel.merge_partitions(partitions, max_workers=3))
+        self.assertEqual(sorted(items), list(range(40)))
+
+    def test_merge_partitions_reraises_error(self):
+        def failing():
+            yield 1
+            raise ValueError('failed')
+
+        with self.assertRaises(ValueError):
+            list(parallel.merge_partitions([failing, lambda: iter(range(100))], max_workers=2))
+
+    def test_split_evenly(self):
+        self.assertEqual(parallel.split_evenly([1, 2, 3, 4, 5], 2), [[1, 2, 3], [4, 5]])
+        self.assertEqual(parallel.split_evenly([1], 3), [[1]])
+
+
+if __name__ == "__main__":
+    unittest.main()
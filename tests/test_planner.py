@@ -0,0 +1,36 @@
+import unittest
+
+import planner
+from hubspot_api import client_service
+
+
+class TestRunPlanner(unittest.TestCase):
+
+    def test_probe_and_previous_run_statistics(self):
+        stats = {client_service.CAMPAIGNS_BY_ID: {'pages': 2, 'records': 1500, 'avg_latency_s': 1.0}}
+        run_planner = planner.RunPlanner(stats, requests_per_second=1)
+
+        deals = run_planner.add('deals', 'full', lambda: 1001)
+        campaigns = run_planner.add('campaigns', 'full', requests_per_record=1)
+        lists = run_planner.add('lists', 'full')
+
+        self.assertEqual((deals['records_source'], deals['pages'], deals['requests']), ('probe', 5, 5))
+        # the rate limit is the lower bound of the 2.5s from the default latency
+        self.assertEqual(deals['estimated_seconds'], 5.0)
+        self.assertEqual((campaigns['records_source'], campaigns['pages'], campaigns['requests']),
+                         ('previous_run', 2, 1502))
+        self.assertEqual(campaigns['estimated_seconds'], 1502.0)
+        self.assertEqual((lists['records_source'], lists['requests']), ('unknown', None))
+        self.assertEqual(run_planner.summary(), {'requests': 1507, 'estimated_seconds': 1507.0,
+                                                 'unknown_endpoints': ['lists']})
+
+    def test_failed_probe_falls_back_to_unknown(self):
+        def probe():
+            raise RuntimeError('missing scope')
+
+        plan = planner.RunPlanner({}).add('owners', 'full', probe)
+        self.assertEqual((plan['records'], plan['records_source'], plan['requests']), (None, 'unknown', 1))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,71 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+import profiling
+
+
+class TestStageProfiler(unittest.TestCase):
+
+    def test_stages_split_endpoint_time(self):
+        profiler = profiling.StageProfiler(enabled=True)
+        profiler.start_endpoint('owners')
+        with profiler.stage(profiling.STAGE_FETCH):
+            time.sleep(0.02)
+        with profiler.stage(profiling.STAGE_WRITE):
+            time.sleep(0.01)
+        time.sleep(0.01)
+        profiler.start_endpoint('deals')
+        profiler.stop()
+
+        owners, deals = profiler.breakdown()
+        self.assertEqual(owners['endpoint'], 'owners')
+        self.assertGreaterEqual(owners['fetch_s'], 0.02)
+        self.assertGreaterEqual(owners['write_s'], 0.01)
+        self.assertGreaterEqual(owners['transform_s'], 0.005)
+        self.assertEqual((owners['requests'], owners['writes']), (1, 1))
+        self.assertEqual(deals['requests'], 0)
+
+    def test_disabled_profiler_records_nothing(self):
+        profiler = profiling.StageProfiler()
+        profiler.start_endpoint('owners')
+        with profiler.stage(profiling.STAGE_FETCH):
+            pass
+        profiler.stop()
+        self.assertEqual(profiler.breakdown(), [])
+
+
+class TestSamplingProfiler(unittest.TestCase):
+
+    def test_folded_stacks_written(self):
+        stop = threading.Event()
+
+        def busy_wait():
+            while not stop.is_set():
+                time.sleep(0.001)
+
+        worker = threading.Thread(target=busy_wait, name='worker')
+        sampler = profiling.SamplingProfiler(interval_ms=1)
+        sampler.start()
+        worker.start()
+        time.sleep(0.05)
+        stop.set()
+        worker.join()
+        sampler.stop()
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'profile.folded')
+            sampler.write_folded(path)
+            with open(path) as inp:
+                lines = inp.read().splitlines()
+        self.assertGreater(sampler.samples, 0)
+        self.assertTrue(any(line.startswith('worker;') and 'busy_wait (test_profiling.py:' in line
+                            for line in lines))
+        stack, count = lines[0].rsplit(' ', 1)
+        self.assertGreater(int(count), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,38 @@
+import unittest
+
+import pandas as pd
+
+import property_history
+
+
+class TestPropertyHistory(unittest.TestCase):
+
+    def test_iter_property_history(self):
+        page = pd.DataFrame([
+            {'dealId': 1, 'properties.amount.value': '10',
+             'properties.amount.versions': [{'value': '10', 'timestamp': 2, 'source': 'API', 'sourceId': 'x'},
+                                            {'value': '5', 'timestamp': 1, 'source': 'CRM_UI'}],
+             'properties.dealname.versions': [{'value': 'A', 'timestamp': 1, 'source': 'CRM_UI'}]},
+            {'dealId': 2, 'properties.amount.value': '', 'properties.amount.versions': '',
+             'properties.dealname.versions': [{'value': 'B', 'timestamp': 3, 'source': 'API'}]}])
+
+        versions_columns = property_history.get_versions_columns(page.columns)
+        self.assertEqual(versions_columns, ['properties.amount.versions', 'properties.dealname.versions'])
+
+        rows = list(property_history.iter_property_history(page, 'dealId', versions_columns))
+        self.assertEqual([(r['object_id'], r['property'], r['value']) for r in rows],
+                         [(1, 'amount', '10'), (1, 'amount', '5'), (1, 'dealname', 'A'), (2, 'dealname', 'B')])
+        self.assertEqual(rows[0]['source_id'], 'x')
+        self.assertEqual(set(rows[0].keys()), set(property_history.PROPERTY_HISTORY_COLS))
+
+    def test_versions_of_same_timestamp_keep_distinct_keys(self):
+        versions = [{'value': '10', 'timestamp': 2, 'source': 'API', 'sourceId': 'x'},
+                    {'value': '12', 'timestamp': 2, 'source': 'WORKFLOWS', 'sourceId': 'y'}]
+        page = pd.DataFrame([{'dealId': 1, 'properties.amount.versions': versions}])
+        rows = property_history.iter_property_history(page, 'dealId', ['properties.amount.versions'])
+        keys = {tuple(r[c] for c in property_history.PROPERTY_HISTORY_PK) for r in rows}
+        self.assertEqual(len(keys), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
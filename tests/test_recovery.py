@@ -0,0 +1,62 @@
+import unittest
+from unittest import mock
+
+from requests.exceptions import ConnectionError
+
+from hubspot_api import recovery
+
+
+def _error(status_code, retry_after=None):
+    response = mock.Mock()
+    response.status_code = status_code
+    response.headers = {'Retry-After': retry_after} if retry_after else {}
+    return recovery.PageRequestError(f'failed {status_code}', 'endpoint', response)
+
+
+class TestPageRecovery(unittest.TestCase):
+
+    def setUp(self):
+        sleep_patcher = mock.patch('hubspot_api.recovery.time.sleep')
+        self.sleep = sleep_patcher.start()
+        self.addCleanup(sleep_patcher.stop)
+
+    def test_retries_until_success_honoring_retry_after(self):
+        request = mock.Mock(side_effect=[_error(429, '7'), ConnectionError('reset'), 'response'])
+        page_recovery = recovery.PageRecovery(max_page_attempts=3)
+        self.assertEqual(page_recovery.run('endpoint', {}, request), 'response')
+        self.assertEqual(self.sleep.call_args_list[0], mock.call(7.0))
+        self.assertEqual(page_recovery.stats()['retries'], {'endpoint': 2})
+
+    def test_client_error_not_retried(self):
+        request = mock.Mock(side_effect=_error(400))
+        with self.assertRaises(recovery.PageRequestError):
+            recovery.PageRecovery().run('endpoint', {}, request)
+        self.assertEqual(request.call_count, 1)
+
+    def test_quarantine_after_budget_exhausted(self):
+        request = mock.Mock(side_effect=_error(500))
+        page_recovery = recovery.PageRecovery(max_page_attempts=5, endpoint_retry_budget=1, quarantine=True)
+        with self.assertRaises(recovery.PageQuarantined):
+            page_recovery.run('endpoint', {'offset': 10}, request)
+        self.assertEqual(request.call_count, 2)
+        self.assertEqual(page_recovery.failed_pages[0]['parameters'], '{"offset": 10}')
+        self.assertEqual(page_recovery.failed_pages[0]['status_code'], 500)
+        self.assertEqual(page_recovery.quarantined_pages(['endpoint', 'other']), 1)
+        self.assertEqual(page_recovery.quarantined_pages(['other']), 0)
+
+    def test_stop_on_quarantine(self):
+        @recovery.stop_on_quarantine
+        def pages():
+            yield 1
+            raise recovery.PageQuarantined('quarantined')
+
+        self.assertEqual(list(pages()), [1])
+
+    def test_parse_retry_after(self):
+        self.assertEqual(recovery.parse_retry_after('3'), 3.0)
+        self.assertEqual(recovery.parse_retry_after('Wed, 21 Oct 2015 07:28:00 GMT'), 0.0)
+        self.assertIsNone(recovery.parse_retry_after('invalid'))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,39 @@
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+import reference_cache
+
+
+class TestReferenceCache(unittest.TestCase):
+
+    def test_unchanged_payload_detected(self):
+        hashes = {}
+        cache = reference_cache.ReferenceCache(hashes)
+        self.assertTrue(cache.update('owners', [{'ownerId': 1, 'email': 'a@b.com'}]))
+        # key order does not matter
+        self.assertFalse(cache.update('owners', [{'email': 'a@b.com', 'ownerId': 1}]))
+        self.assertTrue(cache.update('owners', [{'ownerId': 1, 'email': 'c@b.com'}]))
+        self.assertEqual(list(hashes), ['owners'])
+
+    def test_shared_payload_reused_until_expired(self):
+        with tempfile.TemporaryDirectory() as shared_dir:
+            writer = reference_cache.ReferenceCache({}, shared_dir=shared_dir, portal_id='123')
+            self.assertIsNone(writer.load_shared('pipelines'))
+            writer.store_shared('pipelines', [{'pipelineId': 'default'}])
+            self.assertEqual(os.listdir(os.path.join(shared_dir, '123')), ['pipelines.json.gz'])
+
+            reader = reference_cache.ReferenceCache({}, shared_dir=shared_dir, portal_id='123', max_age_s=60)
+            self.assertEqual(reader.load_shared('pipelines'), [{'pipelineId': 'default'}])
+            other_portal = reference_cache.ReferenceCache({}, shared_dir=shared_dir, portal_id='456')
+            self.assertIsNone(other_portal.load_shared('pipelines'))
+
+            expired = reference_cache.ReferenceCache({}, shared_dir=shared_dir, portal_id='123', max_age_s=60)
+            with mock.patch('time.time', return_value=time.time() + 120):
+                self.assertIsNone(expired.load_shared('pipelines'))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,43 @@
+import csv
+import os
+import tempfile
+import unittest
+
+import row_writer
+
+
+class TestSchemaRowWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, 'calls.csv')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def _read(self):
+        with open(self.path, encoding='utf-8', newline='') as inp:
+            return list(csv.reader(inp))
+
+    def test_rows_mapped_to_header_and_padded_after_growth(self):
+        writer = row_writer.SchemaRowWriter(self.path, ['id', 'hs_timestamp'])
+        row = {'id': '1', 'archived': False, 'properties': {'hs_timestamp': 't1'}}
+        writer.writerow(row)
+        writer.writerow({'id': '2', 'properties': {'hs_call_body': 'a,b'}})
+        writer.close()
+
+        self.assertEqual(writer.columns, ['id', 'hs_timestamp', 'archived', 'hs_call_body'])
+        self.assertEqual(self._read(), [['1', 't1', 'False', ''], ['2', '', '', 'a,b']])
+        self.assertIn('properties', row)
+        self.assertEqual(os.listdir(self.tmp_dir.name), ['calls.csv'])
+
+    def test_no_file_without_rows(self):
+        writer = row_writer.SchemaRowWriter(self.path, ['id'])
+        writer.close()
+
+        self.assertEqual(writer.rows, 0)
+        self.assertFalse(os.path.exists(self.path))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,76 @@
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from hubspot_api.transport import HttpTransport, RateLimiter, SharedTransportClient
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        body = (self.headers.get('Authorization') or '').encode()
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestSharedTransport(unittest.TestCase):
+
+    def setUp(self):
+        self.server = HTTPServer(('127.0.0.1', 0), _Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.base_url = f'http://127.0.0.1:{self.server.server_port}/'
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_clients_share_pooled_connection(self):
+        transport = HttpTransport(pool_size=2)
+        client_a = SharedTransportClient(self.base_url, transport=transport, auth_header={'Authorization': 'a'})
+        client_b = SharedTransportClient(self.base_url, transport=transport, auth_header={'Authorization': 'b'})
+
+        self.assertEqual(client_a.get_raw('x').text, 'a')
+        self.assertEqual(client_b.get_raw('y').text, 'b')
+        self.assertEqual(client_a.get_raw('z', ignore_auth=True).text, '')
+
+        stats = transport.stats()
+        self.assertEqual(stats['requests'], 3)
+        self.assertEqual(stats['new_connections'], 1)
+        self.assertEqual(stats['reused_connections'], 2)
+        transport.close()
+
+    def test_requests_counted_across_threads(self):
+        transport = HttpTransport(pool_size=4)
+        transport.session.request = lambda *args, **kwargs: None
+        threads = [threading.Thread(target=lambda: [transport.request('GET', self.base_url) for _ in range(500)])
+                   for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(transport.stats()['requests'], 4000)
+        transport.close()
+
+
+class TestRateLimiter(unittest.TestCase):
+
+    def test_requests_spaced_by_interval(self):
+        limiter = RateLimiter(requests_per_second=50)
+        start = time.monotonic()
+        for _ in range(6):
+            limiter.acquire()
+        # the first request is sent immediately
+        self.assertGreaterEqual(time.monotonic() - start, 5 * 0.02 - 0.005)
+        self.assertGreater(limiter.waited_s, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
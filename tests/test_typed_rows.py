@@ -0,0 +1,40 @@
+import csv
+import os
+import tempfile
+import unittest
+
+import typed_rows
+
+
+class TestTypedRowBuffer(unittest.TestCase):
+
+    def test_rows_formatted_at_write(self):
+        buffer = typed_rows.TypedRowBuffer(['dealId', 'source', 'timestamp', 'sourceVid'],
+                                           {'dealId': typed_rows.INT, 'source': typed_rows.ENUM,
+                                            'timestamp': typed_rows.INT})
+        buffer.append([1, 'CRM_UI', 1600000000000, []])
+        buffer.append_dict({'dealId': '2', 'source': 'CRM_UI', 'sourceVid': [3]})
+        # non integer values switch the column to text
+        buffer.append(['x-3', None, 1600000000001, None])
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'stage_history.csv')
+            written = buffer.write(path)
+            with open(path, encoding='utf-8', newline='') as inp:
+                rows = list(csv.reader(inp))
+
+        self.assertEqual(written, 3)
+        self.assertEqual(rows, [['1', 'CRM_UI', '1600000000000', '[]'],
+                                ['2', 'CRM_UI', '', '[3]'],
+                                ['x-3', '', '1600000000001', '']])
+        self.assertEqual(len(buffer), 0)
+
+    def test_normalize(self):
+        self.assertEqual(typed_rows.normalize('123', typed_rows.INT), 123)
+        self.assertEqual(typed_rows.normalize(True, typed_rows.INT), 'True')
+        self.assertEqual(typed_rows.normalize(None, typed_rows.INT), '')
+        self.assertEqual(typed_rows.normalize(['a'], typed_rows.ENUM), "['a']")
+
+
+if __name__ == "__main__":
+    unittest.main()